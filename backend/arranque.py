@@ -0,0 +1,86 @@
+# arranque.py
+
+"""
+Ciclo de Vida del Servidor.
+
+Al importar main.py no se conecta a nada: la inicialización se hace en el
+arranque de cada worker (lifespan), en un hilo para no retrasar la escucha:
+    1. Crear las tablas (solo si settings.INIT_DB_AL_ARRANCAR; server.py lo hace antes).
+    2. Abrir el almacén clave-valor y cargar el índice de provincias.
+    3. Precalcular el ranking general para que la primera petición ya lo tenga en caché.
+Mientras tanto /salud/listo responde 503; cuando termina pasa a 200. Si falla (p.ej.
+la base de datos aún no acepta conexiones) se reintenta con espera exponencial hasta
+settings.ARRANQUE_REINTENTO_MAX segundos entre intentos, sin dejar nunca de intentarlo.
+Con varios workers también publica periódicamente sus métricas (middlewares/metricas.py).
+"""
+import time
+import logging
+from contextlib import asynccontextmanager
+from typing import Optional
+import anyio
+from fastapi import FastAPI
+from config import settings
+
+logger = logging.getLogger("moveon.arranque")
+
+class _Estado:
+    def __init__(self):
+        self.listo = False
+        self.error: Optional[str] = None
+        self.duracion: Optional[float] = None
+
+estado = _Estado()
+
+def calentar():
+    """Inicialización y precarga de cachés (bloqueante)."""
+    import database
+    from services import province_service, user_service
+    from utils.kv_store import obtener_almacen
+
+    if settings.INIT_DB_AL_ARRANCAR:
+        database.init_db()
+    obtener_almacen()
+    if province_service.obtener_indice(reintentar=True) is None and settings.PROVINCIAS_OBLIGATORIAS:
+        raise RuntimeError(f"Faltan los límites de provincias ({settings.PROVINCIAS_GEOJSON})")
+
+    db = database.SessionLocal()
+    try:
+        user_service.obtener_ranking(db, None)
+    finally:
+        db.close()
+
+async def _calentar_en_segundo_plano():
+    inicio = time.perf_counter()
+    espera = settings.ARRANQUE_REINTENTO_INICIAL
+    intento = 1
+    while True:
+        try:
+            await anyio.to_thread.run_sync(calentar)
+            break
+        except Exception as e:
+            # El worker sigue sin estar listo: el balanceador no le enviará tráfico hasta que lo consiga.
+            estado.error = str(e)
+            logger.exception("Fallo al iniciar el servidor (intento %d, nuevo intento en %.0f s)", intento, espera)
+        await anyio.sleep(espera)
+        espera = min(espera * 2, settings.ARRANQUE_REINTENTO_MAX)
+        intento += 1
+    estado.error = None
+    estado.duracion = round(time.perf_counter() - inicio, 3)
+    estado.listo = True
+
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    from utils import procesos, registro
+    from middlewares.metricas import volcar_periodicamente
+
+    registro.iniciar()
+    async with anyio.create_task_group() as tareas:
+        tareas.start_soon(_calentar_en_segundo_plano)
+        tareas.start_soon(volcar_periodicamente)
+        try:
+            yield
+        finally:
+            tareas.cancel_scope.cancel()
+            # Detener el pool de procesos de renderizado al apagar el servidor.
+            procesos.cerrar_pool()
+            registro.detener()
@@ -14,6 +14,7 @@ from fastapi import HTTPException, Header, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Any
 from config import settings
+from utils import carga, registro
 
 # Parámetros de configuración del sistema de tokens,
 SECRET_KEY = settings.SECRET_KEY
@@ -28,11 +29,13 @@ security_scheme = HTTPBearer()
 def encriptar_contraseña(contraseña: str) -> str:
     """Cifra una contraseña de texto plano usando bcrypt."""
     salt = bcrypt.gensalt()
-    return bcrypt.hashpw(contraseña.encode('utf-8'), salt).decode('utf-8')
+    with carga.operacion_bcrypt():
+        return bcrypt.hashpw(contraseña.encode('utf-8'), salt).decode('utf-8')
 
 def comprobar_contraseña(contraseña_plana: str, contraseña_encriptada: str) -> bool:
     """Compara una contraseña plana ingresada con el hash almacenado en la base de datos."""
-    return bcrypt.checkpw(contraseña_plana.encode('utf-8'), contraseña_encriptada.encode('utf-8'))
+    with carga.operacion_bcrypt():
+        return bcrypt.checkpw(contraseña_plana.encode('utf-8'), contraseña_encriptada.encode('utf-8'))
 
 def crear_token_aplicacion() -> str:
     """Genera un token JWT de corta duración (5 minutos) para el apretón de manos inicial."""
@@ -73,7 +76,9 @@ def obtener_usuario_actual(res: HTTPAuthorizationCredentials = Depends(security_
         
         if usuario_id is None or not isinstance(usuario_id, str):
             raise HTTPException(status_code=401, detail="Error: Token no contiene un usuario válido")
-            
+
+        # Usuario de la petición en los logs de acceso.
+        registro.anotar_usuario(usuario_id)
         return usuario_id
     except JWTError:
         raise HTTPException(status_code=401, detail="Error: Token de acceso inválido o expirado")
\ No newline at end of file
@@ -0,0 +1,65 @@
+# benchmarks/bench_arranque.py
+
+"""
+Tiempo de importación de main.py (arranque en frío de un worker).
+
+Lanza 'python -X importtime -c "import main"' en procesos nuevos y resume la salida:
+tiempo total y los módulos más lentos (acumulado con sus dependencias y propio).
+No conecta con la base de datos (la inicialización va en el lifespan), solo necesita
+el .env habitual. Ejecutar desde la carpeta backend:
+    python -m benchmarks.bench_arranque [--top 25]
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+REPETICIONES = 5
+
+def medir() -> tuple[float, list[tuple[str, int, int]]]:
+    """Tiempo real del proceso y filas (modulo, propio_us, acumulado_us) de -X importtime."""
+    inicio = time.perf_counter()
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        capture_output=True, text=True, env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    )
+    duracion = time.perf_counter() - inicio
+    if proceso.returncode != 0:
+        raise SystemExit(proceso.stderr[-2000:])
+
+    filas = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "self [us]" in linea:
+            continue
+        propio, acumulado, modulo = linea.removeprefix("import time:").split("|")
+        filas.append((modulo.rstrip(), int(propio), int(acumulado)))
+    return duracion, filas
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=20)
+    argumentos = parser.parse_args()
+
+    # La primera ejecución compila los .pyc; no cuenta.
+    medir()
+    duraciones, totales = [], []
+    for _ in range(REPETICIONES):
+        duracion, filas = medir()
+        duraciones.append(duracion)
+        totales.append(sum(propio for _, propio, _ in filas))
+
+    print(f"Proceso completo (mediana de {REPETICIONES}): {statistics.median(duraciones) * 1000:.0f} ms")
+    print(f"Importaciones: {statistics.median(totales) / 1000:.0f} ms en {len(filas)} módulos\n")
+
+    print(f"{'acumulado ms':>12} {'propio ms':>10}  módulo")
+    for modulo, propio, acumulado in sorted(filas, key=lambda f: f[2], reverse=True)[:argumentos.top]:
+        print(f"{acumulado / 1000:12.1f} {propio / 1000:10.1f}  {modulo}")
+
+    print(f"\n{'propio ms':>10}  módulo (más lentos por sí mismos)")
+    for modulo, propio, _ in sorted(filas, key=lambda f: f[1], reverse=True)[:argumentos.top]:
+        print(f"{propio / 1000:10.1f}  {modulo.strip()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+# benchmarks/bench_carga.py
+
+"""
+Prueba de carga de extremo a extremo contra la API real.
+
+Cada usuario virtual (un hilo con su conexión keep-alive) hace el recorrido de la App:
+handshake -> login -> guardar actividad -> obtener_todas -> ranking -> buscar,
+o elige las operaciones al azar según una mezcla con pesos. Al terminar muestra por
+endpoint las peticiones, los errores, p50/p95/p99 y el rendimiento, y guarda el
+resultado en JSON para comparar antes y después de cada cambio.
+
+Sin --url lanza server.py en un puerto libre con la base de datos del .env (y los
+límites de peticiones desactivados: el limitador cortaría la prueba). Los usuarios
+de prueba se crean en cada ejecución (carga<id><n>). Ejecutar desde la carpeta backend:
+    python -m benchmarks.bench_carga [--usuarios 20] [--duracion 30] [--mezcla app]
+        [--workers 1] [--url http://127.0.0.1:8000] [--comparar resultados/anterior.json]
+
+Mezclas: "flujo" (el recorrido completo en orden), "app", "lectura", "escritura" o
+pesos a medida: --mezcla guardar=1,obtener_todas=4,ranking=2,buscar=2,login=1
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Optional
+from urllib.parse import urlsplit, quote
+from config import settings
+
+MEZCLAS = {
+    "flujo": None,
+    "app": {"obtener_todas": 4, "ranking": 3, "buscar": 2, "guardar": 1},
+    "lectura": {"obtener_todas": 5, "ranking": 4, "buscar": 3},
+    "escritura": {"guardar": 4, "obtener_todas": 1},
+}
+FLUJO = ("handshake", "login", "guardar", "obtener_todas", "ranking", "buscar")
+CONTRASEÑA = "Carga12345"
+# El token de sesión de la App caduca a los 5 minutos.
+RENOVAR_SESION = 240
+ACTIVIDADES_INICIALES = 20
+
+def codificar_polilinea(puntos: list[tuple[float, float]]) -> str:
+    """Polilínea codificada de Google (precisión 5)."""
+    resultado, lat_anterior, lon_anterior = [], 0, 0
+    for lat, lon in puntos:
+        lat_e5, lon_e5 = round(lat * 1e5), round(lon * 1e5)
+        for valor in (lat_e5 - lat_anterior, lon_e5 - lon_anterior):
+            valor = ~(valor << 1) if valor < 0 else valor << 1
+            while valor >= 0x20:
+                resultado.append(chr((0x20 | (valor & 0x1F)) + 63))
+                valor >>= 5
+            resultado.append(chr(valor + 63))
+        lat_anterior, lon_anterior = lat_e5, lon_e5
+    return "".join(resultado)
+
+def ruta_aleatoria(generador: random.Random) -> str:
+    """Ruta de ~200 puntos (unos 5 km) por el centro de Madrid."""
+    lat, lon = 40.4168 + generador.uniform(-0.02, 0.02), -3.7038 + generador.uniform(-0.02, 0.02)
+    puntos = []
+    for _ in range(200):
+        lat += generador.uniform(-0.0002, 0.0003)
+        lon += generador.uniform(-0.0002, 0.0003)
+        puntos.append((lat, lon))
+    return codificar_polilinea(puntos)
+
+def percentil(ordenados: list[float], p: float) -> float:
+    """Percentil por rango más cercano de una lista ordenada."""
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, round(p / 100 * len(ordenados) + 0.5) - 1))
+    return ordenados[indice]
+
+class Cliente:
+    """Conexión HTTP keep-alive de un usuario virtual; se reconecta si el servidor la cierra."""
+
+    def __init__(self, url: str):
+        partes = urlsplit(url)
+        self.host, self.puerto = partes.hostname, partes.port or 80
+        self.conexion: Optional[http.client.HTTPConnection] = None
+        self.cabeceras = {"Accept-Encoding": "gzip"}
+
+    def peticion(self, metodo: str, ruta: str, cuerpo: Optional[dict] = None) -> tuple[int, bytes]:
+        cabeceras = dict(self.cabeceras)
+        datos = None
+        if cuerpo is not None:
+            datos = json.dumps(cuerpo).encode()
+            cabeceras["Content-Type"] = "application/json"
+        for intento in range(2):
+            if self.conexion is None:
+                self.conexion = http.client.HTTPConnection(self.host, self.puerto, timeout=30)
+            try:
+                self.conexion.request(metodo, ruta, body=datos, headers=cabeceras)
+                respuesta = self.conexion.getresponse()
+                return respuesta.status, respuesta.read()
+            except (http.client.HTTPException, OSError):
+                self.conexion.close()
+                self.conexion = None
+                if intento == 1:
+                    raise
+
+class Resultados:
+    """Latencias (s) y códigos de estado por operación, compartidos por todos los hilos."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencias: dict[str, list[float]] = {}
+        self.estados: dict[str, Counter] = {}
+
+    def registrar(self, operacion: str, latencia: float, estado: int):
+        with self.lock:
+            self.latencias.setdefault(operacion, []).append(latencia)
+            self.estados.setdefault(operacion, Counter())[str(estado)] += 1
+
+    def resumen(self, duracion: float) -> dict:
+        endpoints = {}
+        with self.lock:
+            for operacion, latencias in sorted(self.latencias.items()):
+                ordenadas = sorted(latencias)
+                estados = self.estados[operacion]
+                endpoints[operacion] = {
+                    "peticiones": len(ordenadas),
+                    "errores": sum(n for estado, n in estados.items() if not estado.startswith("2")),
+                    "estados": dict(estados),
+                    "rps": round(len(ordenadas) / duracion, 2),
+                    "media_ms": round(sum(ordenadas) / len(ordenadas) * 1000, 2),
+                    "p50_ms": round(percentil(ordenadas, 50) * 1000, 2),
+                    "p95_ms": round(percentil(ordenadas, 95) * 1000, 2),
+                    "p99_ms": round(percentil(ordenadas, 99) * 1000, 2),
+                    "max_ms": round(ordenadas[-1] * 1000, 2),
+                }
+        total = sum(datos["peticiones"] for datos in endpoints.values())
+        return {
+            "peticiones": total,
+            "errores": sum(datos["errores"] for datos in endpoints.values()),
+            "rps": round(total / duracion, 2),
+            "endpoints": endpoints,
+        }
+
+class UsuarioVirtual:
+    """Un usuario de la App con su cuenta, su sesión y su conexión."""
+
+    def __init__(self, url: str, nombre: str, semilla: int):
+        self.cliente = Cliente(url)
+        self.nombre = nombre
+        self.aleatorio = random.Random(semilla)
+        self.sesion_renovada = 0.0
+
+    def _exigir(self, operacion: str, estado: int, cuerpo: bytes):
+        if estado >= 300:
+            raise RuntimeError(f"{operacion} respondió {estado}: {cuerpo[:200]!r}")
+
+    # Operaciones: devuelven el código de estado de la respuesta.
+
+    def handshake(self) -> int:
+        self.cliente.cabeceras.pop("X-App-Session", None)
+        self.cliente.cabeceras["X-App-Id"] = settings.APP_ID_SECRET
+        estado, cuerpo = self.cliente.peticion("GET", "/handshake")
+        if estado == 200:
+            self.cliente.cabeceras["X-App-Session"] = json.loads(cuerpo)["app_session_token"]
+            self.sesion_renovada = time.monotonic()
+        return estado
+
+    def login(self) -> int:
+        estado, cuerpo = self.cliente.peticion(
+            "POST", "/login", {"identificador": self.nombre, "contraseña": CONTRASEÑA}
+        )
+        if estado == 200:
+            self.cliente.cabeceras["Authorization"] = f"Bearer {json.loads(cuerpo)['token_acceso']}"
+        return estado
+
+    def guardar(self) -> int:
+        distancia = self.aleatorio.uniform(2000, 15000)
+        estado, _ = self.cliente.peticion("POST", "/actividad/guardar", {
+            "tipo": self.aleatorio.choice(("Correr", "Caminar")),
+            "distancia": round(distancia, 1),
+            "duracion": int(distancia / 3),
+            "calorias_quemadas": int(distancia / 15),
+            "ruta_polilinea": ruta_aleatoria(self.aleatorio),
+            "fecha_ruta": (datetime.now() - timedelta(minutes=self.aleatorio.randint(5, 60 * 24 * 90))).isoformat(),
+        })
+        return estado
+
+    def obtener_todas(self) -> int:
+        return self.cliente.peticion("GET", "/actividad/obtener_todas?skip=0&limit=20")[0]
+
+    def ranking(self) -> int:
+        return self.cliente.peticion("GET", "/ranking/obtener")[0]
+
+    def buscar(self) -> int:
+        termino = self.aleatorio.choice(("carga", "car", "usuario", self.nombre[:6]))
+        return self.cliente.peticion("GET", f"/perfil/buscar?q={quote(termino)}")[0]
+
+    def preparar(self):
+        """Crea la cuenta y unas actividades para que los listados no estén vacíos (no se mide)."""
+        self._exigir("handshake", self.handshake(), b"")
+        estado, cuerpo = self.cliente.peticion("POST", "/registro", {
+            "nombre_usuario": self.nombre,
+            "email": f"{self.nombre}@carga.moveon.es",
+            "contraseña": CONTRASEÑA,
+            "fecha_nacimiento": "1990-01-01",
+            "provincia": "Madrid",
+        })
+        self._exigir("registro", estado, cuerpo)
+        self._exigir("login", self.login(), b"")
+        for _ in range(ACTIVIDADES_INICIALES):
+            self._exigir("guardar", self.guardar(), b"")
+
+    def ejecutar(self, mezcla: Optional[dict], fin: float, inicio_medida: float, resultados: Resultados):
+        """Repite el flujo o las operaciones de la mezcla hasta 'fin'."""
+        if mezcla:
+            operaciones, pesos = list(mezcla), list(mezcla.values())
+        while time.monotonic() < fin:
+            if mezcla is None:
+                secuencia = FLUJO
+            else:
+                if time.monotonic() - self.sesion_renovada > RENOVAR_SESION:
+                    self.handshake()
+                secuencia = self.aleatorio.choices(operaciones, pesos)
+            for operacion in secuencia:
+                inicio = time.monotonic()
+                try:
+                    estado = getattr(self, operacion)()
+                except (http.client.HTTPException, OSError):
+                    estado = 0
+                final = time.monotonic()
+                if inicio >= inicio_medida and final <= fin:
+                    resultados.registrar(operacion, final - inicio, estado)
+
+def leer_mezcla(texto: str) -> Optional[dict]:
+    if texto in MEZCLAS:
+        return MEZCLAS[texto]
+    mezcla = {}
+    for parte in texto.split(","):
+        operacion, _, peso = parte.partition("=")
+        if operacion not in FLUJO or not hasattr(UsuarioVirtual, operacion):
+            raise SystemExit(f"Operación desconocida en la mezcla: {operacion} (válidas: {', '.join(FLUJO)})")
+        mezcla[operacion] = float(peso or 1)
+    return mezcla
+
+def puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def lanzar_servidor(workers: int) -> tuple[subprocess.Popen, str]:
+    """server.py en un puerto libre, con los límites de peticiones desactivados."""
+    puerto = puerto_libre()
+    sin_limite = "1000000/second"
+    entorno = {
+        **os.environ,
+        "LIMITE_LOGIN": sin_limite, "LIMITE_REGISTRO": sin_limite,
+        "LIMITE_RECUPERACION": sin_limite, "LIMITE_BUSQUEDA": sin_limite,
+    }
+    proceso = subprocess.Popen(
+        [sys.executable, "server.py", "--host", "127.0.0.1", "--port", str(puerto), "--workers", str(workers)],
+        env=entorno, stdout=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{puerto}"
+    limite = time.monotonic() + 120
+    while time.monotonic() < limite:
+        if proceso.poll() is not None:
+            raise SystemExit(f"server.py terminó al arrancar (código {proceso.returncode})")
+        try:
+            if Cliente(url).peticion("GET", "/salud/listo")[0] == 200:
+                return proceso, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    proceso.terminate()
+    raise SystemExit("server.py no está listo tras 120 s")
+
+def commit_actual() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def imprimir(resumen: dict, configuracion: dict, anterior: Optional[dict]):
+    print(f"\n{'operación':<14}{'n':>8}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'máx ms':>9}")
+    for operacion, datos in resumen["endpoints"].items():
+        print(
+            f"{operacion:<14}{datos['peticiones']:>8}{datos['errores']:>6}{datos['rps']:>9.1f}"
+            f"{datos['p50_ms']:>9.1f}{datos['p95_ms']:>9.1f}{datos['p99_ms']:>9.1f}{datos['max_ms']:>9.1f}"
+        )
+    print(f"{'total':<14}{resumen['peticiones']:>8}{resumen['errores']:>6}{resumen['rps']:>9.1f}")
+    errores = {
+        operacion: datos["estados"] for operacion, datos in resumen["endpoints"].items() if datos["errores"]
+    }
+    if errores:
+        print(f"\nCódigos de estado de las operaciones con errores (0 = sin respuesta): {errores}")
+
+    if anterior is None:
+        return
+    def cambio(actual: float, previo: float) -> str:
+        return f"{(actual - previo) / previo * 100:+.1f}%" if previo else "-"
+    print(f"\nComparado con {anterior.get('commit') or '?'} ({anterior.get('fecha', '?')}):")
+    if anterior.get("configuracion") != configuracion:
+        print(f"Aviso: la configuración es distinta ({anterior.get('configuracion')})")
+    print(f"{'operación':<14}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for operacion, datos in resumen["endpoints"].items():
+        previo = anterior["resultados"]["endpoints"].get(operacion)
+        if previo is None:
+            continue
+        print(
+            f"{operacion:<14}{cambio(datos['rps'], previo['rps']):>9}{cambio(datos['p50_ms'], previo['p50_ms']):>9}"
+            f"{cambio(datos['p95_ms'], previo['p95_ms']):>9}{cambio(datos['p99_ms'], previo['p99_ms']):>9}"
+        )
+    print(f"{'total':<14}{cambio(resumen['rps'], anterior['resultados']['rps']):>9}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="Servidor ya lanzado (por defecto se lanza server.py)")
+    parser.add_argument("--workers", type=int, default=1, help="Workers de server.py si se lanza")
+    parser.add_argument("--usuarios", type=int, default=20, help="Usuarios virtuales concurrentes")
+    parser.add_argument("--duracion", type=float, default=30, help="Segundos medidos")
+    parser.add_argument("--calentamiento", type=float, default=5, help="Segundos iniciales sin medir")
+    parser.add_argument("--mezcla", default="flujo")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--salida", help="Archivo JSON (por defecto benchmarks/resultados/carga-<fecha>.json)")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior")
+    argumentos = parser.parse_args()
+
+    mezcla = leer_mezcla(argumentos.mezcla)
+    anterior = None
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding="utf-8") as archivo:
+            anterior = json.load(archivo)
+
+    proceso, url = None, argumentos.url
+    if url is None:
+        proceso, url = lanzar_servidor(argumentos.workers)
+    else:
+        print("Aviso: con --url el servidor debe tener los límites de peticiones (LIMITE_*) altos.")
+    try:
+        ejecucion = uuid.uuid4().hex[:6]
+        usuarios = [
+            UsuarioVirtual(url, f"carga{ejecucion}{n}", argumentos.semilla * 100_000 + n)
+            for n in range(argumentos.usuarios)
+        ]
+        print(f"Preparando {len(usuarios)} usuarios en {url}...")
+        fallos = []
+
+        def preparar(usuario: UsuarioVirtual):
+            try:
+                usuario.preparar()
+            except Exception as e:
+                fallos.append(f"{usuario.nombre}: {e}")
+
+        preparacion = [threading.Thread(target=preparar, args=(usuario,)) for usuario in usuarios]
+        for hilo in preparacion:
+            hilo.start()
+        for hilo in preparacion:
+            hilo.join()
+        if fallos:
+            raise SystemExit("No se han podido preparar los usuarios:\n" + "\n".join(fallos[:5]))
+
+        resultados = Resultados()
+        inicio_medida = time.monotonic() + argumentos.calentamiento
+        fin = inicio_medida + argumentos.duracion
+        print(f"Carga: mezcla '{argumentos.mezcla}', {argumentos.calentamiento:g} s de calentamiento y {argumentos.duracion:g} s medidos...")
+        hilos = [
+            threading.Thread(target=usuario.ejecutar, args=(mezcla, fin, inicio_medida, resultados))
+            for usuario in usuarios
+        ]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait(timeout=60)
+
+    resumen = resultados.resumen(argumentos.duracion)
+    configuracion = {
+        "url": argumentos.url or f"server.py --workers {argumentos.workers}",
+        "usuarios": argumentos.usuarios,
+        "duracion": argumentos.duracion,
+        "calentamiento": argumentos.calentamiento,
+        "mezcla": argumentos.mezcla if mezcla is None or argumentos.mezcla in MEZCLAS else mezcla,
+        "semilla": argumentos.semilla,
+    }
+    imprimir(resumen, configuracion, anterior)
+
+    salida = argumentos.salida or os.path.join(
+        "benchmarks", "resultados", f"carga-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(salida) or ".", exist_ok=True)
+    with open(salida, "w", encoding="utf-8") as archivo:
+        json.dump({
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "commit": commit_actual(),
+            "configuracion": configuracion,
+            "resultados": resumen,
+        }, archivo, ensure_ascii=False, indent=2)
+    print(f"\nResultados guardados en {salida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# benchmarks/bench_serializacion.py
+
+"""
+Comparativa de la serialización de /actividad/obtener_todas.
+
+    - actual: objetos del ORM + validación con response_model + json de la librería estándar
+      (lo que hacía FastAPI antes de utils/respuestas.py).
+    - rápida: filas de Core como diccionarios + orjson (obtener_actividades actual).
+
+Usa una base de datos SQLite en memoria con los modelos de database.py, así que solo
+necesita el .env habitual. Ejecutar desde la carpeta backend:
+    python -m benchmarks.bench_serializacion
+"""
+import json
+import time
+from datetime import datetime, timedelta
+from typing import List
+from pydantic import TypeAdapter
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+import database
+import schemas
+from services import activities_service
+from utils import respuestas
+
+TAMANOS = (20, 100, 1000)
+REPETICIONES = 50
+# Polilínea de ~200 puntos, tamaño habitual de una ruta de 5 km.
+POLILINEA = "_p~iF~ps|U_ulLnnqC_mqNvxq`@" * 50
+
+def preparar_bd(num_actividades: int):
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    database.Base.metadata.create_all(engine)
+    Sesion = sessionmaker(bind=engine)
+    db = Sesion()
+    usuario = database.Usuario(
+        nombre_usuario="benchmark", email="benchmark@moveon.es", contraseña_encriptada="x",
+        fecha_nacimiento=datetime(1990, 1, 1).date()
+    )
+    db.add(usuario)
+    db.flush()
+    inicio = datetime(2025, 1, 1, 8, 0, 0)
+    db.add_all([
+        database.Actividad(
+            usuario_id=usuario.id, tipo="Correr", distancia=5000.0 + i, duracion=1500 + i,
+            calorias_quemadas=300, ruta_polilinea=POLILINEA, ruta_mapa_url=f"rutas/ruta_{i}.png",
+            fecha_ruta=inicio + timedelta(hours=i)
+        )
+        for i in range(num_actividades)
+    ])
+    db.commit()
+    return db
+
+ADAPTADOR = TypeAdapter(List[schemas.RespuestaObtenerActividad])
+
+def camino_actual(db, limite: int) -> bytes:
+    usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == "benchmark").first()
+    actividades = db.query(database.Actividad)\
+        .filter(database.Actividad.usuario_id == usuario.id)\
+        .order_by(database.Actividad.fecha_ruta.desc(), database.Actividad.id.desc())\
+        .limit(limite)\
+        .all()
+    lista = []
+    for actividad in actividades:
+        datos = schemas.RespuestaObtenerActividad.model_validate(actividad).model_dump()
+        datos["ruta_mapa_url"] = f"http://127.0.0.1:8000/imagenes/{actividad.ruta_mapa_url}"
+        lista.append(datos)
+    # Validación del response_model y JSONResponse de FastAPI.
+    contenido = jsonable_encoder(ADAPTADOR.validate_python(lista))
+    return json.dumps(contenido, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+def camino_rapido(db, limite: int) -> bytes:
+    actividades = activities_service.obtener_actividades(db, "benchmark", 0, limite)
+    for actividad in actividades:
+        actividad["ruta_mapa_url"] = f"http://127.0.0.1:8000/imagenes/{actividad['ruta_mapa_url']}"
+    return respuestas.serializar(actividades)
+
+def medir(funcion, db, limite: int) -> float:
+    """Mediana en milisegundos."""
+    tiempos = []
+    for _ in range(REPETICIONES):
+        db.expunge_all()
+        inicio = time.perf_counter()
+        funcion(db, limite)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    return tiempos[len(tiempos) // 2]
+
+def main():
+    db = preparar_bd(max(TAMANOS))
+    print(f"{'elementos':>10} {'actual (ms)':>12} {'rápida (ms)':>12} {'mejora':>8}")
+    for limite in TAMANOS:
+        # Las dos respuestas deben ser idénticas.
+        assert json.loads(camino_actual(db, limite)) == json.loads(camino_rapido(db, limite))
+        actual = medir(camino_actual, db, limite)
+        rapida = medir(camino_rapido, db, limite)
+        print(f"{limite:>10} {actual:>12.2f} {rapida:>12.2f} {actual / rapida:>7.1f}x")
+    db.close()
+
+if __name__ == "__main__":
+    main()
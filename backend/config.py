@@ -9,6 +9,20 @@ class Settings(BaseSettings):
     DB_HOST: str
     DB_PORT: int
     DB_NAME: str
+    # Conexiones máximas de toda la App (se reparten entre los workers) y espera máxima por una (s)
+    DB_CONEXIONES_MAX: int = 15
+    DB_POOL_TIMEOUT: float = 10.0
+    # Crear las tablas al arrancar cada worker (server.py lo hace una sola vez antes de lanzar los workers)
+    INIT_DB_AL_ARRANCAR: bool = True
+    # Si la inicialización del worker falla, se reintenta con espera exponencial (segundos)
+    ARRANQUE_REINTENTO_INICIAL: float = 1.0
+    ARRANQUE_REINTENTO_MAX: float = 60.0
+
+    # Servidor multiproceso (server.py): workers (0 = uno por núcleo), peticiones antes de
+    # reciclar un worker (0 = nunca) y segundos para terminar las peticiones en curso al apagar
+    WORKERS: int = 1
+    MAX_PETICIONES_WORKER: int = 10000
+    APAGADO_GRACIOSO: int = 20
 
     # Seguridad App
     APP_ID_SECRET: str
@@ -27,12 +41,99 @@ class Settings(BaseSettings):
     CLOUDINARY_API_KEY: str = ""
     CLOUDINARY_API_SECRET: str = ""
 
+    # Llamadas al almacenamiento en la nube (hilos simultáneos, segundos por intento y reintentos)
+    STORAGE_MAX_CONCURRENCIA: int = 4
+    STORAGE_TIMEOUT: float = 30.0
+    STORAGE_REINTENTOS: int = 2
+
     # Email
     EMAIL_HOST: str
     EMAIL_PORT: int = 587
     EMAIL_USER: str
     EMAIL_PASS: str
 
+    # Mapas de calor
+    HEATMAP_CACHE_DIR: str = "cache/heatmap"
+    HEATMAP_ZOOM_MIN: int = 3
+    HEATMAP_ZOOM_MAX: int = 17
+    HEATMAP_MAX_RUTAS: int = 5000 # Máximo de rutas pintadas en una tesela
+
+    # Límites provinciales en GeoJSON (WGS84) para detectar la provincia de cada actividad;
+    # con PROVINCIAS_OBLIGATORIAS el worker no está listo (/salud/listo) si no se pueden cargar
+    PROVINCIAS_GEOJSON: str = "data/provincias.geojson"
+    PROVINCIAS_OBLIGATORIAS: bool = False
+
+    # Almacén clave-valor compartido (contadores de versión para ETags)
+    # "memoria" solo sirve con un worker; con varios usar "sqlite"
+    KV_BACKEND: str = "memoria"
+    KV_SQLITE_PATH: str = "cache/kv.sqlite3"
+
+    # Límites de peticiones ("<peticiones>/<second|minute|hour|day>"), comunes a todos los workers con KV "sqlite"
+    LIMITE_LOGIN: str = "20/minute"
+    LIMITE_REGISTRO: str = "5/minute"
+    LIMITE_RECUPERACION: str = "3/minute"
+    LIMITE_BUSQUEDA: str = "60/minute"
+
+    # Control de admisión: por encima de estos umbrales se rechazan búsqueda, ranking y perfiles públicos (503)
+    ADMISION_MAX_EN_CURSO: int = 200
+    ADMISION_MAX_COLA_HILOS: int = 20
+    ADMISION_MAX_ESPERA_DB: float = 0.5
+    ADMISION_RETRY_AFTER: int = 5
+
+    # Métricas de Prometheus en /metrics (vacío = desactivado; se pide con "Authorization: Bearer <token>")
+    # Con varios workers cada uno vuelca sus métricas en METRICAS_DIR cada METRICAS_INTERVALO segundos
+    METRICAS_TOKEN: str = ""
+    METRICAS_DIR: str = "cache/metricas"
+    METRICAS_INTERVALO: float = 5.0
+
+    # Diagnóstico: cabeceras X-DB-Consultas / X-DB-Tiempo-Ms en las respuestas (solo desarrollo)
+    DEBUG: bool = False
+    # Consultas SQL: segundos a partir de los que se registran como lentas y máximo por petición antes de avisar
+    SQL_UMBRAL_LENTA: float = 0.2
+    SQL_MAX_CONSULTAS: int = 30
+
+    # Perfilado bajo demanda: cabecera X-Perfil con este token (vacío = desactivado) o fracción de
+    # peticiones elegidas al azar; segundos entre muestras e informes guardados como máximo
+    PERFIL_TOKEN: str = ""
+    PERFIL_MUESTREO: float = 0.0
+    PERFIL_INTERVALO: float = 0.002
+    PERFIL_DIR: str = "cache/perfiles"
+    PERFIL_MAX_ARCHIVOS: int = 200
+
+    # Trazas: fracción de peticiones guardadas siempre, segundos a partir de los que se guarda
+    # cualquier petición (0 = solo muestreo), trazas en memoria por worker, tramos máximos por
+    # traza y archivo JSONL donde añadirlas (vacío = solo en memoria, endpoint /trazas)
+    TRAZAS_MUESTREO: float = 0.01
+    TRAZAS_UMBRAL_LENTA: float = 1.0
+    TRAZAS_MAX: int = 200
+    TRAZAS_MAX_TRAMOS: int = 500
+    TRAZAS_ARCHIVO: str = ""
+
+    # Logs en JSON: nivel, archivo (vacío = stdout), registros en cola como máximo antes de
+    # descartar y fracción de peticiones correctas registradas en las rutas de mucho tráfico
+    LOG_NIVEL: str = "INFO"
+    LOG_ARCHIVO: str = ""
+    LOG_COLA_MAX: int = 10000
+    LOG_MUESTREO: float = 0.05
+
+    # Caché de lecturas de los servicios: "memoria" (LRU por worker) o "kv" (almacén compartido)
+    CACHE_BACKEND: str = "memoria"
+    CACHE_MAX_ENTRADAS: int = 2048
+
+    # Compresión de respuestas (bytes y niveles; los cuerpos desde TAMANO_HILO se comprimen en un hilo)
+    COMPRESION_TAMANO_MINIMO: int = 1024
+    COMPRESION_TAMANO_HILO: int = 64 * 1024
+    COMPRESION_NIVEL_GZIP: int = 6
+    COMPRESION_NIVEL_BROTLI: int = 5
+    COMPRESION_NIVEL_ZSTD: int = 3
+
+    # Miniaturas de rutas (px)
+    SNAPSHOT_ANCHO: int = 320
+    SNAPSHOT_ALTO: int = 180
+
+    # Pool de procesos para el renderizado (0 = un proceso por núcleo)
+    PROCESS_POOL_WORKERS: int = 0
+
     # CONFIGURACIÓN MODERNA DE PYDANTIC V2
     model_config = SettingsConfigDict(
         env_file=".env",
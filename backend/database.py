@@ -6,11 +6,14 @@ Configuración de la Base de Datos y Modelos.
 Este módulo establece la conexión con PostgreSQL mediante SQLAlchemy y define
 la estructura de la tabla de usuarios.
 """
+import time
 from datetime import datetime, date, timezone
 from typing import Optional
-from sqlalchemy import create_engine, String, Date, DateTime, Boolean, Integer, Float, ForeignKey, Text
+from sqlalchemy import insert, select, exists, create_engine, String, Date, DateTime, Boolean, Integer, Float, ForeignKey, Text, Index, UniqueConstraint
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, sessionmaker
+from sqlalchemy.pool import QueuePool
 from config import settings
+from utils import carga, consultas, metricas, trazas
 from urllib.parse import quote_plus
 
 # Construcción de la URL de conexión para PostgreSQL
@@ -18,9 +21,37 @@ user_safe = quote_plus(settings.DB_USER)
 pass_safe = quote_plus(settings.DB_PASSWORD)
 DATABASE_URL = f"postgresql://{user_safe}:{pass_safe}@{settings.DB_HOST}:{settings.DB_PORT}/{settings.DB_NAME}"
 
+ESPERA_POOL = metricas.Histograma(
+    "db_pool_espera_segundos", "Espera para obtener una conexión del pool",
+    cubetas=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+class PoolMedido(QueuePool):
+    """Pool de conexiones que mide cuánto se espera para obtener cada conexión (control de admisión)."""
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            espera = time.perf_counter() - inicio
+            carga.registrar_espera_db(espera)
+            ESPERA_POOL.observar(espera)
+
 # Configuración del motor de SQLAlchemy y la sesión
-engine = create_engine(DATABASE_URL)
+# Cada worker tiene su propio pool: las conexiones máximas se reparten entre todos.
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=PoolMedido,
+    pool_size=max(1, settings.DB_CONEXIONES_MAX // max(1, settings.WORKERS)),
+    max_overflow=0,
+    pool_timeout=settings.DB_POOL_TIMEOUT
+)
+# Número de consultas y tiempo por petición, consultas lentas y N+1 (utils/consultas.py).
+consultas.registrar_eventos(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Tramos de cada consulta y commit en las trazas de las peticiones (utils/trazas.py).
+trazas.registrar_eventos(engine, SessionLocal)
 
 class Base(DeclarativeBase):
     """Clase base para todos los modelos con soporte de tipado moderno."""
@@ -78,6 +109,20 @@ class Usuario(Base):
     codigo_recuperacion: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     codigo_expiracion: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
+class FotoPerfil(Base):
+    """
+    Índice de fotos de perfil: qué archivo (direccionado por contenido) usa cada usuario.
+    Permite saber en O(1) si una imagen sigue en uso antes de borrarla.
+
+    Atributos:
+        usuario_id: Usuario propietario y clave primaria.
+        nombre_archivo: Ruta relativa (ab/cd/hash.ext) o URL de la foto.
+    """
+    __tablename__ = "fotos_perfil"
+
+    usuario_id: Mapped[int] = mapped_column(ForeignKey("usuarios.id", ondelete="CASCADE"), primary_key=True)
+    nombre_archivo: Mapped[str] = mapped_column(String, nullable=False, index=True)
+
 class Actividad(Base):
     """
     Modelo para registrar las actividades deportivas.
@@ -113,6 +158,105 @@ class Actividad(Base):
 
     fecha_ruta: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))    
 
+class ActividadGeometria(Base):
+    """
+    Índice geográfico de las actividades (Relación 1:1 con Actividad).
+    Se rellena al guardar la actividad decodificando su polilínea una sola vez,
+    así las consultas por zona (mapas de calor) no tienen que decodificar nada.
+
+    Atributos:
+        actividad_id: Actividad a la que pertenece y clave primaria.
+        usuario_id: Propietario de la actividad (copiado para filtrar sin JOIN).
+        lat_min, lat_max, lon_min, lon_max: Rectángulo que envuelve la ruta.
+        lat_inicio, lon_inicio: Punto de salida de la ruta.
+        provincia: Provincia en la que empieza la ruta (detectada al guardar).
+    """
+    __tablename__ = "actividades_geometria"
+
+    actividad_id: Mapped[int] = mapped_column(ForeignKey("actividades.id", ondelete="CASCADE"), primary_key=True)
+    usuario_id: Mapped[int] = mapped_column(ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False, index=True)
+
+    lat_min: Mapped[float] = mapped_column(Float, nullable=False)
+    lat_max: Mapped[float] = mapped_column(Float, nullable=False)
+    lon_min: Mapped[float] = mapped_column(Float, nullable=False)
+    lon_max: Mapped[float] = mapped_column(Float, nullable=False)
+
+    lat_inicio: Mapped[float] = mapped_column(Float, nullable=False)
+    lon_inicio: Mapped[float] = mapped_column(Float, nullable=False)
+    provincia: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+
+    __table_args__ = (
+        Index("ix_actividades_geometria_bbox", "lat_min", "lat_max", "lon_min", "lon_max"),
+        # Clasificaciones por provincia según dónde se hizo la actividad.
+        Index("ix_actividades_geometria_provincia", "provincia", "usuario_id"),
+    )
+
+class Segmento(Base):
+    """
+    Modelo para los segmentos: tramos de ruta populares con clasificación propia.
+
+    Atributos:
+        id: Identificador único del segmento y clave primaria.
+        creador_id: Usuario que definió el segmento.
+        nombre: Nombre visible del segmento.
+        ruta_polilinea: Trazado del segmento en formato string de Google Maps.
+        distancia: Longitud del segmento en metros.
+        lat_inicio, lon_inicio, lat_fin, lon_fin: Extremos del segmento.
+        fecha_creacion: Marca de tiempo de creación.
+    """
+    __tablename__ = "segmentos"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    creador_id: Mapped[Optional[int]] = mapped_column(ForeignKey("usuarios.id", ondelete="SET NULL"), nullable=True)
+    nombre: Mapped[str] = mapped_column(String, nullable=False)
+    ruta_polilinea: Mapped[str] = mapped_column(Text, nullable=False)
+    distancia: Mapped[float] = mapped_column(Float, nullable=False)
+
+    lat_inicio: Mapped[float] = mapped_column(Float, nullable=False)
+    lon_inicio: Mapped[float] = mapped_column(Float, nullable=False)
+    lat_fin: Mapped[float] = mapped_column(Float, nullable=False)
+    lon_fin: Mapped[float] = mapped_column(Float, nullable=False)
+
+    fecha_creacion: Mapped[datetime] = mapped_column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+class SegmentoCelda(Base):
+    """
+    Índice geohash de los segmentos: celdas que cubren el punto de salida de cada segmento.
+    Una actividad solo se compara con los segmentos cuyas celdas pisa.
+    """
+    __tablename__ = "segmentos_celdas"
+
+    celda: Mapped[str] = mapped_column(String, primary_key=True)
+    segmento_id: Mapped[int] = mapped_column(ForeignKey("segmentos.id", ondelete="CASCADE"), primary_key=True)
+
+class EsfuerzoSegmento(Base):
+    """
+    Modelo para los esfuerzos: cada vez que una actividad recorre un segmento.
+
+    Atributos:
+        segmento_id: Segmento recorrido.
+        usuario_id: Usuario que lo recorrió.
+        actividad_id: Actividad en la que se detectó.
+        tiempo: Tiempo estimado en recorrer el segmento en segundos.
+        fecha: Fecha de la actividad.
+    """
+    __tablename__ = "segmentos_esfuerzos"
+
+    id: Mapped[int] = mapped_column(primary_key=True, index=True)
+    segmento_id: Mapped[int] = mapped_column(ForeignKey("segmentos.id", ondelete="CASCADE"), nullable=False)
+    usuario_id: Mapped[int] = mapped_column(ForeignKey("usuarios.id", ondelete="CASCADE"), nullable=False)
+    actividad_id: Mapped[int] = mapped_column(ForeignKey("actividades.id", ondelete="CASCADE"), nullable=False, index=True)
+    tiempo: Mapped[int] = mapped_column(Integer, nullable=False)
+    fecha: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Clasificación del segmento (mejores tiempos) y mejores marcas de cada usuario.
+        Index("ix_segmentos_esfuerzos_clasificacion", "segmento_id", "tiempo"),
+        Index("ix_segmentos_esfuerzos_usuario", "usuario_id", "segmento_id", "tiempo"),
+        # Una actividad cuenta como mucho una vez por segmento.
+        UniqueConstraint("segmento_id", "actividad_id", name="uq_segmentos_esfuerzos_actividad"),
+    )
+
 def init_db():
     """
     Inicialización de la base de datos.
@@ -121,7 +265,33 @@ def init_db():
     si estas no existen previamente en la base de datos PostgreSQL.
     """
     Base.metadata.create_all(bind=engine)
+    _rellenar_fotos_perfil()
+    _rellenar_geometrias()
+
+def _rellenar_fotos_perfil():
+    """Crea en fotos_perfil las filas que falten de las fotos de perfil anteriores al índice."""
+    with engine.begin() as conexion:
+        conexion.execute(
+            insert(FotoPerfil).from_select(
+                ["usuario_id", "nombre_archivo"],
+                select(Usuario.id, Usuario.foto_perfil).where(
+                    Usuario.foto_perfil.is_not(None),
+                    Usuario.foto_perfil != "default_avatar.png",
+                    ~exists().where(FotoPerfil.usuario_id == Usuario.id)
+                )
+            )
+        )
     
+def _rellenar_geometrias():
+    """Índice geográfico (bbox, salida y provincia) de las actividades anteriores a él."""
+    # Import local: el servicio depende de este módulo.
+    from services import heatmap_service
+    db = SessionLocal()
+    try:
+        heatmap_service.rellenar_geometrias(db)
+    finally:
+        db.close()
+
 def obtener_db():
     """Dependencia para la conexión a la base de datos."""
     db = SessionLocal()
@@ -1,8 +1,71 @@
 # limiter_config.py
 
-from slowapi import Limiter
-from slowapi.util import get_remote_address
+"""
+Limitador de Peticiones.
 
-# Inicializar el limitador usando la dirección IP del usuario como "llave"
-# para identificar quién está haciendo las peticiones.
-limiter = Limiter(key_func=get_remote_address)
\ No newline at end of file
+Cubeta de tokens por ruta guardada en el almacén clave-valor compartido
+(utils/kv_store.py), así el límite es el mismo con uno o varios workers
+(con settings.KV_BACKEND = "sqlite"). Cada comprobación es una sola operación O(1).
+
+Las políticas se configuran en settings con la notación "<peticiones>/<periodo>":
+la cubeta admite esa ráfaga y se rellena al mismo ritmo. Se cuenta por IP
+(rutas sin sesión) o por usuario (rutas con token de acceso).
+"""
+import math
+from dataclasses import dataclass
+from fastapi import Depends, HTTPException, Request
+import auth
+from config import settings
+from utils.kv_store import obtener_almacen
+
+PERIODOS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+@dataclass(frozen=True)
+class Politica:
+    nombre: str
+    capacidad: int
+    intervalo: float
+    por_usuario: bool = False
+
+def crear_politica(nombre: str, limite: str, por_usuario: bool = False) -> Politica:
+    """Convierte "20/minute" en una cubeta de 20 tokens con uno nuevo cada 3 segundos."""
+    peticiones, periodo = limite.split("/")
+    capacidad = int(peticiones)
+    return Politica(nombre, capacidad, PERIODOS[periodo.strip()] / capacidad, por_usuario)
+
+POLITICAS = {
+    "login": crear_politica("login", settings.LIMITE_LOGIN),
+    "registro": crear_politica("registro", settings.LIMITE_REGISTRO),
+    "recuperacion": crear_politica("recuperacion", settings.LIMITE_RECUPERACION),
+    "busqueda": crear_politica("busqueda", settings.LIMITE_BUSQUEDA, por_usuario=True),
+}
+
+def direccion_cliente(request: Request) -> str:
+    """
+    IP del cliente. Detrás de un proxy, uvicorn solo la toma de X-Forwarded-For si el proxy
+    está en FORWARDED_ALLOW_IPS; si no, es la del proxy y todos comparten el mismo límite.
+    """
+    return request.client.host if request.client else "desconocida"
+
+def _comprobar(politica: Politica, identificador: str):
+    espera = obtener_almacen().consumir_cupo(
+        f"limite:{politica.nombre}:{identificador}", politica.intervalo, politica.capacidad
+    )
+    if espera > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Error: Demasiadas peticiones, inténtalo de nuevo más tarde",
+            headers={"Retry-After": str(math.ceil(espera))}
+        )
+
+def limitar(nombre: str):
+    """Dependencia que aplica la política 'nombre', p.ej. dependencies=[Depends(limitar("login"))]."""
+    politica = POLITICAS[nombre]
+    if politica.por_usuario:
+        def dependencia_usuario(usuario_actual: str = Depends(auth.obtener_usuario_actual)):
+            _comprobar(politica, f"u:{usuario_actual}")
+        return dependencia_usuario
+
+    def dependencia_ip(request: Request):
+        _comprobar(politica, f"ip:{direccion_cliente(request)}")
+    return dependencia_ip
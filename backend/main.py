@@ -6,27 +6,27 @@ Punto de Entrada Principal - MoveOn API.
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from routers import users, access, activities
+from routers import users, access, activities, maps, segments, salud
 from exceptions import manejador_validacion_personalizado
-import database
-from fastapi.staticfiles import StaticFiles
-import os
-from config import settings
-from slowapi import _rate_limit_exceeded_handler
-from slowapi.errors import RateLimitExceeded
-from limiter_config import limiter
+from middlewares.compresion import CompresionMiddleware
+from middlewares.admision import AdmisionMiddleware
+from middlewares.registro import RegistroMiddleware
+from middlewares.metricas import MetricasMiddleware
+from middlewares.consultas import ConsultasMiddleware
+from middlewares.perfilador import PerfiladorMiddleware
+from middlewares.trazas import TrazasMiddleware
+from services import storage_service
+from arranque import ciclo_de_vida
 
 # Declaración de API.
 app = FastAPI(
     title="MoveOn API",
     description="Backend de la aplicación MoveOn",
-    version="0.2.6"
+    version="0.2.6",
+    # Creación de tablas, precarga de cachés y cierre del pool de procesos (arranque.py).
+    lifespan=ciclo_de_vida
 )
 
-# Configurar el limitador (usa la IP del usuario para contar)
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler) # type: ignore
-
 # Configuración de CORS para permitir peticiones desde la App.
 app.add_middleware(
     CORSMiddleware,
@@ -36,8 +36,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Inicializar base de datos.
-database.init_db()
+# Compresión de las respuestas grandes (listas de actividades con polilíneas, ranking...).
+app.add_middleware(
+    CompresionMiddleware,
+    rutas=("/actividad/obtener", "/ranking/obtener", "/perfil/buscar", "/segmento/"),
+)
+
+# Control de admisión (el último añadido es el primero en ejecutarse): con el worker
+# saturado se rechaza el tráfico prescindible y se siguen atendiendo logins y actividades.
+app.add_middleware(
+    AdmisionMiddleware,
+    prescindibles=("/perfil/buscar", "/ranking/obtener", "/perfil/informacion/"),
+)
+
+# Registro JSON de accesos con id de petición (por dentro de Consultas para saber cuántas hizo;
+# por fuera de Admisión para registrar también los rechazos). Las rutas de mucho tráfico se muestrean.
+app.add_middleware(
+    RegistroMiddleware,
+    muestreadas=("/salud/", "/metrics", "/mapa/heatmap/", "/ranking/obtener", "/perfil/buscar", "/actividad/obtener"),
+)
+
+# Consultas SQL por petición (aviso de N+1 y cabeceras de diagnóstico con DEBUG).
+app.add_middleware(ConsultasMiddleware)
+
+# Trazas (tramos por servicio, consulta y almacenamiento) de las peticiones muestreadas y lentas.
+app.add_middleware(TrazasMiddleware)
+
+# Latencia y códigos de estado por ruta para /metrics (incluye los rechazos de admisión).
+app.add_middleware(MetricasMiddleware)
+
+# Perfilado de peticiones bajo demanda (cabecera X-Perfil) o por muestreo.
+app.add_middleware(PerfiladorMiddleware)
 
 # Registro de excepciones.
 app.add_exception_handler(RequestValidationError, manejador_validacion_personalizado)
@@ -46,20 +75,12 @@ app.add_exception_handler(RequestValidationError, manejador_validacion_personali
 app.include_router(access.router)
 app.include_router(users.router)
 app.include_router(activities.router)
+app.include_router(maps.router)
+app.include_router(segments.router)
+app.include_router(salud.router)
 
-# Obtener el tipo de almacenamiento para las imagenes.
-STORAGE_TYPE = settings.STORAGE_TYPE
-
-# Configurar almacenamiento local si es necesario.
-if STORAGE_TYPE == "local":
-    # Usar la variable de settings.
-    carpeta_imagenes = settings.UPLOAD_DIR
-    # Crear la carpeta para guardar imagenes en local si no existe.
-    if not os.path.exists(carpeta_imagenes):
-        os.makedirs(carpeta_imagenes)
-    # Se monta la carpeta para que sea accesible vía URL
-    # http://127.0.0.1:8000/imagenes/default_avatar.jpg    
-    app.mount("/imagenes", StaticFiles(directory=carpeta_imagenes), name="imagenes")
+# Preparar el almacenamiento de imágenes (en local crea la carpeta y la monta en /imagenes).
+storage_service.obtener_almacenamiento().preparar(app)
 
 # Endpoint raiz.
 @app.get("/")
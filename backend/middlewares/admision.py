@@ -0,0 +1,81 @@
+# middlewares/admision.py
+
+"""
+Middleware de Control de Admisión.
+
+Cuando el worker está saturado (demasiadas peticiones en curso, cola de hilos
+o espera del pool de la base de datos por encima de los umbrales de settings),
+las rutas prescindibles (búsqueda, ranking, perfiles públicos) se rechazan al
+momento con 503 y Retry-After, en vez de esperar en la cola hasta que el cliente
+corte y reintente. El resto (guardar actividades, login...) se atiende siempre.
+"""
+import threading
+from typing import Optional
+import orjson
+from starlette.types import ASGIApp, Receive, Scope, Send
+from config import settings
+from utils import carga
+
+class _Estadisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.rechazadas: dict[str, int] = {}
+
+    def registrar(self, motivo: str):
+        with self.lock:
+            self.rechazadas[motivo] = self.rechazadas.get(motivo, 0) + 1
+
+_estadisticas = _Estadisticas()
+
+def estadisticas() -> dict:
+    """Peticiones rechazadas por motivo y carga actual."""
+    with _estadisticas.lock:
+        return {"rechazadas": dict(_estadisticas.rechazadas), **carga.estadisticas()}
+
+def motivo_saturacion() -> Optional[str]:
+    """Primer umbral superado, o None si el worker puede aceptar tráfico prescindible."""
+    if carga.en_curso() >= settings.ADMISION_MAX_EN_CURSO:
+        return "en_curso"
+    if carga.cola_hilos() >= settings.ADMISION_MAX_COLA_HILOS:
+        return "cola_hilos"
+    if carga.espera_db() >= settings.ADMISION_MAX_ESPERA_DB:
+        return "espera_db"
+    return None
+
+class AdmisionMiddleware:
+    """Middleware ASGI que cuenta las peticiones en curso y rechaza las prescindibles si hay saturación."""
+
+    def __init__(self, app: ASGIApp, prescindibles: tuple[str, ...]):
+        self.app = app
+        self.prescindibles = prescindibles
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"].startswith(self.prescindibles):
+            motivo = motivo_saturacion()
+            if motivo is not None:
+                _estadisticas.registrar(motivo)
+                await self._rechazar(send)
+                return
+
+        carga.entrar()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            carga.salir()
+
+    async def _rechazar(self, send: Send):
+        cuerpo = orjson.dumps({"detail": "Error: Servidor saturado, inténtalo de nuevo en unos segundos"})
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(cuerpo)).encode()),
+                (b"retry-after", str(settings.ADMISION_RETRY_AFTER).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": cuerpo})
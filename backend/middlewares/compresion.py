@@ -0,0 +1,173 @@
+# middlewares/compresion.py
+
+"""
+Middleware de Compresión de Respuestas.
+
+Las listas de actividades son casi todo texto de polilíneas, que se comprime muy bien.
+Se negocia la codificación con Accept-Encoding entre las disponibles:
+    - br (Brotli) y zstd: solo si están instalados los paquetes 'brotli' / 'zstandard'.
+    - gzip: siempre (librería estándar).
+
+Solo se comprimen las rutas indicadas al añadir el middleware, los tipos de texto
+(JSON, MessagePack...) y los cuerpos de al menos settings.COMPRESION_TAMANO_MINIMO.
+Los cuerpos grandes se comprimen en un hilo para no frenar el bucle de eventos.
+Todas las respuestas de esas rutas llevan Vary: Accept-Encoding, se compriman o no,
+para que una caché no sirva la versión sin comprimir a quien sí la acepta (ni al revés).
+"""
+import gzip
+import threading
+from typing import Callable, Iterable, Optional
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Tipos de contenido que merece la pena comprimir.
+TIPOS_COMPRIMIBLES = ("application/json", "application/msgpack", "text/")
+
+def _gzip(cuerpo: bytes) -> bytes:
+    # mtime=0: misma entrada, misma salida (no cambia en cada petición).
+    return gzip.compress(cuerpo, compresslevel=settings.COMPRESION_NIVEL_GZIP, mtime=0)
+
+def _brotli(cuerpo: bytes) -> bytes:
+    return brotli.compress(cuerpo, quality=settings.COMPRESION_NIVEL_BROTLI)
+
+def _zstd(cuerpo: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=settings.COMPRESION_NIVEL_ZSTD).compress(cuerpo)
+
+# Codificaciones disponibles, de más a menos preferida a igual prioridad del cliente.
+COMPRESORES: dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+    COMPRESORES["br"] = _brotli
+if zstandard is not None:
+    COMPRESORES["zstd"] = _zstd
+COMPRESORES["gzip"] = _gzip
+
+class _Estadisticas:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.por_codificacion: dict[str, dict[str, int]] = {}
+
+    def registrar(self, codificacion: str, original: int, comprimido: int):
+        with self.lock:
+            datos = self.por_codificacion.setdefault(
+                codificacion, {"respuestas": 0, "bytes_originales": 0, "bytes_enviados": 0}
+            )
+            datos["respuestas"] += 1
+            datos["bytes_originales"] += original
+            datos["bytes_enviados"] += comprimido
+
+_estadisticas = _Estadisticas()
+
+def estadisticas() -> dict:
+    """Respuestas comprimidas y bytes ahorrados por codificación."""
+    with _estadisticas.lock:
+        return {
+            codificacion: {**datos, "bytes_ahorrados": datos["bytes_originales"] - datos["bytes_enviados"]}
+            for codificacion, datos in _estadisticas.por_codificacion.items()
+        }
+
+def elegir_codificacion(accept_encoding: str, disponibles: Optional[Iterable[str]] = None) -> Optional[str]:
+    """
+    Codificación con más prioridad para el cliente entre las disponibles (None si ninguna).
+    Por defecto, los compresores instalados; a igual prioridad gana la primera de 'disponibles'.
+    """
+    calidades: dict[str, float] = {}
+    for parte in accept_encoding.split(","):
+        nombre, *parametros = [p.strip() for p in parte.split(";")]
+        calidad = 1.0
+        for parametro in parametros:
+            if parametro.startswith("q="):
+                try:
+                    calidad = float(parametro[2:])
+                except ValueError:
+                    calidad = 0.0
+        if nombre:
+            calidades[nombre.lower()] = calidad
+
+    mejor, mejor_calidad = None, 0.0
+    for codificacion in (COMPRESORES if disponibles is None else disponibles):
+        calidad = calidades.get(codificacion, calidades.get("*", 0.0))
+        if calidad > mejor_calidad:
+            mejor, mejor_calidad = codificacion, calidad
+    return mejor
+
+class CompresionMiddleware:
+    """Middleware ASGI que comprime las respuestas de las rutas indicadas (prefijos)."""
+
+    def __init__(self, app: ASGIApp, rutas: tuple[str, ...]):
+        self.app = app
+        self.rutas = rutas
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.rutas):
+            await self.app(scope, receive, send)
+            return
+        codificacion = None
+        if scope["method"] != "HEAD":
+            codificacion = elegir_codificacion(Headers(scope=scope).get("accept-encoding", ""))
+        if codificacion is None:
+            async def enviar_con_vary(mensaje: Message):
+                if mensaje["type"] == "http.response.start":
+                    MutableHeaders(scope=mensaje).add_vary_header("Accept-Encoding")
+                await send(mensaje)
+
+            await self.app(scope, receive, enviar_con_vary)
+            return
+
+        inicio: Optional[Message] = None
+        partes: list[bytes] = []
+
+        async def enviar(mensaje: Message):
+            nonlocal inicio
+            if mensaje["type"] == "http.response.start":
+                # Se retiene la cabecera hasta saber si el cuerpo se comprime.
+                inicio = mensaje
+            elif mensaje["type"] == "http.response.body" and inicio is not None:
+                partes.append(mensaje.get("body", b""))
+                if not mensaje.get("more_body", False):
+                    await self._enviar(inicio, b"".join(partes), codificacion, send)
+            else:
+                await send(mensaje)
+
+        await self.app(scope, receive, enviar)
+
+    async def _enviar(self, inicio: Message, cuerpo: bytes, codificacion: str, send: Send):
+        cabeceras = MutableHeaders(raw=inicio["headers"])
+        cabeceras.add_vary_header("Accept-Encoding")
+        tipo = cabeceras.get("content-type", "")
+        if (
+            inicio["status"] in (204, 206, 304)
+            or "content-encoding" in cabeceras
+            or len(cuerpo) < settings.COMPRESION_TAMANO_MINIMO
+            or not tipo.startswith(TIPOS_COMPRIMIBLES)
+        ):
+            await send(inicio)
+            await send({"type": "http.response.body", "body": cuerpo})
+            return
+
+        compresor = COMPRESORES[codificacion]
+        if len(cuerpo) >= settings.COMPRESION_TAMANO_HILO:
+            comprimido = await anyio.to_thread.run_sync(compresor, cuerpo)
+        else:
+            comprimido = compresor(cuerpo)
+        _estadisticas.registrar(codificacion, len(cuerpo), len(comprimido))
+
+        cabeceras["content-encoding"] = codificacion
+        cabeceras["content-length"] = str(len(comprimido))
+        # Un ETag fuerte identifica bytes exactos: el cuerpo comprimido pasa a ser equivalente (débil).
+        etag = cabeceras.get("etag")
+        if etag and not etag.startswith("W/"):
+            cabeceras["etag"] = f"W/{etag}"
+        await send(inicio)
+        await send({"type": "http.response.body", "body": comprimido})
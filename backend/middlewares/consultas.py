@@ -0,0 +1,50 @@
+# middlewares/consultas.py
+
+"""
+Middleware de Consultas por Petición.
+
+Abre el registro de consultas SQL de cada petición (utils/consultas.py), lo
+revisa al terminar (aviso de N+1) y anota cuántas consultas hizo cada ruta en
+/metrics. Con settings.DEBUG añade a la respuesta las cabeceras:
+    - X-DB-Consultas: número de consultas hasta enviar la respuesta.
+    - X-DB-Tiempo-Ms: tiempo total en la base de datos.
+Las tareas en segundo plano (después de la respuesta) cuentan en el aviso, no en las cabeceras.
+"""
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils import consultas, metricas
+from middlewares.metricas import plantilla_ruta
+
+CONSULTAS_POR_PETICION = metricas.Histograma(
+    "db_consultas_por_peticion", "Consultas SQL de cada petición", ("ruta",),
+    cubetas=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+
+class ConsultasMiddleware:
+    """Middleware ASGI que cuenta las consultas SQL de cada petición."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        registro, token = consultas.iniciar()
+
+        async def enviar(mensaje: Message):
+            if mensaje["type"] == "http.response.start" and settings.DEBUG:
+                cabeceras = MutableHeaders(scope=mensaje)
+                cabeceras["X-DB-Consultas"] = str(registro.total)
+                cabeceras["X-DB-Tiempo-Ms"] = f"{registro.tiempo * 1000:.1f}"
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            consultas.terminar(token)
+            ruta = plantilla_ruta(scope)
+            CONSULTAS_POR_PETICION.observar(registro.total, ruta)
+            consultas.revisar_peticion(registro, scope["method"], ruta)
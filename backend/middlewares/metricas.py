@@ -0,0 +1,128 @@
+# middlewares/metricas.py
+
+"""
+Middleware de Métricas.
+
+Registra la latencia (histograma) y el código de estado de cada petición por
+plantilla de ruta (p.ej. /actividad/obtener/{id_actividad}), para que el número
+de series no crezca con los identificadores. Las peticiones que no llegan a
+ninguna ruta (404, rechazadas por admisión...) se agrupan en "sin_ruta".
+
+También registra los colectores que leen al exportar los contadores de los demás
+módulos. La tasa de aciertos de la caché se calcula en Prometheus a partir de los
+contadores de aciertos y fallos (los porcentajes no se pueden sumar entre workers).
+"""
+import time
+import anyio
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils import metricas, carga, cache, coalescencia
+from middlewares import compresion, admision
+
+PETICIONES = metricas.Contador("http_peticiones_total", "Peticiones HTTP atendidas", ("ruta", "metodo", "estado"))
+DURACION = metricas.Histograma("http_duracion_segundos", "Duración de las peticiones HTTP", ("ruta", "metodo"))
+
+def plantilla_ruta(scope: Scope) -> str:
+    ruta = scope.get("route")
+    return getattr(ruta, "path", "sin_ruta")
+
+class MetricasMiddleware:
+    """Middleware ASGI que mide cada petición HTTP."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def enviar(mensaje: Message):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = plantilla_ruta(scope)
+            PETICIONES.inc(ruta, scope["method"], str(estado))
+            DURACION.observar(time.perf_counter() - inicio, ruta, scope["method"])
+
+def _colector_carga():
+    ocupados, maximos = carga.hilos()
+    yield "gauge", "http_en_curso", "Peticiones en curso", {"": carga.en_curso()}
+    yield "gauge", "hilos_ocupados", "Hilos ocupados del pool de FastAPI", {"": ocupados}
+    yield "gauge", "hilos_maximos", "Tamaño del pool de hilos de FastAPI", {"": maximos}
+    yield "gauge", "hilos_en_cola", "Tareas esperando un hilo libre", {"": carga.cola_hilos()}
+    yield "gauge", "bcrypt_en_curso", "Operaciones de bcrypt en curso", {"": carga.bcrypt_en_curso()}
+
+def _colector_pool_db():
+    import database
+
+    pool = database.engine.pool
+    if hasattr(pool, "checkedout"):
+        yield "gauge", "db_pool_conexiones", "Conexiones del pool de la base de datos", {
+            'estado="en_uso"': pool.checkedout(),
+            'estado="libres"': pool.checkedin(),
+        }
+        yield "gauge", "db_pool_tamano", "Tamaño configurado del pool de la base de datos", {"": pool.size()}
+
+def _colector_cache():
+    datos = cache.estadisticas()
+    por_funcion = datos["funciones"]
+    for campo, nombre, ayuda in (("aciertos", "cache_aciertos_total", "Lecturas servidas desde la caché"),
+                                 ("fallos", "cache_fallos_total", "Lecturas calculadas por no estar en caché"),
+                                 ("invalidadas", "cache_invalidadas_total", "Entradas descartadas por cambios en sus etiquetas")):
+        yield "counter", nombre, ayuda, {
+            metricas.etiquetas(("funcion",), (funcion,)): valores[campo] for funcion, valores in por_funcion.items()
+        }
+    yield "counter", "cache_expulsiones_total", "Entradas expulsadas por el LRU", {"": datos["expulsiones"]}
+
+def _colector_coalescencia():
+    datos = coalescencia.estadisticas()
+    for campo, ayuda in (("ejecutadas", "Cálculos ejecutados"), ("agrupadas", "Peticiones que esperaron un cálculo en curso")):
+        yield "counter", f"coalescencia_{campo}_total", ayuda, {
+            metricas.etiquetas(("grupo",), (grupo,)): valores[campo] for grupo, valores in datos.items()
+        }
+
+def _colector_compresion():
+    datos = compresion.estadisticas()
+    for campo, ayuda in (("respuestas", "Respuestas comprimidas"),
+                         ("bytes_originales", "Bytes antes de comprimir"),
+                         ("bytes_enviados", "Bytes enviados tras comprimir")):
+        yield "counter", f"compresion_{campo}_total", ayuda, {
+            metricas.etiquetas(("codificacion",), (codificacion,)): valores[campo]
+            for codificacion, valores in datos.items()
+        }
+
+def _colector_admision():
+    yield "counter", "admision_rechazadas_total", "Peticiones rechazadas por saturación", {
+        metricas.etiquetas(("motivo",), (motivo,)): valor
+        for motivo, valor in admision.estadisticas()["rechazadas"].items()
+    }
+
+for _colector in (_colector_carga, _colector_pool_db, _colector_cache, _colector_coalescencia,
+                  _colector_compresion, _colector_admision):
+    metricas.registrar_colector(_colector)
+
+def directorio_compartido() -> str:
+    """Carpeta donde se suman las métricas de los workers (vacío con un solo worker)."""
+    return settings.METRICAS_DIR if settings.WORKERS > 1 else ""
+
+async def volcar_periodicamente():
+    """Tarea del ciclo de vida: publica las métricas de este worker para los demás."""
+    directorio = directorio_compartido()
+    if not directorio:
+        return
+    try:
+        while True:
+            metricas.volcar(directorio)
+            await anyio.sleep(settings.METRICAS_INTERVALO)
+    finally:
+        # Último volcado al apagar: el siguiente /metrics lo suma al acumulado de los terminados.
+        metricas.volcar(directorio)
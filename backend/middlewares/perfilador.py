@@ -0,0 +1,67 @@
+# middlewares/perfilador.py
+
+"""
+Middleware de Perfilado bajo Demanda.
+
+Perfila (utils/perfilador.py) las peticiones que:
+    - Llevan la cabecera X-Perfil con el valor de settings.PERFIL_TOKEN. La respuesta
+      incluye Server-Timing con el tiempo en jose, bcrypt, Pydantic, SQLAlchemy y el
+      driver de Postgres, y X-Perfil con el nombre del informe.
+    - Salen elegidas al azar con probabilidad settings.PERFIL_MUESTREO (sin cabeceras).
+El informe completo (pilas en formato colapsado) se guarda en settings.PERFIL_DIR.
+Sin token y con muestreo 0 (valores por defecto) no hace nada.
+"""
+import sys
+import hmac
+import random
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils import perfilador
+from middlewares.metricas import plantilla_ruta
+
+def _pedido_por_cabecera(scope: Scope) -> bool:
+    if not settings.PERFIL_TOKEN:
+        return False
+    valor = Headers(scope=scope).get("x-perfil", "")
+    return hmac.compare_digest(valor.encode(), settings.PERFIL_TOKEN.encode())
+
+class PerfiladorMiddleware:
+    """Middleware ASGI que perfila las peticiones pedidas o muestreadas."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        por_cabecera = _pedido_por_cabecera(scope)
+        if not por_cabecera and not (settings.PERFIL_MUESTREO and random.random() < settings.PERFIL_MUESTREO):
+            await self.app(scope, receive, send)
+            return
+
+        nombre = perfilador.nombre_informe()
+        # El marco de esta corrutina identifica la petición en las muestras del bucle de eventos.
+        perfil, token = perfilador.iniciar(sys._getframe(), settings.PERFIL_INTERVALO)
+
+        async def enviar(mensaje: Message):
+            if mensaje["type"] == "http.response.start" and por_cabecera:
+                duracion, tiempos = perfilador.tiempos(perfil)
+                cabeceras = MutableHeaders(scope=mensaje)
+                cabeceras["Server-Timing"] = ", ".join(
+                    [f"{categoria};dur={tiempo * 1000:.1f}" for categoria, tiempo in tiempos.items()]
+                    + [f"total;dur={duracion * 1000:.1f}"]
+                )
+                cabeceras["X-Perfil"] = nombre
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            perfilador.terminar(perfil, token)
+            titulo = f"{scope['method']} {scope['path']} ({plantilla_ruta(scope)})"
+            await anyio.to_thread.run_sync(
+                perfilador.guardar, settings.PERFIL_DIR, nombre, perfil.informe(titulo), settings.PERFIL_MAX_ARCHIVOS
+            )
@@ -0,0 +1,80 @@
+# middlewares/registro.py
+
+"""
+Middleware de Registro de Accesos.
+
+Da a cada petición un id (el de la cabecera X-Request-ID si es válido, o uno nuevo),
+lo devuelve en X-Request-ID y al terminar escribe en el logger "moveon.acceso"
+un registro con la ruta, el estado, la latencia, las consultas SQL y el usuario.
+    - Errores (estado >= 400) y excepciones: siempre (las excepciones con su traza).
+    - Peticiones correctas de las rutas de mucho tráfico: solo una fracción
+      (settings.LOG_MUESTREO); el campo "muestreo" permite estimar el total.
+    - Resto de peticiones correctas: siempre.
+"""
+import re
+import time
+import uuid
+import random
+import logging
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils import consultas, registro
+from middlewares.metricas import plantilla_ruta
+
+logger = logging.getLogger("moveon.acceso")
+
+_ID_VALIDO = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+class RegistroMiddleware:
+    """Middleware ASGI que identifica cada petición y registra el acceso en JSON."""
+
+    def __init__(self, app: ASGIApp, muestreadas: tuple[str, ...]):
+        self.app = app
+        self.muestreadas = muestreadas
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        id_peticion = Headers(scope=scope).get("x-request-id", "")
+        if not _ID_VALIDO.fullmatch(id_peticion):
+            id_peticion = uuid.uuid4().hex
+        contexto, token = registro.iniciar_peticion(id_peticion)
+        inicio = time.perf_counter()
+        estado = 500
+
+        async def enviar(mensaje: Message):
+            nonlocal estado
+            if mensaje["type"] == "http.response.start":
+                estado = mensaje["status"]
+                MutableHeaders(scope=mensaje)["X-Request-ID"] = id_peticion
+            await send(mensaje)
+
+        excepcion = None
+        try:
+            await self.app(scope, receive, enviar)
+        except BaseException as e:
+            excepcion = e
+            raise
+        finally:
+            muestreo = 1.0
+            if excepcion is None and estado < 400 and scope["path"].startswith(self.muestreadas):
+                muestreo = settings.LOG_MUESTREO
+            if muestreo >= 1.0 or random.random() < muestreo:
+                registro_consultas = consultas.actual()
+                logger.log(
+                    logging.ERROR if excepcion is not None or estado >= 500 else logging.INFO,
+                    "%s %s %d", scope["method"], scope["path"], estado,
+                    exc_info=excepcion if isinstance(excepcion, Exception) else None,
+                    extra={
+                        "metodo": scope["method"],
+                        "ruta": plantilla_ruta(scope),
+                        "estado": estado,
+                        "duracion_ms": round((time.perf_counter() - inicio) * 1000, 1),
+                        "consultas": registro_consultas.total if registro_consultas else None,
+                        "muestreo": muestreo,
+                    }
+                )
+            registro.terminar_peticion(token)
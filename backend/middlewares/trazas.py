@@ -0,0 +1,48 @@
+# middlewares/trazas.py
+
+"""
+Middleware de Trazas.
+
+Abre la traza de cada petición elegida (utils/trazas.py) con un tramo raíz que
+cubre el endpoint y sus dependencias, y al terminar la guarda si fue muestreada
+o lenta. Con settings.TRAZAS_MUESTREO y settings.TRAZAS_UMBRAL_LENTA a 0 no hace nada.
+"""
+import anyio
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from config import settings
+from utils import trazas
+from middlewares.metricas import plantilla_ruta
+
+class TrazasMiddleware:
+    """Middleware ASGI que traza las peticiones muestreadas y las lentas."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trazar, muestreada = trazas.debe_trazar()
+        if not trazar:
+            await self.app(scope, receive, send)
+            return
+
+        traza, raiz, tokens = trazas.iniciar(scope["method"], scope["path"])
+
+        async def enviar(mensaje: Message):
+            if mensaje["type"] == "http.response.start":
+                traza.estado = mensaje["status"]
+            await send(mensaje)
+
+        error = None
+        try:
+            await self.app(scope, receive, enviar)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            trazas.terminar(traza, raiz, tokens, plantilla_ruta(scope), error)
+            datos = trazas.conservar(traza, muestreada)
+            if datos is not None and settings.TRAZAS_ARCHIVO:
+                await anyio.to_thread.run_sync(trazas.escribir, settings.TRAZAS_ARCHIVO, datos)
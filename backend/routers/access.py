@@ -6,18 +6,18 @@ Endpoints de Seguridad de Aplicación y Autenticación.
 Gestiona el apretón de manos (handshake) inicial para validar la App 
 y el inicio de sesión de usuarios para obtener tokens de acceso.
 """
-from fastapi import APIRouter, Depends, HTTPException, Header, Request
+from fastapi import APIRouter, Depends, HTTPException, Header
 from sqlalchemy.orm import Session
 import auth
 import schemas
 from database import obtener_db
 from services import access_service
 from config import settings
-from limiter_config import limiter
+from limiter_config import limitar
 
 router = APIRouter(tags=["Seguridad"])
 
-@router.get("/handshake", response_model=schemas.RespuestaGenerica)
+@router.get("/handshake", response_model=schemas.RespuestaHandshake)
 def handshake(x_app_id: str = Header(None)):
     """Valida la App de Android y entrega un token de sesión temporal."""
     if x_app_id != settings.APP_ID_SECRET:
@@ -25,10 +25,9 @@ def handshake(x_app_id: str = Header(None)):
     # Crea el token de corta duración.
     return {"app_session_token": auth.crear_token_aplicacion()}
 
-@router.post("/login", response_model=schemas.RespuestaLogin)
-@limiter.limit("20/minute") # Limite 20 intentos por minuto
-def login(request: Request,
-          datos: schemas.Login, 
+@router.post("/login", response_model=schemas.RespuestaLogin,
+             dependencies=[Depends(limitar("login"))])
+def login(datos: schemas.Login, 
           db: Session = Depends(obtener_db), 
           _auth_app=Depends(auth.verificar_sesion_aplicacion)):
     """Autentica al usuario y genera el token de acceso JWT final."""
@@ -48,7 +47,8 @@ def login(request: Request,
         "token_acceso": token
     }
 
-@router.post("/contraseña/solicitar", response_model=schemas.RespuestaGenerica)
+@router.post("/contraseña/solicitar", response_model=schemas.RespuestaGenerica,
+             dependencies=[Depends(limitar("recuperacion"))])
 async def solicitar_contraseña(datos: schemas.SolicitarContraseña, 
                      db: Session = Depends(obtener_db),
                      _auth_app=Depends(auth.verificar_sesion_aplicacion)):
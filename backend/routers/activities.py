@@ -1,27 +1,46 @@
 # routers/#activities.py
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, BackgroundTasks, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 import schemas
 import auth
+import database
 from database import obtener_db
-from services import activities_service 
+from services import activities_service, file_service, map_snapshot_service, segment_service, version_service
+from utils import respuestas
 
 router = APIRouter(tags=["Actividades"])
 
+def respuesta_actividad(actividad: database.Actividad, request: Request) -> dict:
+    """Convierte la actividad en respuesta con la URL completa de la miniatura de la ruta."""
+    datos = schemas.RespuestaObtenerActividad.model_validate(actividad).model_dump()
+    datos["ruta_mapa_url"] = file_service.construir_url_archivo(actividad.ruta_mapa_url, request)
+    return datos
+
 @router.post("/actividad/guardar", response_model=schemas.RespuestaObtenerActividad)
 def guardar_actividad(
     datos: schemas.GuardarActividad,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(obtener_db),
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
     _auth_app=Depends(auth.verificar_sesion_aplicacion)
 ):
-    return activities_service.crear_actividad(db, usuario_actual, datos)
+    """
+    Guarda la actividad y, si tiene ruta, genera su miniatura y busca los segmentos
+    recorridos en segundo plano. Mientras se genera, ruta_mapa_url conserva la URL que envió la App.
+    """
+    respuesta = activities_service.crear_actividad(db, usuario_actual, datos, background_tasks)
+    if respuesta["ruta_polilinea"]:
+        background_tasks.add_task(map_snapshot_service.generar_instantanea, respuesta["id"])
+        background_tasks.add_task(segment_service.emparejar_actividad, respuesta["id"])
+    return respuesta
 
-@router.get("/actividad/obtener/{id_actividad}", response_model=schemas.RespuestaObtenerActividad)
+@router.get("/actividad/obtener/{id_actividad}", response_model=schemas.RespuestaObtenerActividad,
+            responses=respuestas.DOC_MSGPACK)
 def obtener_actividad(
     id_actividad: int,
+    request: Request,
     db: Session = Depends(obtener_db),
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
     _auth_app=Depends(auth.verificar_sesion_aplicacion)
@@ -30,15 +49,20 @@ def obtener_actividad(
     Obtiene el detalle de una actividad específica por su ID.
     Útil si la App necesita recargar los detalles de una ruta concreta.
     """
-    return activities_service.obtener_actividad(db, usuario_actual, id_actividad)
+    actividad = activities_service.obtener_actividad(db, usuario_actual, id_actividad)
+    return respuestas.respuesta_negociada(request, respuesta_actividad(actividad, request))
 
-@router.get("/actividad/obtener_todas", response_model=List[schemas.RespuestaObtenerActividad])
+@router.get("/actividad/obtener_todas", response_model=List[schemas.RespuestaObtenerActividad],
+            responses=respuestas.DOC_MSGPACK)
 def obtener_todas_actividades(
+    request: Request,
+    response: Response,
     skip: int = 0,
     limit: int = 20,
     db: Session = Depends(obtener_db),
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
-    _auth_app=Depends(auth.verificar_sesion_aplicacion)
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    _condicional=Depends(version_service.peticion_condicional(version_service.clave_actividades("{usuario_actual}")))
 ):
     """
     Este endpoint es para obtener toda la BD de rutas cuando el usuario vuelve a la app despues de desinstalar.
@@ -46,19 +70,24 @@ def obtener_todas_actividades(
     y garantizar que el usuario recibe todos las rutas en un entorno con poca cobertura WIFI/datos.
     Ejemplo: /actividad/obtener?skip=0&limit=20
     """
-    return activities_service.obtener_actividades(db, usuario_actual, skip, limit)
+    actividades = activities_service.obtener_actividades(db, usuario_actual, skip, limit)
+    for actividad in actividades:
+        actividad["ruta_mapa_url"] = file_service.construir_url_archivo(actividad["ruta_mapa_url"], request)
+    return respuestas.respuesta_negociada(request, actividades, response)
 
 @router.delete("/actividad/borrar/{id_actividad}", response_model=schemas.RespuestaGenerica)
 def borrar_actividad(
     id_actividad: int,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(obtener_db),
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
     _auth_app=Depends(auth.verificar_sesion_aplicacion)
 ):
-    return activities_service.eliminar_actividad(db, usuario_actual, id_actividad)
+    return activities_service.eliminar_actividad(db, usuario_actual, id_actividad, background_tasks)
 
 @router.delete("/actividad/borrar_todas", response_model=schemas.RespuestaGenerica)
 def borrar_todas_actividades(
+    background_tasks: BackgroundTasks,
     db: Session = Depends(obtener_db),
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
     _auth_app=Depends(auth.verificar_sesion_aplicacion)
@@ -67,4 +96,4 @@ def borrar_todas_actividades(
     Borra absolutamente todo el historial deportivo del usuario.
     Se usa para resetear datos desde la App.
     """
-    return activities_service.eliminar_actividades(db, usuario_actual)
\ No newline at end of file
+    return activities_service.eliminar_actividades(db, usuario_actual, background_tasks)
\ No newline at end of file
@@ -0,0 +1,33 @@
+# routers/maps.py
+
+"""
+Endpoints de Mapas.
+
+Sirve las teselas PNG del mapa de calor (global y personal) para superponerlas
+en el mapa de la App con el esquema estándar /{z}/{x}/{y}.
+"""
+from fastapi import APIRouter, Depends, Response
+from sqlalchemy.orm import Session
+import auth
+from database import obtener_db
+from services import heatmap_service
+
+router = APIRouter(tags=["Mapas"])
+
+@router.get("/mapa/heatmap/{z}/{x}/{y}.png", response_class=Response)
+async def tesela_heatmap(
+    z: int,
+    x: int,
+    y: int,
+    personal: bool = False,
+    db: Session = Depends(obtener_db),
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+):
+    """
+    Devuelve una tesela del mapa de calor.
+    Por defecto es el mapa global (rutas de perfiles públicos); con ?personal=true solo las rutas del usuario.
+    Ejemplo: /mapa/heatmap/12/2006/1541.png?personal=true
+    """
+    contenido = await heatmap_service.obtener_tesela(db, z, x, y, usuario_actual, personal)
+    return Response(content=contenido, media_type="image/png")
@@ -0,0 +1,65 @@
+# routers/salud.py
+
+"""
+Endpoints de Estado del Servidor.
+
+Para el balanceador de carga, el autoescalado y Prometheus: no requieren la sesión de la App.
+"""
+import hmac
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header, Response, Query
+import arranque
+from config import settings
+from services import province_service
+from utils import metricas, trazas
+from middlewares.metricas import directorio_compartido
+
+router = APIRouter(tags=["Salud"])
+
+def _comprobar_token(authorization: str):
+    """Los endpoints de observabilidad no existen sin settings.METRICAS_TOKEN."""
+    if not settings.METRICAS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(authorization.encode(), f"Bearer {settings.METRICAS_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Error: Token de métricas no válido")
+
+@router.get("/salud/vivo")
+def vivo():
+    """El proceso responde (aunque todavía se esté iniciando)."""
+    return {"estatus": "vivo"}
+
+@router.get("/salud/listo")
+def listo():
+    """El worker ha terminado de iniciarse y puede recibir tráfico."""
+    if not arranque.estado.listo:
+        detalle = "Error: El servidor se está iniciando"
+        if arranque.estado.error:
+            detalle = f"Error: Fallo al iniciar el servidor ({arranque.estado.error})"
+        raise HTTPException(status_code=503, detail=detalle, headers={"Retry-After": "5"})
+    return {
+        "estatus": "listo",
+        "duracion_arranque": arranque.estado.duracion,
+        # Sin límites de provincias las actividades se guardan sin provincia (ver el log del arranque).
+        "deteccion_provincias": province_service.obtener_indice() is not None
+    }
+
+@router.get("/metrics", include_in_schema=False)
+async def exportar_metricas(authorization: str = Header("")):
+    """Métricas de todos los workers en formato de Prometheus. Requiere settings.METRICAS_TOKEN."""
+    _comprobar_token(authorization)
+    # Se ejecuta en el bucle de eventos: los colectores leen el estado del pool de hilos.
+    return Response(
+        content=metricas.exportar(directorio_compartido()),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@router.get("/trazas", include_in_schema=False)
+def ver_trazas(
+    authorization: str = Header(""),
+    ruta: Optional[str] = None,
+    min_ms: float = Query(0, ge=0),
+    limite: int = Query(20, ge=1, le=200)
+):
+    """Trazas guardadas en este worker (las más recientes primero). Requiere settings.METRICAS_TOKEN."""
+    _comprobar_token(authorization)
+    return trazas.recientes(ruta, min_ms, limite)
@@ -0,0 +1,63 @@
+# routers/segments.py
+
+"""
+Endpoints de Segmentos.
+
+Permite definir tramos de ruta populares y consultar su clasificación
+(mejor tiempo de cada usuario) y las marcas propias del usuario.
+"""
+from fastapi import APIRouter, Depends, BackgroundTasks, Request
+from sqlalchemy.orm import Session
+from typing import List
+import auth
+import schemas
+from database import obtener_db
+from services import segment_service, file_service
+
+router = APIRouter(tags=["Segmentos"])
+
+@router.post("/segmento/crear", response_model=schemas.RespuestaSegmento)
+def crear_segmento(
+    datos: schemas.GuardarSegmento,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(obtener_db),
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+):
+    """Crea un segmento y busca en segundo plano los esfuerzos de las actividades ya guardadas."""
+    segmento = segment_service.crear_segmento(db, usuario_actual, datos)
+    background_tasks.add_task(segment_service.emparejar_segmento, segmento.id)
+    return segmento
+
+@router.get("/segmento/{id_segmento}", response_model=schemas.RespuestaSegmento)
+def obtener_segmento(
+    id_segmento: int,
+    db: Session = Depends(obtener_db),
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+):
+    return segment_service.obtener_segmento(db, id_segmento)
+
+@router.get("/segmento/{id_segmento}/clasificacion", response_model=List[schemas.ClasificacionSegmento])
+def clasificacion_segmento(
+    id_segmento: int,
+    request: Request,
+    db: Session = Depends(obtener_db),
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+):
+    """Devuelve el TOP 15 de mejores tiempos del segmento (un tiempo por usuario)."""
+    clasificacion = segment_service.obtener_clasificacion(db, id_segmento)
+    for item in clasificacion:
+        item["foto_perfil"] = file_service.construir_url_foto(item["foto_perfil"], request, tamano=64)
+    return clasificacion
+
+@router.get("/segmento/{id_segmento}/mis_esfuerzos", response_model=List[schemas.EsfuerzoSegmento])
+def mis_esfuerzos_segmento(
+    id_segmento: int,
+    db: Session = Depends(obtener_db),
+    _auth_app=Depends(auth.verificar_sesion_aplicacion),
+    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+):
+    """Devuelve los tiempos del usuario en el segmento, del más rápido al más lento."""
+    return segment_service.obtener_esfuerzos_usuario(db, usuario_actual, id_segmento)
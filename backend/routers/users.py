@@ -6,19 +6,27 @@ Endpoints de Gestión de Perfil de Usuario.
 Define las rutas para el registro de nuevos usuarios y la gestión 
 posterior del perfil (consulta, actualización, foto y borrado).
 """
-from fastapi import APIRouter, Depends, File, UploadFile, Request, Query
+from fastapi import APIRouter, Depends, File, UploadFile, Request, Response, Query, HTTPException
+import anyio
 from sqlalchemy.orm import Session
 import auth
 import schemas
-from services import user_service, file_service
+from services import user_service, file_service, version_service, province_service
 from database import obtener_db
 from fastapi.concurrency import run_in_threadpool
 from typing import List, Optional
 from schemas import ProvinciaEspaña
+from utils.coalescencia import UnSoloVuelo
+from utils import respuestas
+from limiter_config import limitar
 
 router = APIRouter(tags=["Usuarios"])
 
-@router.post("/registro", response_model=schemas.RespuestaRegistro)
+# Tras una notificación del ranking llegan miles de peticiones iguales a la vez.
+vuelos_ranking = UnSoloVuelo("ranking")
+
+@router.post("/registro", response_model=schemas.RespuestaRegistro,
+             dependencies=[Depends(limitar("registro"))])
 def registro(datos: schemas.Registro, 
              db: Session = Depends(obtener_db), 
              _auth_app=Depends(auth.verificar_sesion_aplicacion)):
@@ -29,7 +37,8 @@ def registro(datos: schemas.Registro,
 def informacion_perfil(request: Request,
                       db: Session = Depends(obtener_db), 
                       _auth_app=Depends(auth.verificar_sesion_aplicacion),
-                      usuario_actual: str = Depends(auth.obtener_usuario_actual)):
+                      usuario_actual: str = Depends(auth.obtener_usuario_actual),
+                      _condicional=Depends(version_service.peticion_condicional(version_service.clave_usuario("{usuario_actual}")))):
     """Obtiene los datos del perfil."""
     usuario = user_service.obtener_perfil(db, usuario_actual)
     
@@ -52,7 +61,10 @@ nombre_usuario: str,
     request: Request,
     db: Session = Depends(obtener_db),
     _auth_app=Depends(auth.verificar_sesion_aplicacion),
-    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+    usuario_actual: str = Depends(auth.obtener_usuario_actual),
+    _condicional=Depends(version_service.peticion_condicional(
+        version_service.clave_usuario("{nombre_usuario}"), version_service.clave_actividades("{nombre_usuario}")
+    ))
 ):
     """
     Permite ver la ficha reducida de otro usuario si este tiene el perfil visible.
@@ -62,14 +74,14 @@ nombre_usuario: str,
     usuario_objetivo = user_service.obtener_perfil_publico(db, nombre_usuario)
     
     # Calcular puntos (1 KM = 1 Punto).
-    metros = usuario_objetivo.total_metros if usuario_objetivo.total_metros else 0
+    metros = usuario_objetivo["total_metros"] if usuario_objetivo["total_metros"] else 0
     puntos = int(metros / 1000)
 
     # Devolver solo los datos públicos.
     return {
-        "nombre_usuario": usuario_objetivo.nombre_usuario,
-        "provincia": usuario_objetivo.provincia,
-        "foto_perfil": file_service.construir_url_foto(usuario_objetivo.foto_perfil, request),
+        "nombre_usuario": usuario_objetivo["nombre_usuario"],
+        "provincia": usuario_objetivo["provincia"],
+        "foto_perfil": file_service.construir_url_foto(usuario_objetivo["foto_perfil"], request, tamano=256),
         "total_puntos": puntos
     }
 
@@ -80,18 +92,37 @@ async def foto_perfil(
     usuario_actual: str = Depends(auth.obtener_usuario_actual),
     archivo: UploadFile = File(...)
 ):
-    await file_service.validar_seguridad(archivo)
+    # Se valida la subida por bloques y se deja en un archivo temporal.
+    recibido = await file_service.recibir_subida(archivo)
     # Ejecutar la consulta bloqueante en un hilo separado
-    usuario = await run_in_threadpool(user_service.obtener_perfil, db, usuario_actual)
-    
+    try:
+        usuario = await run_in_threadpool(user_service.obtener_perfil, db, usuario_actual)
+    except HTTPException:
+        await anyio.Path(recibido.ruta_temporal).unlink(missing_ok=True)
+        raise
+
+    # Cerrojo sobre el archivo hasta el commit: otro usuario no puede borrarlo mientras se reutiliza.
+    await run_in_threadpool(file_service.bloquear_foto, db, recibido.sha256)
     # Se procesa la subida.
-    nueva_ruta_foto = await file_service.procesar_subida(archivo, usuario_actual)
+    nueva_ruta_foto = await file_service.procesar_subida(recibido)
     
-    # Si la subida fue exitosa, se actualiza la base de datos.
+    # Si la subida fue exitosa, se actualiza la base de datos y el índice de fotos.
+    foto_anterior = usuario.foto_perfil
     usuario.foto_perfil = nueva_ruta_foto
+    await run_in_threadpool(file_service.registrar_foto, db, usuario, nueva_ruta_foto)
     
     # Ejecutar el commit bloqueante en un hilo separado
     await run_in_threadpool(db.commit)
+    await run_in_threadpool(
+        version_service.incrementar,
+        version_service.clave_usuario(usuario_actual),
+        version_service.CLAVE_RANKING,
+        version_service.CLAVE_USUARIOS
+    )
+
+    # Borrar la foto anterior si ya nadie la usa.
+    if foto_anterior != nueva_ruta_foto:
+        await run_in_threadpool(file_service.liberar_foto, db, foto_anterior, usuario_actual)
     
     return {"estatus": "success", "mensaje": "Foto actualizada correctamente"}
 
@@ -110,11 +141,14 @@ def borrar_perfil(db: Session = Depends(obtener_db),
                   usuario_actual: str = Depends(auth.obtener_usuario_actual)):
     """Elimina la cuenta y borra la foto (local o nube)."""
     usuario = user_service.obtener_perfil(db, usuario_actual)
+    foto_perfil = usuario.foto_perfil
     
-    file_service.borrar_foto(usuario.foto_perfil, usuario_actual)
-    return user_service.eliminar_cuenta(db, usuario)
+    respuesta = user_service.eliminar_cuenta(db, usuario)
+    file_service.liberar_foto(db, foto_perfil, usuario_actual)
+    return respuesta
 
-@router.get("/perfil/buscar", response_model=List[schemas.BusquedaUsuario])
+@router.get("/perfil/buscar", response_model=List[schemas.BusquedaUsuario],
+            dependencies=[Depends(limitar("busqueda"))])
 def buscar_perfil(
     request: Request,
     # 'q' es el parámetro de la URL: /perfil/buscar?q=pepe
@@ -133,40 +167,62 @@ def buscar_perfil(
     # Procesamos para añadir la URL completa de la foto
     lista_final = []
     for usuario in resultados:
-        url_foto = file_service.construir_url_foto(usuario.foto_perfil, request)
+        url_foto = file_service.construir_url_foto(usuario["foto_perfil"], request, tamano=64)
         
         lista_final.append({
-            "nombre_usuario": usuario.nombre_usuario,
+            "nombre_usuario": usuario["nombre_usuario"],
             "foto_perfil": url_foto
         })
         
-    return lista_final
+    return respuestas.respuesta_json(respuestas.serializar(lista_final))
+
+def comprobar_ubicacion(provincia: Optional[ProvinciaEspaña] = None, por_ubicacion: bool = False):
+    """
+    El ranking por ubicación necesita los límites provinciales: sin ellos saldría vacío,
+    como si nadie hubiera hecho actividades allí. Va antes de la comprobación del ETag.
+    """
+    if provincia and por_ubicacion and province_service.obtener_indice() is None:
+        raise HTTPException(status_code=503, detail="Error: El ranking por ubicación no está disponible")
 
-@router.get("/ranking/obtener", response_model=List[schemas.ObtenerRanking])
+@router.get("/ranking/obtener", response_model=List[schemas.ObtenerRanking], responses=respuestas.DOC_MSGPACK)
 def obtener_ranking(
 request: Request,
+    response: Response,
     provincia: Optional[ProvinciaEspaña] = None,
+    por_ubicacion: bool = False,
     db: Session = Depends(obtener_db),
     _auth_app=Depends(auth.verificar_sesion_aplicacion),
-    usuario_actual: str = Depends(auth.obtener_usuario_actual)
+    usuario_actual: str = Depends(auth.obtener_usuario_actual),
+    _ubicacion=Depends(comprobar_ubicacion),
+    _condicional=Depends(version_service.peticion_condicional(version_service.CLAVE_RANKING))
 ):
     """
     Devuelve el TOP 15 de usuarios con más puntos (KM recorridos).
     Permite filtrar por provincia de foma opcional.
+    Con por_ubicacion=true la provincia se refiere a dónde se hicieron las actividades
+    y no a la provincia del perfil del usuario (503 si no hay límites provinciales).
     """
-    # Obtener los datos
-    ranking = user_service.obtener_ranking(db, provincia)
-    
-    # Procesar la URL de las fotos para que la App pueda descargarlas.
-    ranking_final = []
-    for item in ranking:
-        # Usar el servicio existente para crear la URL correcta.
-        url_foto = file_service.construir_url_foto(item["foto_perfil"], request)
-        
-        ranking_final.append({
-            "nombre_usuario": item["nombre_usuario"],
-            "foto_perfil": url_foto,
-            "total_puntos": item["total_puntos"]
-        })
+    def construir_ranking():
+        # Obtener los datos
+        if provincia and por_ubicacion:
+            ranking = user_service.obtener_ranking_por_ubicacion(db, provincia)
+        else:
+            ranking = user_service.obtener_ranking(db, provincia)
         
-    return ranking_final
\ No newline at end of file
+        # Procesar la URL de las fotos para que la App pueda descargarlas.
+        ranking_final = []
+        for item in ranking:
+            # Usar el servicio existente para crear la URL correcta.
+            url_foto = file_service.construir_url_foto(item["foto_perfil"], request, tamano=64)
+            
+            ranking_final.append({
+                "nombre_usuario": item["nombre_usuario"],
+                "foto_perfil": url_foto,
+                "total_puntos": item["total_puntos"]
+            })
+        return respuestas.serializar(ranking_final, formato)
+
+    # Las peticiones simultáneas con los mismos parámetros comparten la consulta y la serialización.
+    formato = respuestas.formato_preferido(request)
+    clave = (request.url.path, str(request.base_url), provincia, por_ubicacion, formato)
+    return respuestas.respuesta_serializada(vuelos_ranking.ejecutar(clave, construir_ranking), formato, response)
\ No newline at end of file
@@ -550,6 +550,60 @@ class RespuestaObtenerActividad(BaseModel):
         from_attributes = True
         populate_by_name = True
 
+class GuardarSegmento(BaseModel):
+    """Esquema para definir un nuevo segmento a partir de un tramo de ruta."""
+    nombre: str = Field(...)
+    ruta_polilinea: str = Field(...)
+
+    @model_validator(mode='before')
+    @classmethod
+    def validar_campos_requeridos_segmento(cls, values: Any) -> Any:
+        """Revisa que se reciban todos los campos obligatorios."""
+        if isinstance(values, dict):
+            if 'nombre' not in values or not values['nombre']:
+                raise ValueError('Error: El nombre del segmento es obligatorio')
+            if 'ruta_polilinea' not in values or not values['ruta_polilinea']:
+                raise ValueError('Error: La ruta del segmento es obligatoria')
+        return values
+
+    @field_validator('nombre')
+    @classmethod
+    def validar_nombre_segmento(cls, v: str) -> str:
+        v = v.strip()
+        if len(v) < 3:
+            raise ValueError('Error: El nombre del segmento es demasiado corto')
+        if len(v) > 60:
+            raise ValueError('Error: El nombre del segmento es demasiado largo')
+        return v
+
+    @field_validator('ruta_polilinea')
+    @classmethod
+    def validar_polilinea_segmento(cls, v: str) -> str:
+        return validators.validar_polilinea_logica(v)
+
+class RespuestaSegmento(BaseModel):
+    id: int
+    nombre: str
+    ruta_polilinea: str
+    distancia: float
+
+    class Config:
+        from_attributes = True
+
+class ClasificacionSegmento(BaseModel):
+    nombre_usuario: str
+    foto_perfil: Optional[str] = None
+    tiempo: int
+    fecha: datetime
+
+class EsfuerzoSegmento(BaseModel):
+    actividad_id: int
+    tiempo: int
+    fecha: datetime
+
+    class Config:
+        from_attributes = True
+
 class ObtenerRanking(BaseModel):
     nombre_usuario: str
     foto_perfil: Optional[str] = None
@@ -557,4 +611,7 @@ class ObtenerRanking(BaseModel):
 
 class RespuestaGenerica(BaseModel):
     estatus: str
-    mensaje: str
\ No newline at end of file
+    mensaje: str
+
+class RespuestaHandshake(BaseModel):
+    app_session_token: str
@@ -0,0 +1,76 @@
+# server.py
+
+"""
+Arranque del Servidor en Producción.
+
+    python server.py [--host 0.0.0.0] [--port 8000] [--workers N]
+    python server.py --init-db      (solo crea las tablas y termina)
+
+1. Crea las tablas una sola vez, antes de lanzar los workers.
+2. Lanza N workers de uvicorn (settings.WORKERS, 0 = uno por núcleo) que comparten el socket.
+   Cada uno abre su parte de settings.DB_CONEXIONES_MAX y de los procesos de renderizado.
+3. Con más de un worker, cada uno se recicla tras settings.MAX_PETICIONES_WORKER peticiones
+   para limitar el crecimiento de memoria (el supervisor de uvicorn lanza otro en su lugar).
+   Con un solo worker no hay supervisor que lo relance, así que no se recicla.
+4. Al apagar (SIGTERM/SIGINT) se dejan de aceptar conexiones y se esperan las peticiones
+   en curso hasta settings.APAGADO_GRACIOSO segundos.
+
+Con más de un worker se usa KV_BACKEND = "sqlite" (se fuerza si está en "memoria") para
+que los ETag, la caché y los límites de peticiones sean comunes a todos.
+
+Detrás de un proxy (Heroku, nginx...) la IP del cliente sale de X-Forwarded-For solo si la
+conexión llega desde una IP de la variable de entorno FORWARDED_ALLOW_IPS (por defecto
+127.0.0.1; "*" si el proxy es el único acceso posible). Si no, todas las peticiones
+parecen venir del proxy y comparten los límites por IP (limiter_config.direccion_cliente).
+"""
+import os
+import logging
+import argparse
+import uvicorn
+from config import settings
+from utils import registro
+
+logger = logging.getLogger("moveon.servidor")
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor multiproceso de MoveOn API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, default=settings.WORKERS)
+    parser.add_argument("--init-db", action="store_true", help="Crear las tablas y terminar")
+    argumentos = parser.parse_args()
+
+    # Inicialización única de la base de datos antes de lanzar los workers.
+    import database
+    database.init_db()
+    if argumentos.init_db:
+        return
+
+    nucleos = os.cpu_count() or 1
+    workers = argumentos.workers or nucleos
+    # Los workers heredan el entorno: saben cuántos son y que no deben repetir la inicialización.
+    if workers > 1 and settings.KV_BACKEND == "memoria":
+        # Con un almacén en memoria por worker, cada uno tendría sus propios límites y contadores.
+        os.environ["KV_BACKEND"] = "sqlite"
+        registro.iniciar()
+        logger.warning("KV_BACKEND='memoria' con varios workers; se usa 'sqlite' (%s).", settings.KV_SQLITE_PATH)
+        registro.detener()
+    os.environ["WORKERS"] = str(workers)
+    os.environ["INIT_DB_AL_ARRANCAR"] = "false"
+    if settings.PROCESS_POOL_WORKERS == 0:
+        # Repartir los núcleos entre los pools de renderizado de todos los workers.
+        os.environ["PROCESS_POOL_WORKERS"] = str(max(1, nucleos // workers))
+
+    uvicorn.run(
+        "main:app",
+        host=argumentos.host,
+        port=argumentos.port,
+        workers=workers,
+        # Sin supervisor (un worker) el proceso terminaría al llegar al límite y nadie lo relanzaría.
+        limit_max_requests=(settings.MAX_PETICIONES_WORKER or None) if workers > 1 else None,
+        timeout_graceful_shutdown=settings.APAGADO_GRACIOSO,
+        proxy_headers=True
+    )
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,9 @@ import auth
 import schemas
 from services import email_service
 from fastapi.concurrency import run_in_threadpool
+from utils.trazas import trazar
 
+@trazar()
 def buscar_por_identificador(db: Session, identificador: str):
     """Búsqueda para login (email o nombre de usuario)."""
     identificador_limpio = identificador.strip()
@@ -18,6 +20,7 @@ def buscar_por_identificador(db: Session, identificador: str):
         (database.Usuario.nombre_usuario == identificador_limpio)
     ).first()
 
+@trazar()
 async def generar_codigo_recuperacion(db: Session, email: str):
     """Genera el OTP de 6 dígitos y lo envía por email."""
     usuario = await run_in_threadpool(
@@ -37,6 +40,7 @@ async def generar_codigo_recuperacion(db: Session, email: str):
     
     return {"estatus": "success", "mensaje": "Si el email corresponde a un usuario recibirá un código"}
 
+@trazar()
 def resetear_contraseña(db: Session, datos: schemas.ConfirmarContraseña):
     """Valida el OTP y actualiza la contraseña."""
     usuario = db.query(database.Usuario).filter(
@@ -1,13 +1,18 @@
 # services/activities_service.py
 
+from sqlalchemy import select
 from sqlalchemy.orm import Session
-from fastapi import HTTPException
+from fastapi import BackgroundTasks, HTTPException
 import database
 import schemas
+from services import heatmap_service, map_snapshot_service, version_service
+from utils.trazas import trazar
 
-def crear_actividad(db: Session, usuario_actual: str, datos: schemas.GuardarActividad):
+@trazar()
+def crear_actividad(db: Session, usuario_actual: str, datos: schemas.GuardarActividad, tareas: BackgroundTasks):
     """
     Busca al usuario y registra una nueva actividad deportiva.
+    La limpieza de las teselas del mapa de calor se hace en 'tareas', tras la respuesta.
     """
     # Se busca el usuario por su nombre (viene del token)
     usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
@@ -31,10 +36,17 @@ def crear_actividad(db: Session, usuario_actual: str, datos: schemas.GuardarActi
     metros_actuales = usuario.total_metros if usuario.total_metros else 0.0
     usuario.total_metros = metros_actuales + datos.distancia
 
-    # Se guarda en BD.
+    # Se guarda en BD junto a su geometría (el flush asigna el id a la actividad).
     db.add(nueva_actividad)
+    db.flush()
+    bbox = heatmap_service.registrar_geometria(db, nueva_actividad)
     db.commit()
     db.refresh(nueva_actividad)
+
+    # Las teselas del mapa de calor por las que pasa la ruta quedan obsoletas. Su clave ya
+    # lleva la versión de los datos, así que borrarlas es solo limpieza de disco: después de responder.
+    tareas.add_task(heatmap_service.invalidar_teselas, usuario.id, bbox)
+    version_service.incrementar(version_service.clave_actividades(usuario_actual), version_service.CLAVE_RANKING)
     
     # Se calculan los puntos para el Ranking
     puntos_actualizados = int(usuario.total_metros / 1000)
@@ -53,6 +65,7 @@ def crear_actividad(db: Session, usuario_actual: str, datos: schemas.GuardarActi
     
     return respuesta
 
+@trazar()
 def obtener_actividad(db: Session, usuario_actual: str, id_actividad: int):
     # Burcar usuario
     usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
@@ -70,27 +83,39 @@ def obtener_actividad(db: Session, usuario_actual: str, id_actividad: int):
 
     return actividad
 
-def obtener_actividades(db: Session, usuario_actual: str, skip: int, limit: int):
+@trazar()
+def obtener_actividades(db: Session, usuario_actual: str, skip: int, limit: int) -> list[dict]:
     """
     Obtiene la lista paginada de actividades de un usuario específico.
+    Devuelve filas de Core como diccionarios con los campos de RespuestaObtenerActividad
+    (sin crear objetos del ORM, la lista se serializa directamente).
     """
     # Se Busca el usuario para obtener su ID.
-    usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
+    usuario_id = db.execute(
+        select(database.Usuario.id).where(database.Usuario.nombre_usuario == usuario_actual)
+    ).scalar()
     
-    if not usuario:
+    if usuario_id is None:
         raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
 
     # Se Hace la query filtrando por ese ID de usuario.
-    actividades = db.query(database.Actividad)\
-        .filter(database.Actividad.usuario_id == usuario.id)\
-        .order_by(database.Actividad.fecha_ruta.desc(), database.Actividad.id.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
+    actividad = database.Actividad
+    filas = db.execute(
+        select(
+            actividad.id, actividad.tipo, actividad.distancia, actividad.duracion,
+            actividad.calorias_quemadas, actividad.ruta_polilinea, actividad.ruta_mapa_url,
+            actividad.fecha_ruta
+        )
+        .where(actividad.usuario_id == usuario_id)
+        .order_by(actividad.fecha_ruta.desc(), actividad.id.desc())
+        .offset(skip)
+        .limit(limit)
+    ).mappings().all()
         
-    return actividades
+    return [{**fila, "nuevo_total_puntos": None} for fila in filas]
 
-def eliminar_actividad(db: Session, usuario_actual: str, id_actividad: int):
+@trazar()
+def eliminar_actividad(db: Session, usuario_actual: str, id_actividad: int, tareas: BackgroundTasks):
     usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
     if not usuario:
         raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
@@ -103,6 +128,9 @@ def eliminar_actividad(db: Session, usuario_actual: str, id_actividad: int):
     if not actividad:
         raise HTTPException(status_code=404, detail="Error: Actividad no encontrada")
 
+    # Zona de la ruta para invalidar el mapa de calor tras el borrado.
+    bbox = heatmap_service.obtener_bbox(db, usuario.id, actividad.id)
+
     # Se resta la distancia en metros recorrida de la ruta al borrarla.
     if usuario.total_metros:
         usuario.total_metros -= actividad.distancia
@@ -110,16 +138,28 @@ def eliminar_actividad(db: Session, usuario_actual: str, id_actividad: int):
         if usuario.total_metros < 0: 
             usuario.total_metros = 0.0
 
+    miniatura = actividad.ruta_mapa_url
     db.delete(actividad)
     db.commit()
+    tareas.add_task(heatmap_service.invalidar_teselas, usuario.id, bbox)
+    version_service.incrementar(version_service.clave_actividades(usuario_actual), version_service.CLAVE_RANKING)
+    map_snapshot_service.borrar_instantaneas(db, [miniatura])
     return {"estatus": "success", "mensaje": "Actividad eliminada"}
 
-def eliminar_actividades(db: Session, usuario_actual: str):
+@trazar()
+def eliminar_actividades(db: Session, usuario_actual: str, tareas: BackgroundTasks):
     # Buscar usuario
     usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
     if not usuario:
         raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
 
+    # Zona que cubren todas sus rutas para invalidar el mapa de calor.
+    bbox = heatmap_service.obtener_bbox(db, usuario.id)
+
+    # Miniaturas de las rutas para borrarlas del almacenamiento.
+    miniaturas = [fila[0] for fila in db.query(database.Actividad.ruta_mapa_url)
+                  .filter(database.Actividad.usuario_id == usuario.id).all()]
+
     # Borrado masivo. Buscar todas las actividades donde el usuario_id coincida y borrarlas de golpe.
     num_borrados = db.query(database.Actividad)\
         .filter(database.Actividad.usuario_id == usuario.id)\
@@ -129,6 +169,9 @@ def eliminar_actividades(db: Session, usuario_actual: str):
     usuario.total_metros = 0.0
 
     db.commit()
+    tareas.add_task(heatmap_service.invalidar_usuario, usuario.id, bbox)
+    version_service.incrementar(version_service.clave_actividades(usuario_actual), version_service.CLAVE_RANKING)
+    map_snapshot_service.borrar_instantaneas(db, miniaturas)
     
     return {
         "estatus": "success", 
@@ -1,12 +1,19 @@
 # services/email_service.py
 
-import aiosmtplib
+import logging
 from email.message import EmailMessage
 from services import email_templates
 from config import settings
+from utils.trazas import trazar
 
+logger = logging.getLogger("moveon.email")
+
+@trazar("email.enviar")
 async def enviar_codigo_recuperacion(email_destino: str, codigo: str):
     """Construye y envía el correo de forma asíncrona."""
+    # Se importa aquí para no cargar el cliente SMTP al arrancar (solo se usa al recuperar contraseñas).
+    import aiosmtplib
+
     # Obtener configuración del entorno 
     smtp_server = settings.EMAIL_HOST
     smtp_port = settings.EMAIL_PORT
@@ -33,6 +40,6 @@ async def enviar_codigo_recuperacion(email_destino: str, codigo: str):
         )
         return True
     except Exception as e:
-        # Imprime el error en consola para debuguear
-        print(f"ERROR AL ENVIAR EMAIL: {str(e)}")
+        # Sin el destinatario: los logs no deben contener emails.
+        logger.error("Error al enviar el email de recuperación: %s", e, exc_info=True)
         return False
\ No newline at end of file
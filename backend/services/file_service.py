@@ -6,23 +6,19 @@ services/file_service.py
 Servicio para manejar la validación y procesamiento de archivos.
 """
 import os
-import time
-import glob
+import uuid
 import hashlib
+from dataclasses import dataclass
 from typing import Optional
+import anyio
 from fastapi import UploadFile, HTTPException, Request
-import cloudinary.uploader
-import cloudinary
-from config import settings
-
-# Si la API está en producción carga variables de Cloudinary.
-if settings.STORAGE_TYPE == "cloudinary":
-    cloudinary.config(
-        cloud_name = settings.CLOUDINARY_CLOUD_NAME,
-        api_key = settings.CLOUDINARY_API_KEY,
-        api_secret = settings.CLOUDINARY_API_SECRET,
-        secure = True
-    )
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+import database
+from services.storage_service import obtener_almacenamiento, ejecutar_desde_hilo, ErrorAlmacenamiento
+from utils import renderizado
+from utils.procesos import ejecutar_en_proceso
+from utils.trazas import trazar
 
 # Firmas de contenido malicioso conocidas.
 MALICIOUS_SIGNATURES = [
@@ -30,127 +26,233 @@ MALICIOUS_SIGNATURES = [
     b'javascript:', b'vbscript:',
     b'.exe\x00', b'.dll\x00'
 ]
+LONGITUD_MAXIMA_FIRMA = max(len(signature) for signature in MALICIOUS_SIGNATURES)
+
+# Límites de la subida: tamaño máximo (2MB) y tamaño de cada bloque leído.
+TAMANO_MAXIMO = 2 * 1024 * 1024
+TAMANO_BLOQUE = 64 * 1024
+
+# Definir extensión segura basada en content_type
+EXTENSIONES_PERMITIDAS = {
+    "image/jpeg": ".jpg",
+    "image/jpg": ".jpg",
+    "image/png": ".png"
+}
+
+# Tamaños (px) de las miniaturas de la foto de perfil que se generan al subirla.
+TAMANOS_DERIVADOS = (64, 256)
+
+@dataclass
+class ArchivoRecibido:
+    """Subida ya validada y escrita en un archivo temporal."""
+    ruta_temporal: str
+    sha256: str
+    tamano: int
+    extension: str
 
-def construir_url_foto(foto_perfil: Optional[str], request: Request) -> Optional[str]:
-    if not foto_perfil:
+def construir_url_archivo(ruta_archivo: Optional[str], request: Request) -> Optional[str]:
+    if not ruta_archivo:
         return None
-    # Si la foto es de Cloudinary (empieza por http), se usa tal cual. Si es local, se construye la URL.
-    if foto_perfil.startswith("http"):
-        return foto_perfil
-    url_base = str(request.base_url).rstrip("/")
-    return f"{url_base}/imagenes/{foto_perfil}"
+    # Si el archivo es de la nube (empieza por http), se usa tal cual. Si no, la construye el almacenamiento.
+    return obtener_almacenamiento().url(ruta_archivo, request)
+
+def construir_url_foto(foto_perfil: Optional[str], request: Request, tamano: Optional[int] = None) -> Optional[str]:
+    """
+    URL de la foto de perfil. Con 'tamano' se devuelve la miniatura cuadrada de ese tamaño
+    (64 para listados, 256 para fichas) en lugar de la foto original.
+    """
+    if not foto_perfil or tamano not in TAMANOS_DERIVADOS:
+        return construir_url_archivo(foto_perfil, request)
+    derivado = renderizado.nombre_derivado(foto_perfil, tamano, "webp")
+    return obtener_almacenamiento().url_miniatura(foto_perfil, derivado, tamano, request)
 
-async def validar_seguridad(archivo: UploadFile):
+@trazar()
+async def recibir_subida(archivo: UploadFile) -> ArchivoRecibido:
+    """
+    Lee la subida por bloques y en una sola pasada:
+    limita el tamaño, busca firmas maliciosas, calcula el SHA-256 y escribe a un temporal.
+    La memoria usada es la de un bloque y el disco se escribe sin bloquear el bucle de eventos.
+    """
     # Validar tipo de archivo.
-    if archivo.content_type not in ["image/jpeg", "image/png", "image/jpg"]:
+    if archivo.content_type not in EXTENSIONES_PERMITIDAS:
         raise HTTPException(status_code=400, detail="Error: Solo imágenes JPG o PNG")
-    
-    # Validar tamaño máximo (2MB). Leemos el tamaño del archivo desde el descriptor.
-    archivo.file.seek(0, os.SEEK_END)
-    tamano = archivo.file.tell()
-    # Vuelve al inicio para poder guardarlo después.
-    archivo.file.seek(0)
-    
-    if tamano > 2 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="Error: La imagen supera los 2MB")
-
-    # Escaneo de firmas maliciosas
-    content = await archivo.read()
-    # Regresar el puntero del archivo al inicio
-    await archivo.seek(0)
-    content_lower = content.lower()
-    for signature in MALICIOUS_SIGNATURES:
-        if signature in content_lower:
-            raise HTTPException(status_code=400, detail="Error: Contenido malicioso detectado")
-    return True
-
-async def procesar_subida(archivo: UploadFile, usuario_actual: str) -> str:
-    """Manejador de subida que elige entre Local o Nube."""
-    if settings.STORAGE_TYPE == "cloudinary":
-        return await guardar_nube(archivo, usuario_actual)
-    return await guardar_local(archivo, usuario_actual)
-
-async def guardar_local(archivo: UploadFile, usuario_actual: str) -> str:
-    """Lógica de guardado local segura."""
-    
-    # Usar la variable de settings.
-    carpeta_imagenes = settings.UPLOAD_DIR
-    # Genera un HASH SHA-256 para el nombre del archivo de la foto de perfil.
-    nombre_seguro = hashlib.sha256(usuario_actual.encode()).hexdigest()
-
-    # Definir extensión segura basada en content_type
-    mapa_extensiones = {
-        "image/jpeg": ".jpg",
-        "image/jpg": ".jpg",
-        "image/png": ".png"
-    }
-    extension = mapa_extensiones.get(archivo.content_type or "", ".jpg")
-
-    # Buscar archivos que contengan el hash.
-    patron_antiguo = os.path.join(carpeta_imagenes, f"perfil_{nombre_seguro}_*")
-    for archivo_antiguo in glob.glob(patron_antiguo):
-        try: 
-            os.remove(archivo_antiguo)
-        except OSError: 
-            pass
 
-    # Construir la ruta final usando el hash.
-    nombre_archivo = f"perfil_{nombre_seguro}_{int(time.time())}{extension}"
-    ruta_final = os.path.join(carpeta_imagenes, nombre_archivo)
+    # En local el temporal va en la misma carpeta que el destino para que el renombrado sea atómico.
+    carpeta = obtener_almacenamiento().carpeta_temporal()
+    await anyio.Path(carpeta).mkdir(parents=True, exist_ok=True)
+    ruta_temporal = os.path.join(carpeta, f".subida_{uuid.uuid4().hex}.tmp")
 
+    resumen = hashlib.sha256()
+    tamano = 0
+    # Final del bloque anterior para detectar firmas partidas entre dos bloques.
+    cola = b""
     try:
-        await archivo.seek(0)
-        contenido = await archivo.read()
-
-        with open(ruta_final, "wb") as buffer:
-            buffer.write(contenido)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Error: No se ha podido guardar la imagen localmente")
-    
-    return nombre_archivo
-
-async def guardar_nube(archivo: UploadFile, usuario_actual: str) -> str:
-    """Lógica de guardado en Cloudinary usando Hash."""
+        async with await anyio.open_file(ruta_temporal, "wb") as destino:
+            while bloque := await archivo.read(TAMANO_BLOQUE):
+                # Validar tamaño máximo (2MB) mientras se lee.
+                tamano += len(bloque)
+                if tamano > TAMANO_MAXIMO:
+                    raise HTTPException(status_code=400, detail="Error: La imagen supera los 2MB")
+
+                # Escaneo de firmas maliciosas
+                ventana = cola + bloque.lower()
+                for signature in MALICIOUS_SIGNATURES:
+                    if signature in ventana:
+                        raise HTTPException(status_code=400, detail="Error: Contenido malicioso detectado")
+                cola = ventana[-(LONGITUD_MAXIMA_FIRMA - 1):]
+
+                resumen.update(bloque)
+                await destino.write(bloque)
+    except BaseException:
+        await anyio.Path(ruta_temporal).unlink(missing_ok=True)
+        raise
+
+    return ArchivoRecibido(
+        ruta_temporal=ruta_temporal,
+        sha256=resumen.hexdigest(),
+        tamano=tamano,
+        extension=EXTENSIONES_PERMITIDAS[archivo.content_type]
+    )
+
+def ruta_contenido(sha256: str, extension: str) -> str:
+    """
+    Clave direccionada por contenido repartida en dos niveles de carpetas (perfiles/ab/cd/abcd...jpg).
+    Así ninguna carpeta crece sin límite y dos fotos idénticas comparten archivo.
+    """
+    return f"perfiles/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+def _clave_bloqueo(referencia: str) -> int:
+    """Entero de 60 bits para pg_advisory_xact_lock a partir del nombre del archivo (el hash del contenido)."""
+    nombre = os.path.splitext(os.path.basename(referencia))[0]
+    return int(hashlib.sha256(nombre.encode()).hexdigest()[:15], 16)
+
+def bloquear_foto(db: Session, referencia: str):
+    """
+    Cerrojo sobre un archivo de foto hasta el final de la transacción de 'db'.
+    La subida lo toma antes de reutilizar el archivo y lo suelta con el commit que registra
+    su fila en fotos_perfil; liberar_foto lo toma antes de comprobar si sigue en uso y de borrarlo.
+    Así nunca se borra un archivo que otro usuario está a punto de registrar.
+    Solo en PostgreSQL (en SQLite las escrituras ya van de una en una).
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": _clave_bloqueo(referencia)})
+
+@trazar()
+async def procesar_subida(recibido: ArchivoRecibido) -> str:
+    """
+    Guarda la subida en el almacenamiento configurado (nombre = hash del contenido).
+    Debe llamarse con bloquear_foto(db, recibido.sha256) tomado hasta el commit de registrar_foto.
+    """
+    almacenamiento = obtener_almacenamiento()
+    clave = ruta_contenido(recibido.sha256, recibido.extension)
+
+    # Deduplicación: si otro usuario ya subió la misma imagen, se reutiliza con sus derivados.
+    if await almacenamiento.exists(clave):
+        await anyio.Path(recibido.ruta_temporal).unlink(missing_ok=True)
+        return clave
+
     try:
-        # Generar el hash del usuario
+        referencia = await almacenamiento.put_archivo(clave, recibido.ruta_temporal)
+    except ErrorAlmacenamiento:
+        raise HTTPException(status_code=500, detail="Error: No se ha podido guardar la imagen")
+
+    if almacenamiento.genera_derivados:
+        # Miniaturas sin metadatos para los listados, generadas en el pool de procesos.
+        try:
+            await ejecutar_en_proceso(renderizado.generar_derivados_foto, almacenamiento.ruta_local(clave), TAMANOS_DERIVADOS)
+        except ValueError:
+            # Pillow no puede abrirla: no es una imagen real aunque lo diga el content_type.
+            await borrar_referencias(_con_derivados(referencia))
+            raise HTTPException(status_code=400, detail="Error: La imagen no es válida")
+
+    return referencia
+
+@trazar()
+def registrar_foto(db: Session, usuario: database.Usuario, nombre_archivo: str):
+    """Apunta en el índice qué archivo usa el usuario (se confirma con el commit de la petición)."""
+    indice = db.query(database.FotoPerfil).filter(database.FotoPerfil.usuario_id == usuario.id).first()
+    if indice:
+        indice.nombre_archivo = nombre_archivo
+    else:
+        db.add(database.FotoPerfil(usuario_id=usuario.id, nombre_archivo=nombre_archivo))
+
+def _con_derivados(referencia: str) -> list[str]:
+    """Referencia de una foto junto a sus miniaturas (si el almacenamiento las genera)."""
+    if not obtener_almacenamiento().genera_derivados:
+        return [referencia]
+    return [referencia] + [
+        renderizado.nombre_derivado(referencia, tamano, formato)
+        for tamano in TAMANOS_DERIVADOS for formato in renderizado.FORMATOS_DERIVADOS
+    ]
+
+@trazar()
+async def borrar_referencias(referencias: list[str]):
+    """Borra varios archivos a la vez. Un fallo no impide borrar el resto."""
+    almacenamiento = obtener_almacenamiento()
+
+    async def borrar(referencia: str):
+        try:
+            await almacenamiento.delete(referencia)
+        except ErrorAlmacenamiento:
+            pass
+
+    async with anyio.create_task_group() as grupo:
+        for referencia in referencias:
+            grupo.start_soon(borrar, referencia)
+
+@trazar()
+def liberar_foto(db: Session, foto_perfil: Optional[str], usuario_actual: str):
+    """
+    Borra la foto que un usuario acaba de dejar de usar (tras cambiarla o borrar la cuenta),
+    salvo que otro usuario tenga la misma imagen. Debe llamarse después del commit.
+    """
+    if not foto_perfil or foto_perfil == "default_avatar.png":
+        return
+
+    nombre = os.path.basename(foto_perfil)
+    if foto_perfil.startswith("http"):
+        # Foto en la nube: el almacenamiento obtiene el identificador desde la URL.
+        referencias = [foto_perfil]
+    elif "/" in foto_perfil:
+        # Foto direccionada por contenido: se reconstruye la clave desde el hash (limpia rutas como ../).
+        sha256, extension = os.path.splitext(nombre)
+        referencias = _con_derivados(ruta_contenido(sha256, extension))
+    else:
+        # Fotos antiguas (perfil_<hash usuario>_<fecha>): solo si el nombre contiene el hash de este usuario.
         usuario_hash = hashlib.sha256(usuario_actual.encode()).hexdigest()
+        if f"perfil_{usuario_hash}" not in nombre:
+            return
+        referencias = _con_derivados(nombre)
 
-        resultado = cloudinary.uploader.upload(
-            archivo.file,
-            folder="perfiles",
-            # Usar el hash en lugar del nombre de usuario legible
-            public_id=f"perfil_{usuario_hash}",
-            overwrite=True,
-            resource_type="image"
-        )
-        return resultado.get("secure_url")
-    except Exception:
-        raise HTTPException(status_code=500, detail="Error: No se ha podido subir la imagen a la nube")
-
-def borrar_foto(foto_perfil: str, usuario_actual: str):
-    """Lógica de borrado permanente segura usando Hashing."""    
-    # Usar las variables de settings.
-    storage = settings.STORAGE_TYPE
-    carpeta_imagenes = settings.UPLOAD_DIR
-    # Generar el mismo hash que se usa al guardar
-    usuario_hash = hashlib.sha256(usuario_actual.encode()).hexdigest()
-
-    if storage != "cloudinary" and foto_perfil and foto_perfil != "default_avatar.png":
+    try:
+        # La comprobación y el borrado van en la misma transacción, con el cerrojo del archivo:
+        # una subida de la misma imagen espera y después la vuelve a subir.
+        bloquear_foto(db, foto_perfil)
+        # Sigue en uso por otro usuario (consulta por índice).
+        en_uso = db.query(database.FotoPerfil.usuario_id)\
+            .filter(database.FotoPerfil.nombre_archivo == foto_perfil)\
+            .first()
+        if not en_uso:
+            ejecutar_desde_hilo(borrar_referencias, referencias)
+    finally:
+        # Fin de la transacción: suelta el cerrojo.
+        db.commit()
+
+@trazar()
+async def guardar_archivo(contenido: bytes, carpeta: str, nombre: str) -> str:
+    """
+    Guarda un archivo generado por el servidor (p.ej. miniaturas de rutas).
+    El nombre debe ser determinista para que el archivo pueda cachearse para siempre.
+    Devuelve la ruta relativa (local) o la URL segura (nube).
+    """
+    try:
+        return await obtener_almacenamiento().put(f"{carpeta}/{nombre}", contenido)
+    except ErrorAlmacenamiento:
+        raise HTTPException(status_code=500, detail="Error: No se ha podido guardar el archivo")
+
+def borrar_archivo(referencia: str, carpeta: str):
+    """Borra un archivo generado por el servidor a partir de su ruta relativa o URL."""
+    if not referencia.startswith("http"):
         # Usar basename por precaución (limpia rutas como ../)
-        nombre_archivo_seguro = os.path.basename(foto_perfil)
-        ruta_foto = os.path.join(carpeta_imagenes, nombre_archivo_seguro)
-        
-        # Solo borrar la foto si el nombre del archivo contiene el hash de este usuario.
-        if f"perfil_{usuario_hash}" in nombre_archivo_seguro:
-            if os.path.exists(ruta_foto):
-                try: 
-                    os.remove(ruta_foto)
-                except OSError: 
-                    pass
-                
-    if storage == "cloudinary":
-        try:
-            # Usar el mismo hash para borrar en la nube
-            cloudinary.uploader.destroy(f"perfiles/perfil_{usuario_hash}")
-        except: 
-            pass
\ No newline at end of file
+        referencia = f"{carpeta}/{os.path.basename(referencia)}"
+    ejecutar_desde_hilo(borrar_referencias, [referencia])
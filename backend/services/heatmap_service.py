@@ -0,0 +1,253 @@
+# services/heatmap_service.py
+
+"""
+Servicio de Mapas de Calor.
+
+Genera las teselas PNG del mapa de calor (global o personal) a partir de las
+polilíneas guardadas. Las teselas se guardan en una caché en disco direccionada
+por contenido: el nombre del archivo es el hash de (ámbito, z, x, y, versión de datos),
+donde la versión se calcula con una consulta agregada sobre las actividades que
+tocan la tesela. Así una tesela nunca se sirve con datos antiguos y solo se
+vuelve a pintar cuando cambian las rutas que pasan por ella.
+"""
+import os
+import shutil
+import hashlib
+import logging
+from typing import Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+import database
+from config import settings
+from services import province_service
+from utils import polilinea as geo
+from utils import renderizado
+from utils.procesos import ejecutar_en_proceso
+from utils.trazas import trazar
+
+logger = logging.getLogger("moveon.heatmap")
+
+AMBITO_GLOBAL = "global"
+
+# Límite de teselas a borrar por nivel de zoom en cada invalidación.
+# Si una ruta cubre más, los niveles superiores se dejan: la clave por versión ya impide servirlos.
+MAX_TESELAS_INVALIDACION = 256
+
+def _ambito(usuario_id: Optional[int]) -> str:
+    return AMBITO_GLOBAL if usuario_id is None else f"usuario_{usuario_id}"
+
+@trazar()
+def registrar_geometria(db: Session, actividad: database.Actividad):
+    """
+    Decodifica la polilínea de una actividad recién creada y guarda su geometría
+    junto a la provincia en la que empieza.
+    Debe llamarse tras el flush (la actividad necesita id). Devuelve el bbox o None.
+    """
+    if not actividad.ruta_polilinea:
+        return None
+    try:
+        puntos = geo.decodificar_polilinea(actividad.ruta_polilinea)
+    except ValueError:
+        return None
+    bbox = geo.calcular_bbox(puntos)
+    if bbox is None:
+        return None
+
+    lat_min, lat_max, lon_min, lon_max = bbox
+    db.add(database.ActividadGeometria(
+        actividad_id=actividad.id,
+        usuario_id=actividad.usuario_id,
+        lat_min=lat_min,
+        lat_max=lat_max,
+        lon_min=lon_min,
+        lon_max=lon_max,
+        lat_inicio=float(puntos[0, 0]),
+        lon_inicio=float(puntos[0, 1]),
+        provincia=province_service.detectar_provincia(float(puntos[0, 0]), float(puntos[0, 1]))
+    ))
+    return bbox
+
+def rellenar_geometrias(db: Session, lote: int = 500) -> int:
+    """
+    Crea la geometría de las actividades que no la tienen (guardadas antes de existir el índice)
+    y detecta la provincia de las geometrías sin ella si ya hay límites provinciales.
+    Idempotente y por lotes (un commit por lote). Devuelve las geometrías creadas.
+    """
+    actividad = database.Actividad
+    geometria = database.ActividadGeometria
+    creadas, ultimo_id = 0, 0
+    while True:
+        # Paginación por id: las polilíneas inválidas no se vuelven a leer en esta pasada.
+        actividades = db.query(actividad)\
+            .filter(
+                actividad.id > ultimo_id,
+                actividad.ruta_polilinea.is_not(None),
+                actividad.ruta_polilinea != "",
+                ~db.query(geometria.actividad_id).filter(geometria.actividad_id == actividad.id).exists()
+            )\
+            .order_by(actividad.id)\
+            .limit(lote)\
+            .all()
+        if not actividades:
+            break
+        for pendiente in actividades:
+            if registrar_geometria(db, pendiente) is not None:
+                creadas += 1
+        ultimo_id = actividades[-1].id
+        db.commit()
+
+    if province_service.obtener_indice() is not None:
+        ultimo_id = 0
+        while True:
+            sin_provincia = db.query(geometria)\
+                .filter(geometria.actividad_id > ultimo_id, geometria.provincia.is_(None))\
+                .order_by(geometria.actividad_id)\
+                .limit(lote)\
+                .all()
+            if not sin_provincia:
+                break
+            provincias = province_service.detectar_provincias(
+                np.array([[fila.lat_inicio, fila.lon_inicio] for fila in sin_provincia])
+            )
+            for fila, provincia in zip(sin_provincia, provincias):
+                fila.provincia = provincia
+            ultimo_id = sin_provincia[-1].actividad_id
+            db.commit()
+    return creadas
+
+def obtener_bbox(db: Session, usuario_id: int, id_actividad: Optional[int] = None):
+    """Devuelve el bbox de una actividad (o de todas las del usuario) para invalidar sus teselas."""
+    geometria = database.ActividadGeometria
+    query = db.query(
+        func.min(geometria.lat_min), func.max(geometria.lat_max),
+        func.min(geometria.lon_min), func.max(geometria.lon_max)
+    ).filter(geometria.usuario_id == usuario_id)
+    if id_actividad is not None:
+        query = query.filter(geometria.actividad_id == id_actividad)
+    bbox = query.one()
+    return None if bbox[0] is None else tuple(bbox)
+
+def invalidar_teselas(usuario_id: int, bbox):
+    """
+    Borra de la caché las teselas (global y personal) que cubren el bbox de una ruta.
+    Solo libera disco (la clave de cada tesela ya incluye la versión): se ejecuta como tarea en segundo plano.
+    """
+    if bbox is None:
+        return
+    for ambito in (AMBITO_GLOBAL, _ambito(usuario_id)):
+        for z in range(settings.HEATMAP_ZOOM_MIN, settings.HEATMAP_ZOOM_MAX + 1):
+            x_min, x_max, y_min, y_max = geo.teselas_en_bbox(bbox, z)
+            if (x_max - x_min + 1) * (y_max - y_min + 1) > MAX_TESELAS_INVALIDACION:
+                break
+            for x in range(x_min, x_max + 1):
+                for y in range(y_min, y_max + 1):
+                    shutil.rmtree(os.path.join(settings.HEATMAP_CACHE_DIR, ambito, str(z), str(x), str(y)), ignore_errors=True)
+
+def invalidar_usuario(usuario_id: int, bbox):
+    """Borra la caché personal completa de un usuario y las teselas globales de su zona."""
+    shutil.rmtree(os.path.join(settings.HEATMAP_CACHE_DIR, _ambito(usuario_id)), ignore_errors=True)
+    invalidar_teselas(usuario_id, bbox)
+
+def _filtrar_tesela(query, bbox, usuario_id: Optional[int]):
+    """Aplica a la consulta el filtro de rutas que intersectan la tesela y el ámbito."""
+    geometria = database.ActividadGeometria
+    lat_min, lat_max, lon_min, lon_max = bbox
+    query = query.filter(
+        geometria.lat_min <= lat_max,
+        geometria.lat_max >= lat_min,
+        geometria.lon_min <= lon_max,
+        geometria.lon_max >= lon_min
+    )
+    if usuario_id is not None:
+        return query.filter(geometria.usuario_id == usuario_id)
+    # El mapa global solo incluye rutas de perfiles públicos.
+    return query.join(database.Usuario, database.Usuario.id == geometria.usuario_id)\
+        .filter(database.Usuario.perfil_visible == True)
+
+def _version_tesela(db: Session, bbox, usuario_id: Optional[int]) -> str:
+    """Huella barata de las rutas de la tesela: cambia si se añade o borra cualquiera."""
+    geometria = database.ActividadGeometria
+    query = db.query(func.count(geometria.actividad_id), func.max(geometria.actividad_id), func.sum(geometria.actividad_id))
+    total, maximo, suma = _filtrar_tesela(query, bbox, usuario_id).one()
+    return f"{total}-{maximo}-{suma}"
+
+def _rutas_tesela(db: Session, bbox, usuario_id: Optional[int]) -> list[str]:
+    """Polilíneas de las rutas que pasan por la tesela (las más recientes primero)."""
+    geometria = database.ActividadGeometria
+    query = db.query(database.Actividad.ruta_polilinea)\
+        .join(geometria, geometria.actividad_id == database.Actividad.id)
+    filas = _filtrar_tesela(query, bbox, usuario_id)\
+        .order_by(geometria.actividad_id.desc())\
+        .limit(settings.HEATMAP_MAX_RUTAS)\
+        .all()
+    return [fila[0] for fila in filas if fila[0]]
+
+def _ruta_cache(ambito: str, z: int, x: int, y: int, version: str) -> str:
+    clave = hashlib.sha256(f"{ambito}:{z}:{x}:{y}:{version}".encode()).hexdigest()
+    return os.path.join(settings.HEATMAP_CACHE_DIR, ambito, str(z), str(x), str(y), f"{clave}.png")
+
+def _leer_cache(ruta: str) -> Optional[bytes]:
+    try:
+        with open(ruta, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+def _escribir_cache(ruta: str, contenido: bytes):
+    """Escritura atómica: otro worker nunca puede leer un PNG a medias."""
+    carpeta = os.path.dirname(ruta)
+    # Las teselas antiguas de esta misma posición ya no se volverán a servir.
+    shutil.rmtree(carpeta, ignore_errors=True)
+    os.makedirs(carpeta, exist_ok=True)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, "wb") as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+def _preparar_tesela(db: Session, z: int, x: int, y: int, usuario_id: Optional[int]):
+    """Parte bloqueante: calcula la versión y busca en caché. Si no está, trae las rutas."""
+    lat_min, lat_max, lon_min, lon_max = geo.tesela_a_bbox(z, x, y)
+    # Margen de unos píxeles para incluir el grosor de las líneas del borde (en Mercator
+    # la tesela abarca menos grados de latitud que de longitud, cada eje con el suyo).
+    margen_lat = (lat_max - lat_min) * 4 / geo.TAMANO_TESELA
+    margen_lon = (lon_max - lon_min) * 4 / geo.TAMANO_TESELA
+    bbox = (lat_min - margen_lat, lat_max + margen_lat, lon_min - margen_lon, lon_max + margen_lon)
+
+    ruta = _ruta_cache(_ambito(usuario_id), z, x, y, _version_tesela(db, bbox, usuario_id))
+    contenido = _leer_cache(ruta)
+    if contenido is not None:
+        return ruta, contenido, None
+    return ruta, None, _rutas_tesela(db, bbox, usuario_id)
+
+@trazar()
+async def obtener_tesela(db: Session, z: int, x: int, y: int, usuario_actual: str, personal: bool) -> bytes:
+    """Devuelve el PNG de la tesela, desde la caché o renderizándolo en el pool de procesos."""
+    if not (settings.HEATMAP_ZOOM_MIN <= z <= settings.HEATMAP_ZOOM_MAX):
+        raise HTTPException(status_code=400, detail="Error: Nivel de zoom no disponible")
+    if not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail="Error: La tesela solicitada no existe")
+
+    usuario_id = None
+    if personal:
+        usuario = await run_in_threadpool(
+            lambda: db.query(database.Usuario.id).filter(database.Usuario.nombre_usuario == usuario_actual).first()
+        )
+        if not usuario:
+            raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
+        usuario_id = usuario.id
+
+    ruta, contenido, polilineas = await run_in_threadpool(_preparar_tesela, db, z, x, y, usuario_id)
+    if contenido is not None:
+        return contenido
+
+    # El rasterizado es CPU puro: se hace en otro proceso para no frenar a los workers de la API.
+    contenido = await ejecutar_en_proceso(renderizado.renderizar_heatmap, polilineas, z, x, y)
+    try:
+        await run_in_threadpool(_escribir_cache, ruta, contenido)
+    except OSError:
+        # Si no se puede cachear se sirve igualmente.
+        logger.exception("No se ha podido guardar la tesela en la caché", extra={"tesela": f"{z}/{x}/{y}"})
+    return contenido
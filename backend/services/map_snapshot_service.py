@@ -0,0 +1,94 @@
+# services/map_snapshot_service.py
+
+"""
+Servicio de Instantáneas de Rutas.
+
+Genera en segundo plano la miniatura PNG de cada ruta a partir de su polilínea
+y la guarda con el mismo almacenamiento que las fotos de perfil (local o nube).
+El nombre del archivo es el hash de la polilínea, así la misma ruta produce
+siempre el mismo archivo y puede cachearse indefinidamente.
+"""
+import hashlib
+import logging
+from typing import Optional
+from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+import database
+from config import settings
+from services import file_service, version_service
+from utils import renderizado
+from utils.procesos import ejecutar_en_proceso
+from utils.trazas import trazar
+
+logger = logging.getLogger("moveon.instantaneas")
+
+CARPETA_RUTAS = "rutas"
+# Versión del dibujo: cambiarla regenera los nombres si cambia el estilo de las miniaturas.
+VERSION_RENDER = "v1"
+
+def nombre_instantanea(polilinea: str) -> str:
+    """Nombre determinista de la miniatura de una polilínea."""
+    clave = f"{VERSION_RENDER}:{settings.SNAPSHOT_ANCHO}x{settings.SNAPSHOT_ALTO}:{polilinea}"
+    return f"ruta_{hashlib.sha256(clave.encode()).hexdigest()}.png"
+
+def es_instantanea_servidor(ruta_mapa_url: Optional[str]) -> bool:
+    """Distingue las miniaturas generadas aquí de las URLs de mapas que envía la App."""
+    if not ruta_mapa_url:
+        return False
+    return f"{CARPETA_RUTAS}/ruta_" in ruta_mapa_url
+
+def _cargar_polilinea(db: Session, actividad_id: int) -> Optional[str]:
+    actividad = db.query(database.Actividad).filter(database.Actividad.id == actividad_id).first()
+    return actividad.ruta_polilinea if actividad else None
+
+def _actualizar_url(db: Session, actividad_id: int, referencia: str):
+    # La actividad puede haberse borrado mientras se generaba la miniatura.
+    actualizadas = db.query(database.Actividad)\
+        .filter(database.Actividad.id == actividad_id)\
+        .update({database.Actividad.ruta_mapa_url: referencia}, synchronize_session=False)
+    db.commit()
+    if actualizadas:
+        # La lista de actividades del usuario cambia (nueva ruta_mapa_url).
+        dueño = db.query(database.Usuario.nombre_usuario)\
+            .join(database.Actividad, database.Actividad.usuario_id == database.Usuario.id)\
+            .filter(database.Actividad.id == actividad_id)\
+            .first()
+        if dueño:
+            version_service.incrementar(version_service.clave_actividades(dueño[0]))
+
+@trazar()
+async def generar_instantanea(actividad_id: int):
+    """
+    Tarea en segundo plano tras guardar una actividad.
+    Usa su propia sesión porque la de la petición ya está cerrada cuando se ejecuta.
+    """
+    db = database.SessionLocal()
+    try:
+        polilinea = await run_in_threadpool(_cargar_polilinea, db, actividad_id)
+        if not polilinea:
+            return
+
+        try:
+            contenido = await ejecutar_en_proceso(
+                renderizado.renderizar_instantanea_ruta, polilinea, settings.SNAPSHOT_ANCHO, settings.SNAPSHOT_ALTO
+            )
+        except ValueError:
+            # Polilínea corrupta: se conserva la URL que envió la App.
+            return
+
+        referencia = await file_service.guardar_archivo(contenido, CARPETA_RUTAS, nombre_instantanea(polilinea))
+        await run_in_threadpool(_actualizar_url, db, actividad_id, referencia)
+    except Exception:
+        # Un fallo en la miniatura no debe afectar a la actividad ya guardada (se queda la URL de la App).
+        logger.exception("No se ha podido generar la miniatura de la ruta", extra={"actividad_id": actividad_id})
+    finally:
+        db.close()
+
+def borrar_instantaneas(db: Session, referencias: list[Optional[str]]):
+    """Borra las miniaturas que ya no usa ninguna actividad (pueden compartirse si la ruta es idéntica)."""
+    for referencia in {r for r in referencias if es_instantanea_servidor(r)}:
+        en_uso = db.query(database.Actividad.id)\
+            .filter(database.Actividad.ruta_mapa_url == referencia)\
+            .first()
+        if not en_uso:
+            file_service.borrar_archivo(referencia, CARPETA_RUTAS)
@@ -0,0 +1,182 @@
+# services/province_service.py
+
+"""
+Servicio de Detección de Provincias.
+
+Determina en qué provincia empieza cada actividad sin servicios externos, a partir
+de los límites provinciales en GeoJSON (WGS84) indicados en settings.PROVINCIAS_GEOJSON
+(p.ej. los recintos provinciales del IGN/CNIG convertidos a GeoJSON).
+
+Los polígonos se cargan una sola vez y se reparten en una rejilla de celdas, así
+cada consulta solo comprueba (con un test punto-en-polígono vectorizado) las
+provincias cuyo rectángulo toca la celda del punto.
+Si el archivo no existe o no es válido se registra un error y la detección queda
+desactivada (devuelve None); con settings.PROVINCIAS_OBLIGATORIAS el worker no llega a estar listo.
+"""
+import json
+import math
+import logging
+import unicodedata
+from typing import Optional
+import numpy as np
+from config import settings
+from schemas import ProvinciaEspaña
+
+logger = logging.getLogger("moveon.provincias")
+
+# Tamaño de celda de la rejilla en grados.
+TAMANO_CELDA = 0.25
+
+# Nombres alternativos habituales en las fuentes oficiales (cooficiales o bilingües).
+ALIAS_PROVINCIAS = {
+    "illes balears": ProvinciaEspaña.BALEARES,
+    "balears, illes": ProvinciaEspaña.BALEARES,
+    "baleares": ProvinciaEspaña.BALEARES,
+    "araba/alava": ProvinciaEspaña.ALAVA,
+    "araba": ProvinciaEspaña.ALAVA,
+    "gipuzkoa": ProvinciaEspaña.GUIPUZCOA,
+    "bizkaia": ProvinciaEspaña.VIZCAYA,
+    "coruna, a": ProvinciaEspaña.A_CORUNA,
+    "la coruna": ProvinciaEspaña.A_CORUNA,
+    "castello/castellon": ProvinciaEspaña.CASTELLON,
+    "castello": ProvinciaEspaña.CASTELLON,
+    "alacant/alicante": ProvinciaEspaña.ALICANTE,
+    "alacant": ProvinciaEspaña.ALICANTE,
+    "valencia/valencia": ProvinciaEspaña.VALENCIA,
+    "rioja, la": ProvinciaEspaña.RIOJA,
+    "palmas, las": ProvinciaEspaña.LAS_PALMAS,
+    "gerona": ProvinciaEspaña.GIRONA,
+    "lerida": ProvinciaEspaña.LLEIDA,
+    "orense": ProvinciaEspaña.OURENSE,
+}
+
+# Propiedades del GeoJSON donde se busca el nombre de la provincia.
+CAMPOS_NOMBRE = ("provincia", "nombre", "NAMEUNIT", "name", "NAME", "NAME_2")
+
+class _IndiceProvincias:
+    """Polígonos de las provincias como arrays de aristas y rejilla de candidatos."""
+
+    def __init__(self, provincias: list[str], aristas: list[np.ndarray], rejilla: dict):
+        self.provincias = provincias
+        # Por provincia: array (N, 4) con [x1, y1, x2, y2] (lon, lat) de todas sus aristas.
+        self.aristas = aristas
+        self.rejilla = rejilla
+
+_indice: Optional[_IndiceProvincias] = None
+_cargado = False
+
+def _normalizar(nombre: str) -> str:
+    sin_tildes = unicodedata.normalize("NFKD", nombre).encode("ascii", "ignore").decode()
+    return " ".join(sin_tildes.lower().split())
+
+def _provincia_desde_nombre(nombre: str) -> Optional[str]:
+    normalizado = _normalizar(nombre)
+    for provincia in ProvinciaEspaña:
+        if _normalizar(provincia.value) == normalizado:
+            return provincia.value
+    alias = ALIAS_PROVINCIAS.get(normalizado)
+    return alias.value if alias else None
+
+def _anillos(geometria: dict) -> list[np.ndarray]:
+    """Todos los anillos (exteriores y huecos) de un Polygon o MultiPolygon."""
+    if geometria["type"] == "Polygon":
+        poligonos = [geometria["coordinates"]]
+    elif geometria["type"] == "MultiPolygon":
+        poligonos = geometria["coordinates"]
+    else:
+        return []
+    return [np.asarray(anillo, dtype=np.float64)[:, :2] for poligono in poligonos for anillo in poligono]
+
+def _celda(lon: float, lat: float):
+    return math.floor(lon / TAMANO_CELDA), math.floor(lat / TAMANO_CELDA)
+
+def _construir_indice(ruta: str) -> _IndiceProvincias:
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+
+    provincias: list[str] = []
+    aristas: list[np.ndarray] = []
+    rejilla: dict = {}
+
+    for feature in datos.get("features", []):
+        propiedades = feature.get("properties") or {}
+        nombre = next((propiedades[c] for c in CAMPOS_NOMBRE if propiedades.get(c)), None)
+        provincia = _provincia_desde_nombre(str(nombre)) if nombre else None
+        anillos = _anillos(feature.get("geometry") or {})
+        if not provincia or not anillos:
+            continue
+
+        indice = len(provincias)
+        provincias.append(provincia)
+        aristas.append(np.vstack([np.hstack((a[:-1], a[1:])) for a in anillos if len(a) > 1]))
+
+        # Se registra la provincia en todas las celdas que toca el rectángulo de cada anillo.
+        for anillo in anillos:
+            x_min, y_min = _celda(anillo[:, 0].min(), anillo[:, 1].min())
+            x_max, y_max = _celda(anillo[:, 0].max(), anillo[:, 1].max())
+            for cx in range(x_min, x_max + 1):
+                for cy in range(y_min, y_max + 1):
+                    candidatos = rejilla.setdefault((cx, cy), [])
+                    if indice not in candidatos:
+                        candidatos.append(indice)
+
+    return _IndiceProvincias(provincias, aristas, rejilla)
+
+def obtener_indice(reintentar: bool = False) -> Optional[_IndiceProvincias]:
+    """
+    Carga el índice la primera vez que se necesita (None si no hay datos de límites).
+    Con reintentar=True se vuelve a intentar la carga si la anterior falló.
+    """
+    global _indice, _cargado
+    if not _cargado or (reintentar and _indice is None):
+        _cargado = True
+        try:
+            _indice = _construir_indice(settings.PROVINCIAS_GEOJSON)
+        except (OSError, ValueError, KeyError) as e:
+            _indice = None
+            logger.error(
+                "Detección de provincias desactivada: no se ha podido cargar %s (%s). "
+                "Las actividades se guardarán sin provincia y el ranking por ubicación quedará vacío.",
+                settings.PROVINCIAS_GEOJSON, e
+            )
+    return _indice
+
+def _dentro(aristas: np.ndarray, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """
+    Test punto-en-polígono (regla par-impar) vectorizado sobre puntos y aristas.
+    Con par-impar los huecos y las islas de un MultiPolygon se resuelven solos.
+    """
+    x1, y1, x2, y2 = aristas.T
+    lon = lons[:, None]
+    lat = lats[:, None]
+    cruza = (y1 > lat) != (y2 > lat)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_corte = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+    return ((cruza & (lon < x_corte)).sum(axis=1) % 2) == 1
+
+def detectar_provincias(puntos: np.ndarray) -> list[Optional[str]]:
+    """Provincia de cada punto [latitud, longitud] (None si cae fuera de España o no hay datos)."""
+    indice = obtener_indice()
+    resultado: list[Optional[str]] = [None] * len(puntos)
+    if indice is None or len(puntos) == 0:
+        return resultado
+
+    # Se agrupan los puntos por celda para comprobar cada provincia candidata una sola vez.
+    celdas: dict = {}
+    for posicion, (lat, lon) in enumerate(puntos):
+        celdas.setdefault(_celda(lon, lat), []).append(posicion)
+
+    for celda, posiciones in celdas.items():
+        pendientes = np.array(posiciones)
+        for candidato in indice.rejilla.get(celda, []):
+            if pendientes.size == 0:
+                break
+            dentro = _dentro(indice.aristas[candidato], puntos[pendientes, 1], puntos[pendientes, 0])
+            for posicion in pendientes[dentro]:
+                resultado[posicion] = indice.provincias[candidato]
+            pendientes = pendientes[~dentro]
+    return resultado
+
+def detectar_provincia(lat: float, lon: float) -> Optional[str]:
+    """Provincia en la que cae un punto."""
+    return detectar_provincias(np.array([[lat, lon]]))[0]
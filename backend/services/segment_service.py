@@ -0,0 +1,319 @@
+# services/segment_service.py
+
+"""
+Servicio de Segmentos.
+
+Detecta qué segmentos recorre cada actividad nueva y guarda el esfuerzo (tiempo)
+para las clasificaciones. Comparar cada actividad con todos los segmentos sería
+demasiado caro, así que se hace en dos fases:
+    1. Filtro de candidatos: solo los segmentos cuya celda geohash de salida pisa la ruta
+       (la ruta se densifica para no saltarse celdas entre dos puntos GPS separados).
+    2. Comprobación vectorizada: distancia de la salida y la llegada del segmento a los
+       tramos de la ruta y de cada punto del segmento a la ruta.
+"""
+from typing import Optional
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+import database
+import schemas
+from utils import polilinea as geo
+from utils.trazas import trazar
+
+# Precisión geohash del índice (celdas de ~1,2 km x 0,6 km).
+PRECISION_CELDA = 6
+# Distancia máxima (m) entre la ruta y el trazado del segmento para considerarlo recorrido.
+TOLERANCIA_METROS = 25.0
+# La parte de la ruta que cubre el segmento no puede ser mucho más larga que él (evita contar bucles).
+FACTOR_LONGITUD_MAXIMA = 1.5
+# Longitud mínima de un segmento en metros.
+DISTANCIA_MINIMA_SEGMENTO = 200.0
+
+def _celdas_alrededor(puntos: np.ndarray, radio: float) -> set[str]:
+    """
+    Celdas geohash que cubren el cuadrado de lado 2 * radio (m) alrededor de cada punto.
+    Como la celda es mucho mayor que el radio, basta con las 4 esquinas.
+    """
+    delta_lat = radio / geo.METROS_POR_GRADO
+    delta_lon = delta_lat / np.maximum(np.cos(np.radians(puntos[:, 0])), 1e-6)
+    lat, lon = puntos[:, 0], puntos[:, 1]
+    esquinas = np.concatenate([
+        np.column_stack((lat + signo_lat * delta_lat, lon + signo_lon * delta_lon))
+        for signo_lat in (-1, 1) for signo_lon in (-1, 1)
+    ])
+    return set(np.unique(geo.codificar_geohash(esquinas, PRECISION_CELDA)).tolist())
+
+def _celdas_salida(lat: float, lon: float) -> set[str]:
+    """Celdas geohash que cubren el cuadrado de tolerancia alrededor de la salida de un segmento."""
+    return _celdas_alrededor(np.array([[lat, lon]]), TOLERANCIA_METROS)
+
+def _celdas_ruta(puntos: np.ndarray) -> set[str]:
+    """
+    Celdas geohash que pisa la ruta, incluidas las que cruzan sus tramos entre dos puntos.
+    Con puntos cada TOLERANCIA_METROS como mucho, cualquier punto de un tramo queda en el
+    cuadrado de tolerancia de alguno de ellos.
+    """
+    return _celdas_alrededor(geo.densificar(puntos, TOLERANCIA_METROS), TOLERANCIA_METROS)
+
+def _pasos_por(punto: np.ndarray, puntos: np.ndarray, acumulada: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pasadas de la ruta a menos de TOLERANCIA_METROS del punto: tramo más cercano de cada pasada
+    y distancia recorrida (m) en la proyección del punto sobre él.
+    """
+    distancias, t = geo.proyectar_en_tramos(punto, puntos)
+    cerca = np.flatnonzero(distancias <= TOLERANCIA_METROS)
+    # Tramos consecutivos cerca del punto son la misma pasada: se queda el más cercano
+    # (en los vecinos la proyección cae en un extremo y adelantaría o retrasaría el paso).
+    pasadas = np.split(cerca, np.flatnonzero(np.diff(cerca) > 1) + 1) if cerca.size else []
+    tramos = np.array([pasada[np.argmin(distancias[pasada])] for pasada in pasadas], dtype=np.int64)
+    posiciones = acumulada[tramos] + t[tramos] * (acumulada[tramos + 1] - acumulada[tramos])
+    return tramos, posiciones
+
+@trazar()
+def crear_segmento(db: Session, usuario_actual: str, datos: schemas.GuardarSegmento):
+    """Registra un segmento nuevo y lo indexa por las celdas de su punto de salida."""
+    usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
+
+    try:
+        puntos = geo.decodificar_polilinea(datos.ruta_polilinea)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Error: La ruta del segmento no es válida")
+    if len(puntos) < 2:
+        raise HTTPException(status_code=400, detail="Error: La ruta del segmento no es válida")
+
+    distancia = float(geo.distancias_acumuladas(puntos)[-1])
+    if distancia < DISTANCIA_MINIMA_SEGMENTO:
+        raise HTTPException(status_code=400, detail="Error: El segmento debe medir al menos 200 metros")
+
+    segmento = database.Segmento(
+        creador_id=usuario.id,
+        nombre=datos.nombre,
+        ruta_polilinea=datos.ruta_polilinea,
+        distancia=distancia,
+        lat_inicio=float(puntos[0, 0]),
+        lon_inicio=float(puntos[0, 1]),
+        lat_fin=float(puntos[-1, 0]),
+        lon_fin=float(puntos[-1, 1])
+    )
+    db.add(segmento)
+    db.flush()
+    for celda in _celdas_salida(segmento.lat_inicio, segmento.lon_inicio):
+        db.add(database.SegmentoCelda(celda=celda, segmento_id=segmento.id))
+    db.commit()
+    db.refresh(segmento)
+    return segmento
+
+def _tiempo_en_segmento(puntos: np.ndarray, acumulada: np.ndarray, duracion: int,
+                        segmento: np.ndarray, distancia_segmento: float) -> Optional[int]:
+    """
+    Busca el mejor paso de la ruta por el segmento y devuelve su tiempo estimado en segundos.
+    Las actividades no guardan marcas de tiempo por punto, así que el tiempo se reparte
+    de forma proporcional a la distancia (ritmo medio de la actividad).
+    La salida y la llegada se miden contra los tramos de la ruta (no solo sus puntos), y
+    la distancia recorrida se interpola en la proyección sobre el tramo.
+    """
+    if acumulada[-1] <= 0:
+        return None
+    tramos_salida, salidas = _pasos_por(segmento[0], puntos, acumulada)
+    tramos_llegada, llegadas = _pasos_por(segmento[-1], puntos, acumulada)
+    if salidas.size == 0 or llegadas.size == 0:
+        return None
+
+    mejor = None
+    # Para cada pasada por la salida se toma la primera llegada posterior
+    # (las posiciones crecen con el tramo, así que 'llegadas' ya está ordenado).
+    for i, salida in zip(tramos_salida, salidas):
+        posicion = np.searchsorted(llegadas, salida, side="right")
+        if posicion == llegadas.size:
+            break
+        j = tramos_llegada[posicion]
+        recorrido = llegadas[posicion] - salida
+        if recorrido > distancia_segmento * FACTOR_LONGITUD_MAXIMA:
+            continue
+        if mejor is not None and recorrido >= mejor:
+            continue
+        # Todos los puntos del segmento deben quedar cerca de los tramos de ruta recorridos.
+        if geo.distancia_a_polilinea(segmento, puntos[i:j + 2]).max() <= TOLERANCIA_METROS:
+            mejor = recorrido
+
+    if mejor is None:
+        return None
+    return max(1, int(round(duracion * mejor / acumulada[-1])))
+
+def _registrar_esfuerzos(db: Session, actividad: database.Actividad, candidatos: list[database.Segmento]) -> int:
+    """Compara la actividad con los segmentos candidatos y guarda los esfuerzos encontrados."""
+    try:
+        puntos = geo.decodificar_polilinea(actividad.ruta_polilinea or "")
+    except ValueError:
+        return 0
+    if len(puntos) < 2:
+        return 0
+    acumulada = geo.distancias_acumuladas(puntos)
+
+    # Segmentos ya registrados para esta actividad (p.ej. si se emparejó al crear el segmento).
+    ya_registrados = {fila[0] for fila in db.query(database.EsfuerzoSegmento.segmento_id)
+                      .filter(database.EsfuerzoSegmento.actividad_id == actividad.id).all()}
+
+    encontrados = 0
+    for segmento in candidatos:
+        if segmento.id in ya_registrados:
+            continue
+        tiempo = _tiempo_en_segmento(
+            puntos, acumulada, actividad.duracion,
+            geo.decodificar_polilinea(segmento.ruta_polilinea), segmento.distancia
+        )
+        if tiempo is None:
+            continue
+        db.add(database.EsfuerzoSegmento(
+            segmento_id=segmento.id,
+            usuario_id=actividad.usuario_id,
+            actividad_id=actividad.id,
+            tiempo=tiempo,
+            fecha=actividad.fecha_ruta
+        ))
+        encontrados += 1
+    return encontrados
+
+@trazar()
+def emparejar_actividad(actividad_id: int):
+    """
+    Tarea en segundo plano tras guardar una actividad: detecta los segmentos recorridos.
+    Usa su propia sesión porque la de la petición ya está cerrada cuando se ejecuta.
+    """
+    db = database.SessionLocal()
+    try:
+        actividad = db.query(database.Actividad).filter(database.Actividad.id == actividad_id).first()
+        if not actividad or not actividad.ruta_polilinea:
+            return
+        try:
+            puntos = geo.decodificar_polilinea(actividad.ruta_polilinea)
+        except ValueError:
+            return
+        if len(puntos) < 2:
+            return
+
+        # Fase 1: candidatos por celdas geohash (consulta indexada por la clave primaria).
+        celdas = sorted(_celdas_ruta(puntos))
+        candidatos = db.query(database.Segmento)\
+            .join(database.SegmentoCelda, database.SegmentoCelda.segmento_id == database.Segmento.id)\
+            .filter(database.SegmentoCelda.celda.in_(celdas))\
+            .distinct()\
+            .all()
+        if not candidatos:
+            return
+
+        # Fase 2: comprobación geométrica vectorizada.
+        if _registrar_esfuerzos(db, actividad, candidatos):
+            db.commit()
+    except IntegrityError:
+        # Otra tarea registró el mismo esfuerzo a la vez.
+        db.rollback()
+    finally:
+        db.close()
+
+@trazar()
+def emparejar_segmento(segmento_id: int, limite: int = 5000):
+    """
+    Tarea en segundo plano tras crear un segmento: busca esfuerzos en actividades ya guardadas.
+    El índice de geometría de las actividades reduce los candidatos a las rutas cuyo
+    rectángulo contiene la salida y la llegada del segmento.
+    """
+    db = database.SessionLocal()
+    try:
+        segmento = db.query(database.Segmento).filter(database.Segmento.id == segmento_id).first()
+        if not segmento:
+            return
+        geometria = database.ActividadGeometria
+        margen = TOLERANCIA_METROS / geo.METROS_POR_GRADO
+        lat_min = min(segmento.lat_inicio, segmento.lat_fin)
+        lat_max = max(segmento.lat_inicio, segmento.lat_fin)
+        lon_min = min(segmento.lon_inicio, segmento.lon_fin)
+        lon_max = max(segmento.lon_inicio, segmento.lon_fin)
+
+        actividades = db.query(database.Actividad)\
+            .join(geometria, geometria.actividad_id == database.Actividad.id)\
+            .filter(
+                geometria.lat_min <= lat_min + margen,
+                geometria.lat_max >= lat_max - margen,
+                geometria.lon_min <= lon_min + margen,
+                geometria.lon_max >= lon_max - margen
+            )\
+            .order_by(database.Actividad.id.desc())\
+            .limit(limite)\
+            .all()
+
+        encontrados = 0
+        for actividad in actividades:
+            encontrados += _registrar_esfuerzos(db, actividad, [segmento])
+        if encontrados:
+            db.commit()
+    except IntegrityError:
+        # Otra tarea registró el mismo esfuerzo a la vez.
+        db.rollback()
+    finally:
+        db.close()
+
+def obtener_segmento(db: Session, segmento_id: int) -> database.Segmento:
+    segmento = db.query(database.Segmento).filter(database.Segmento.id == segmento_id).first()
+    if not segmento:
+        raise HTTPException(status_code=404, detail="Error: Segmento no encontrado")
+    return segmento
+
+@trazar()
+def obtener_clasificacion(db: Session, segmento_id: int, limite: int = 15):
+    """
+    Clasificación del segmento: mejor tiempo de cada usuario con perfil público.
+    Usa el índice (segmento_id, tiempo) de los esfuerzos.
+    """
+    obtener_segmento(db, segmento_id)
+    esfuerzo = database.EsfuerzoSegmento
+
+    mejores = db.query(
+            esfuerzo.usuario_id.label("usuario_id"),
+            func.min(esfuerzo.tiempo).label("tiempo")
+        )\
+        .filter(esfuerzo.segmento_id == segmento_id)\
+        .group_by(esfuerzo.usuario_id)\
+        .subquery()
+
+    resultados = db.query(
+            database.Usuario.nombre_usuario,
+            database.Usuario.foto_perfil,
+            mejores.c.tiempo,
+            func.min(esfuerzo.fecha)
+        )\
+        .join(mejores, mejores.c.usuario_id == database.Usuario.id)\
+        .join(esfuerzo, (esfuerzo.usuario_id == mejores.c.usuario_id) &
+                        (esfuerzo.segmento_id == segmento_id) &
+                        (esfuerzo.tiempo == mejores.c.tiempo))\
+        .filter(database.Usuario.perfil_visible == True)\
+        .group_by(database.Usuario.nombre_usuario, database.Usuario.foto_perfil, mejores.c.tiempo)\
+        .order_by(mejores.c.tiempo.asc())\
+        .limit(limite)\
+        .all()
+
+    return [
+        {"nombre_usuario": nombre, "foto_perfil": foto, "tiempo": tiempo, "fecha": fecha}
+        for nombre, foto, tiempo, fecha in resultados
+    ]
+
+@trazar()
+def obtener_esfuerzos_usuario(db: Session, usuario_actual: str, segmento_id: int, limite: int = 20):
+    """Esfuerzos del usuario en un segmento, del más rápido al más lento."""
+    obtener_segmento(db, segmento_id)
+    usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
+    if not usuario:
+        raise HTTPException(status_code=404, detail="Error: Usuario no encontrado")
+
+    return db.query(database.EsfuerzoSegmento)\
+        .filter(
+            database.EsfuerzoSegmento.usuario_id == usuario.id,
+            database.EsfuerzoSegmento.segmento_id == segmento_id
+        )\
+        .order_by(database.EsfuerzoSegmento.tiempo.asc())\
+        .limit(limite)\
+        .all()
@@ -0,0 +1,303 @@
+# services/storage_service.py
+
+"""
+Servicio de Almacenamiento de Archivos.
+
+Interfaz común (put/get/delete/url) para guardar imágenes en distintos destinos:
+    - AlmacenamientoLocal: carpeta settings.UPLOAD_DIR servida en /imagenes.
+    - AlmacenamientoCloudinary: nube. El SDK es bloqueante, así que cada llamada se
+      ejecuta en un pool de hilos acotado, con tiempo máximo y reintentos.
+    - AlmacenamientoMemoria: diccionario en memoria, para pruebas y desarrollo.
+
+Los archivos se identifican con una clave relativa (p.ej. "perfiles/ab/cd/hash.png").
+'put' devuelve la referencia que se guarda en la base de datos: la propia clave
+(local/memoria) o la URL segura (nube).
+"""
+import os
+import io
+import re
+import asyncio
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+import anyio
+from fastapi import FastAPI, Request
+from config import settings
+from utils.trazas import trazar
+
+class ErrorAlmacenamiento(Exception):
+    """Fallo al guardar, leer o borrar en el almacenamiento."""
+
+class Almacenamiento(ABC):
+    """Interfaz base de los almacenamientos."""
+
+    # Si es True, las miniaturas se generan en el servidor (necesitan ruta_local).
+    genera_derivados = False
+
+    def carpeta_temporal(self) -> str:
+        """Carpeta para los archivos temporales de subida."""
+        return tempfile.gettempdir()
+
+    def ruta_local(self, clave: str) -> Optional[str]:
+        """Ruta en disco de un archivo, si el almacenamiento es local."""
+        return None
+
+    def preparar(self, app: FastAPI):
+        """Configuración al arrancar la API (carpetas, montajes...)."""
+
+    @abstractmethod
+    async def put(self, clave: str, contenido: bytes) -> str:
+        """Guarda el contenido y devuelve la referencia para la base de datos."""
+
+    async def put_archivo(self, clave: str, ruta_temporal: str) -> str:
+        """Guarda un archivo temporal y lo consume (el temporal deja de existir)."""
+        try:
+            contenido = await anyio.Path(ruta_temporal).read_bytes()
+            return await self.put(clave, contenido)
+        finally:
+            await anyio.Path(ruta_temporal).unlink(missing_ok=True)
+
+    @abstractmethod
+    async def get(self, referencia: str) -> Optional[bytes]:
+        """Contenido de un archivo (None si no existe o no se puede leer desde aquí)."""
+
+    @abstractmethod
+    async def exists(self, clave: str) -> bool:
+        """Si ya hay un archivo con esa clave (deduplicación de subidas)."""
+
+    @abstractmethod
+    async def delete(self, referencia: str):
+        """Borra un archivo; no falla si ya no existe."""
+
+    def url(self, referencia: str, request: Request) -> str:
+        """URL pública de un archivo. Las referencias que ya son URL se usan tal cual."""
+        if referencia.startswith("http"):
+            return referencia
+        url_base = str(request.base_url).rstrip("/")
+        return f"{url_base}/imagenes/{referencia}"
+
+    def url_miniatura(self, referencia: str, derivado: str, tamano: int, request: Request) -> str:
+        """URL de la miniatura de una imagen; por defecto la original si no existe el derivado."""
+        return self.url(referencia, request)
+
+def _clave_segura(clave: str) -> str:
+    """Normaliza la clave y evita salir de la carpeta base (rutas como ../)."""
+    partes = [p for p in clave.replace("\\", "/").split("/") if p not in ("", ".", "..")]
+    return "/".join(partes)
+
+class AlmacenamientoLocal(Almacenamiento):
+    """Archivos en disco dentro de settings.UPLOAD_DIR."""
+
+    genera_derivados = True
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+
+    def carpeta_temporal(self) -> str:
+        # Misma carpeta que el destino para que el renombrado sea atómico.
+        return self.directorio
+
+    def ruta_local(self, clave: str) -> str:
+        return os.path.join(self.directorio, _clave_segura(clave))
+
+    def preparar(self, app: FastAPI):
+        # Crear la carpeta para guardar imagenes en local si no existe.
+        os.makedirs(self.directorio, exist_ok=True)
+        # Se monta la carpeta para que sea accesible vía URL
+        # http://127.0.0.1:8000/imagenes/default_avatar.jpg con caché inmutable y ETag por contenido.
+        from utils.estaticos import ArchivosInmutables
+        app.mount("/imagenes", ArchivosInmutables(directory=self.directorio), name="imagenes")
+
+    @trazar("almacenamiento.put")
+    async def put(self, clave: str, contenido: bytes) -> str:
+        destino = anyio.Path(self.ruta_local(clave))
+        temporal = anyio.Path(f"{destino}.{os.getpid()}.tmp")
+        try:
+            await destino.parent.mkdir(parents=True, exist_ok=True)
+            await temporal.write_bytes(contenido)
+            # Escritura atómica para no servir nunca un archivo a medias.
+            await temporal.replace(destino)
+        except OSError as e:
+            await temporal.unlink(missing_ok=True)
+            raise ErrorAlmacenamiento(str(e))
+        return _clave_segura(clave)
+
+    @trazar("almacenamiento.put_archivo")
+    async def put_archivo(self, clave: str, ruta_temporal: str) -> str:
+        destino = anyio.Path(self.ruta_local(clave))
+        try:
+            await destino.parent.mkdir(parents=True, exist_ok=True)
+            # Renombrado atómico: el archivo aparece completo o no aparece.
+            await anyio.Path(ruta_temporal).replace(destino)
+        except OSError as e:
+            await anyio.Path(ruta_temporal).unlink(missing_ok=True)
+            raise ErrorAlmacenamiento(str(e))
+        return _clave_segura(clave)
+
+    @trazar("almacenamiento.get")
+    async def get(self, referencia: str) -> Optional[bytes]:
+        try:
+            return await anyio.Path(self.ruta_local(referencia)).read_bytes()
+        except OSError:
+            return None
+
+    @trazar("almacenamiento.exists")
+    async def exists(self, clave: str) -> bool:
+        return await anyio.Path(self.ruta_local(clave)).exists()
+
+    @trazar("almacenamiento.delete")
+    async def delete(self, referencia: str):
+        await anyio.Path(self.ruta_local(referencia)).unlink(missing_ok=True)
+
+    def url_miniatura(self, referencia: str, derivado: str, tamano: int, request: Request) -> str:
+        # Las fotos subidas antes de existir los derivados (o el avatar por defecto) no los tienen.
+        if referencia.startswith("http") or not os.path.exists(self.ruta_local(derivado)):
+            return self.url(referencia, request)
+        return self.url(derivado, request)
+
+class AlmacenamientoCloudinary(Almacenamiento):
+    """
+    Archivos en Cloudinary. El SDK se importa y configura solo si se usa este almacenamiento.
+    Las llamadas bloqueantes van a un pool de hilos propio y acotado para que una subida
+    lenta no bloquee el bucle de eventos ni agote el pool de hilos de FastAPI.
+    """
+
+    def __init__(self):
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name = settings.CLOUDINARY_CLOUD_NAME,
+            api_key = settings.CLOUDINARY_API_KEY,
+            api_secret = settings.CLOUDINARY_API_SECRET,
+            secure = True
+        )
+        self._uploader = cloudinary.uploader
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.STORAGE_MAX_CONCURRENCIA,
+            thread_name_prefix="almacenamiento"
+        )
+
+    async def _ejecutar(self, funcion, *args, **kwargs):
+        """Ejecuta una llamada del SDK en el pool acotado con tiempo máximo y reintentos."""
+        bucle = asyncio.get_running_loop()
+        intentos = settings.STORAGE_REINTENTOS + 1
+        for intento in range(intentos):
+            try:
+                futuro = bucle.run_in_executor(self._executor, partial(funcion, *args, **kwargs))
+                return await asyncio.wait_for(futuro, timeout=settings.STORAGE_TIMEOUT)
+            except (asyncio.TimeoutError, OSError) as e:
+                # Errores transitorios de red: se reintenta con espera exponencial.
+                if intento == intentos - 1:
+                    raise ErrorAlmacenamiento(str(e) or "Tiempo de espera agotado")
+                await asyncio.sleep(0.2 * (2 ** intento))
+            except Exception as e:
+                raise ErrorAlmacenamiento(str(e))
+
+    @staticmethod
+    def _public_id(referencia: str) -> str:
+        """Identificador de Cloudinary a partir de una clave o de su URL segura."""
+        if referencia.startswith("http") and "/upload/" in referencia:
+            referencia = referencia.split("/upload/", 1)[1]
+            # Quitar la versión (v1234/) si viene en la URL.
+            referencia = re.sub(r"^v\d+/", "", referencia)
+        return os.path.splitext(_clave_segura(referencia))[0]
+
+    @trazar("almacenamiento.put")
+    async def put(self, clave: str, contenido: bytes) -> str:
+        return await self._subir(clave, contenido)
+
+    @trazar("almacenamiento.put_archivo")
+    async def put_archivo(self, clave: str, ruta_temporal: str) -> str:
+        try:
+            return await self._subir(clave, ruta_temporal)
+        finally:
+            await anyio.Path(ruta_temporal).unlink(missing_ok=True)
+
+    async def _subir(self, clave: str, origen) -> str:
+        def subir():
+            # Un buffer nuevo en cada intento: el anterior puede haberse leído ya.
+            archivo = io.BytesIO(origen) if isinstance(origen, bytes) else origen
+            return self._uploader.upload(
+                archivo,
+                public_id=self._public_id(clave),
+                # Las claves son deterministas: misma clave = mismo contenido, reintentar es seguro.
+                overwrite=False,
+                resource_type="image",
+                timeout=settings.STORAGE_TIMEOUT
+            )
+        resultado = await self._ejecutar(subir)
+        return resultado.get("secure_url")
+
+    @trazar("almacenamiento.get")
+    async def get(self, referencia: str) -> Optional[bytes]:
+        # Los archivos de la nube se descargan directamente desde su URL pública.
+        return None
+
+    @trazar("almacenamiento.exists")
+    async def exists(self, clave: str) -> bool:
+        # Siempre False a propósito: procesar_subida reutiliza la clave y aquí hace falta la URL.
+        # La deduplicación la hace la propia subida (overwrite=False devuelve el recurso ya existente
+        # sin reemplazarlo), a costa de enviar los bytes. La API de administración (cloudinary.api.resource)
+        # evitaría el envío, pero tiene un límite de llamadas por hora.
+        return False
+
+    @trazar("almacenamiento.delete")
+    async def delete(self, referencia: str):
+        await self._ejecutar(self._uploader.destroy, self._public_id(referencia))
+
+    def url_miniatura(self, referencia: str, derivado: str, tamano: int, request: Request) -> str:
+        # Cloudinary genera el derivado al vuelo a partir de la URL (recorte, formato y calidad automáticos).
+        if "/upload/" in referencia:
+            return referencia.replace("/upload/", f"/upload/w_{tamano},h_{tamano},c_fill,f_auto,q_auto/", 1)
+        return self.url(referencia, request)
+
+class AlmacenamientoMemoria(Almacenamiento):
+    """Almacenamiento falso en memoria: mismo comportamiento sin disco ni red."""
+
+    def __init__(self):
+        self.archivos: dict[str, bytes] = {}
+
+    async def put(self, clave: str, contenido: bytes) -> str:
+        clave = _clave_segura(clave)
+        self.archivos[clave] = contenido
+        return clave
+
+    async def get(self, referencia: str) -> Optional[bytes]:
+        return self.archivos.get(_clave_segura(referencia))
+
+    async def exists(self, clave: str) -> bool:
+        return _clave_segura(clave) in self.archivos
+
+    async def delete(self, referencia: str):
+        self.archivos.pop(_clave_segura(referencia), None)
+
+_almacenamiento: Optional[Almacenamiento] = None
+
+def obtener_almacenamiento() -> Almacenamiento:
+    """Devuelve el almacenamiento configurado en settings.STORAGE_TYPE (único punto de selección)."""
+    global _almacenamiento
+    if _almacenamiento is None:
+        if settings.STORAGE_TYPE == "cloudinary":
+            _almacenamiento = AlmacenamientoCloudinary()
+        elif settings.STORAGE_TYPE == "memoria":
+            _almacenamiento = AlmacenamientoMemoria()
+        else:
+            _almacenamiento = AlmacenamientoLocal(settings.UPLOAD_DIR)
+    return _almacenamiento
+
+def ejecutar_desde_hilo(funcion, *args):
+    """
+    Ejecuta una operación async del almacenamiento desde código síncrono
+    (rutas 'def' y servicios que FastAPI ejecuta en su pool de hilos).
+    Solo funciona desde los hilos del pool de AnyIO (los de FastAPI y run_in_threadpool):
+    la operación vuelve al bucle de eventos de la API. Desde el propio bucle se usa 'await'
+    y desde otros hilos o scripts sin bucle, anyio.run (aquí daría RuntimeError).
+    """
+    return anyio.from_thread.run(funcion, *args)
+
+def usar_almacenamiento(almacenamiento: Almacenamiento):
+    """Sustituye el almacenamiento activo (p.ej. por AlmacenamientoMemoria en pruebas)."""
+    global _almacenamiento
+    _almacenamiento = almacenamiento
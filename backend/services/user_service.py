@@ -5,13 +5,17 @@ Servicio de Gestión de Usuarios.
 Encapsula la lógica de negocio de registro y actualización de perfil.
 """
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func
 from fastapi import HTTPException
 import database
 import auth
 import schemas
 from typing import Optional
+from services import version_service
+from utils.cache import cacheado
+from utils.trazas import trazar
 
+@trazar()
 def registrar_nuevo_usuario(db: Session, datos: schemas.Registro):
     """Registro de nuevo usuario con validación de duplicados."""
     # Buscar si existe ignorando mayúsculas/minúsculas
@@ -41,12 +45,14 @@ def registrar_nuevo_usuario(db: Session, datos: schemas.Registro):
     
     db.add(nuevo_usuario)
     db.commit()
+    version_service.incrementar(version_service.CLAVE_USUARIOS)
     return {
         "estatus": "success", 
         "mensaje": "Usuario registrado correctamente",
         "nombre_usuario": nuevo_usuario.nombre_usuario
     }
 
+@trazar()
 def obtener_perfil(db: Session, usuario_actual: str):
     """Busca al usuario en la base de datos usando el 'sub' extraído automáticamente del token."""
     usuario = db.query(database.Usuario).filter(database.Usuario.nombre_usuario == usuario_actual).first()
@@ -54,6 +60,7 @@ def obtener_perfil(db: Session, usuario_actual: str):
         raise HTTPException(status_code=404, detail="Error: Perfil de usuario no encontrado")
     return usuario
 
+@trazar()
 def actualizar_perfil_usuario(db: Session, usuario: database.Usuario, datos: schemas.ActualizarPerfil):
     """Lógica para modificar el perfil de usuario."""
     if datos.nombre_real: usuario.nombre_real = datos.nombre_real
@@ -76,14 +83,32 @@ def actualizar_perfil_usuario(db: Session, usuario: database.Usuario, datos: sch
     if datos.perfil_visible is not None: usuario.perfil_visible = datos.perfil_visible
 
     db.commit()
+    version_service.incrementar(
+        version_service.clave_usuario(usuario.nombre_usuario),
+        version_service.CLAVE_RANKING,
+        version_service.CLAVE_USUARIOS
+    )
     return {"estatus": "success", "mensaje": "Perfil de usuario actualizado correctamente"}
 
+@trazar()
+@cacheado(
+    etiquetas=lambda nombre_objetivo: [
+        version_service.clave_usuario(nombre_objetivo), version_service.clave_actividades(nombre_objetivo)
+    ],
+    ttl=300
+)
 def obtener_perfil_publico(db: Session, nombre_objetivo: str):
     """
     Busca un usuario por nombre para mostrar su ficha pública.
     Solo devuelve datos si el usuario existe y tiene perfil_visible=True.
     """
-    usuario = db.query(database.Usuario).filter(
+    usuario = db.query(
+        database.Usuario.nombre_usuario,
+        database.Usuario.provincia,
+        database.Usuario.foto_perfil,
+        database.Usuario.total_metros,
+        database.Usuario.perfil_visible
+    ).filter(
         database.Usuario.nombre_usuario == nombre_objetivo
     ).first()
 
@@ -94,10 +119,17 @@ def obtener_perfil_publico(db: Session, nombre_objetivo: str):
     if not usuario.perfil_visible:
         raise HTTPException(status_code=403, detail="Error: Este perfil es privado")
 
-    return usuario
+    return {
+        "nombre_usuario": usuario.nombre_usuario,
+        "provincia": usuario.provincia,
+        "foto_perfil": usuario.foto_perfil,
+        "total_metros": usuario.total_metros
+    }
 
 # ... imports (asegúrate de que Usuario esté importado)
 
+@trazar()
+@cacheado(etiquetas=lambda termino_busqueda: [version_service.CLAVE_USUARIOS], ttl=60)
 def buscar_usuario(db: Session, termino_busqueda: str):
     """
     Busca usuarios cuyo nombre_usuario contenga el término.
@@ -113,7 +145,7 @@ def buscar_usuario(db: Session, termino_busqueda: str):
     if not termino:
         return []
 
-    resultados = db.query(database.Usuario).filter(
+    resultados = db.query(database.Usuario.nombre_usuario, database.Usuario.foto_perfil).filter(
         # ILIKE: Busca coincidencias sin importar mayúsculas/minúsculas
         # %termino% significa: contiene el texto en cualquier parte
         database.Usuario.nombre_usuario.ilike(f"%{termino}%"),
@@ -121,14 +153,24 @@ def buscar_usuario(db: Session, termino_busqueda: str):
         database.Usuario.perfil_visible == True
     ).limit(20).all()
     
-    return resultados
+    return [{"nombre_usuario": nombre, "foto_perfil": foto} for nombre, foto in resultados]
 
+@trazar()
 def eliminar_cuenta(db: Session, usuario: database.Usuario):
     """Elimina permanentemente el registro de la base de datos."""
+    nombre_usuario = usuario.nombre_usuario
     db.delete(usuario)
     db.commit()
+    version_service.incrementar(
+        version_service.clave_usuario(nombre_usuario),
+        version_service.clave_actividades(nombre_usuario),
+        version_service.CLAVE_RANKING,
+        version_service.CLAVE_USUARIOS
+    )
     return {"estatus": "success", "mensaje": "Tu cuenta ha sido eliminada permanentemente"}
 
+@trazar()
+@cacheado(etiquetas=lambda provincia=None: [version_service.CLAVE_RANKING], ttl=60)
 def obtener_ranking(db: Session, provincia: Optional[str] = None):
     """
     Obtiene el Ranking de los usuarios con más kilometros recorridos.
@@ -168,4 +210,38 @@ def obtener_ranking(db: Session, provincia: Optional[str] = None):
             "total_puntos": puntos
         })
         
-    return ranking_procesado
\ No newline at end of file
+    return ranking_procesado
+
+@trazar()
+@cacheado(etiquetas=lambda provincia: [version_service.CLAVE_RANKING], ttl=60)
+def obtener_ranking_por_ubicacion(db: Session, provincia: str):
+    """
+    Obtiene el Ranking de una provincia según dónde se hicieron las actividades
+    (y no la provincia del perfil). Suma los metros de las actividades que empiezan
+    en la provincia usando el índice (provincia, usuario_id) de la geometría.
+    """
+    geometria = database.ActividadGeometria
+    total_metros = func.sum(database.Actividad.distancia).label("total_metros")
+
+    resultados = db.query(
+            database.Usuario.nombre_usuario,
+            database.Usuario.foto_perfil,
+            total_metros
+        )\
+        .join(geometria, geometria.usuario_id == database.Usuario.id)\
+        .join(database.Actividad, database.Actividad.id == geometria.actividad_id)\
+        .filter(
+            geometria.provincia == provincia,
+            database.Usuario.perfil_visible == True
+        )\
+        .group_by(database.Usuario.id, database.Usuario.nombre_usuario, database.Usuario.foto_perfil)\
+        .having(total_metros > 0)\
+        .order_by(desc(total_metros))\
+        .limit(15)\
+        .all()
+
+    # Convertir Metros a Puntos (1 KM = 1 Punto).
+    return [
+        {"nombre_usuario": nombre, "foto_perfil": foto, "total_puntos": int(metros / 1000)}
+        for nombre, foto, metros in resultados
+    ]
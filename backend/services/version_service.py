@@ -0,0 +1,112 @@
+# services/version_service.py
+
+"""
+Servicio de Versiones y Peticiones Condicionales.
+
+Cada entidad que se muestra en la App tiene un contador de versión en el almacén
+clave-valor compartido (utils/kv_store.py) que los servicios incrementan después
+de cada escritura confirmada:
+    - usuario:<nombre>      datos del perfil (nombre real, provincia, foto, visibilidad...)
+    - actividades:<nombre>  actividades del usuario (y sus metros totales)
+    - ranking               cualquier cambio que pueda mover el ranking
+    - usuarios              altas, bajas y cambios visibles en la búsqueda de usuarios
+
+El ETag de una respuesta se calcula con esos contadores, así una petición con
+If-None-Match se responde con 304 sin consultar la base de datos.
+"""
+import time
+import hashlib
+import logging
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, Response
+import auth
+from utils.kv_store import obtener_almacen, CLAVE_VERSION_GLOBAL
+from utils.respuestas import formato_preferido
+
+# Cambiarla invalida todos los ETag (p.ej. si cambia el formato de las respuestas).
+VERSION_RESPUESTAS = "1"
+
+logger = logging.getLogger("moveon.versiones")
+
+# Intentos de escritura de los contadores (p.ej. SQLite "database is locked" con mucha carga).
+INTENTOS_INCREMENTO = 3
+
+CLAVE_RANKING = "ranking"
+CLAVE_USUARIOS = "usuarios"
+
+def clave_usuario(nombre_usuario: str) -> str:
+    return f"usuario:{nombre_usuario}"
+
+def clave_actividades(nombre_usuario: str) -> str:
+    return f"actividades:{nombre_usuario}"
+
+def _reintentar(funcion, *args) -> bool:
+    """Ejecuta una escritura en el almacén con reintentos y espera exponencial. False si no se pudo."""
+    for intento in range(INTENTOS_INCREMENTO):
+        try:
+            funcion(*args)
+            return True
+        except Exception:
+            if intento == INTENTOS_INCREMENTO - 1:
+                logger.exception("No se han podido incrementar las versiones %s", args[0])
+                return False
+            time.sleep(0.05 * (2 ** intento))
+
+def incrementar(*claves: str):
+    """Marca las entidades como modificadas. Llamar siempre después del commit."""
+    almacen = obtener_almacen()
+    if _reintentar(almacen.incr_many, list(claves)):
+        return
+    # Sin contador nuevo el ETag y la caché seguirían siendo válidos con datos viejos:
+    # la versión global invalida todo en todos los workers.
+    if _reintentar(almacen.incr, CLAVE_VERSION_GLOBAL):
+        return
+    # Último recurso: al menos este worker deja de dar por buenos los ETag y la caché anteriores.
+    logger.error("Almacén sin escrituras: solo se invalidan los ETag y la caché de este worker")
+    almacen.epoca = f"{almacen.epoca}!"
+
+def calcular_etag(request: Request, usuario_actual: str, claves: list[str]) -> str:
+    """ETag débil a partir de la ruta, los parámetros, el usuario y las versiones de las entidades."""
+    almacen = obtener_almacen()
+    version_global, *versiones = almacen.get_many([CLAVE_VERSION_GLOBAL, *claves])
+    partes = [
+        VERSION_RESPUESTAS,
+        almacen.epoca,
+        str(version_global or 0),
+        # Las URL de las fotos se construyen con la URL base de la petición.
+        str(request.base_url),
+        request.url.path,
+        "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items())),
+        # Cada formato negociado (JSON o MessagePack) es una representación distinta.
+        formato_preferido(request),
+        usuario_actual,
+        *(f"{clave}={version or 0}" for clave, version in zip(claves, versiones))
+    ]
+    return f'W/"{hashlib.sha256("|".join(partes).encode()).hexdigest()[:32]}"'
+
+def _coincide(etag: str, if_none_match: Optional[str]) -> bool:
+    if not if_none_match:
+        return False
+    etiquetas = [e.strip() for e in if_none_match.split(",")]
+    # La comparación de If-None-Match es débil: W/"x" y "x" son la misma etiqueta.
+    return "*" in etiquetas or etag.removeprefix("W/") in [e.removeprefix("W/") for e in etiquetas]
+
+def peticion_condicional(*plantillas: str):
+    """
+    Dependencia para endpoints GET. Las plantillas indican de qué contadores depende
+    la respuesta y admiten {usuario_actual} y los parámetros de la ruta, p.ej.
+    peticion_condicional(clave_usuario("{nombre_usuario}"), clave_actividades("{nombre_usuario}")).
+    Si el cliente ya tiene la versión actual responde 304; si no, añade el ETag a la respuesta.
+    """
+    def dependencia(request: Request, response: Response,
+                    usuario_actual: str = Depends(auth.obtener_usuario_actual)):
+        valores = {**request.path_params, "usuario_actual": usuario_actual}
+        claves = [plantilla.format(**valores) for plantilla in plantillas]
+        etag = calcular_etag(request, usuario_actual, claves)
+        # Datos privados de cada usuario: la App los guarda pero debe revalidarlos siempre.
+        cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if _coincide(etag, request.headers.get("if-none-match")):
+            # El ETag depende del formato negociado: la 304 también varía según Accept.
+            raise HTTPException(status_code=304, headers={**cabeceras, "Vary": "Accept"})
+        response.headers.update(cabeceras)
+    return dependencia
@@ -0,0 +1,16 @@
+# tests/conftest.py
+
+"""
+Configuración común de las pruebas.
+
+Settings exige las variables de entorno de producción: se rellenan con valores
+de prueba (solo si no están definidas) antes de importar los módulos de la API.
+"""
+import os
+
+for variable, valor in {
+    "DB_USER": "pruebas", "DB_PASSWORD": "pruebas", "DB_HOST": "localhost", "DB_PORT": "5432",
+    "DB_NAME": "pruebas", "APP_ID_SECRET": "pruebas", "APP_SESSION_SECRET": "pruebas",
+    "SECRET_KEY": "pruebas", "EMAIL_HOST": "localhost", "EMAIL_USER": "pruebas", "EMAIL_PASS": "pruebas",
+}.items():
+    os.environ.setdefault(variable, valor)
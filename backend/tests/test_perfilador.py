@@ -0,0 +1,49 @@
+# tests/test_perfilador.py
+
+"""Pruebas del perfilador estadístico (asignación de muestras y rotación de informes)."""
+import os
+import sys
+import time
+import anyio
+import pytest
+from utils import perfilador
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+def _trabajo_en_hilo(segundos: float):
+    fin = time.perf_counter() + segundos
+    while time.perf_counter() < fin:
+        pass
+
+def test_version_de_anyio_compatible():
+    # Si falla, anyio ha cambiado WorkerThread.run: revisar _propietario antes de actualizarlo.
+    assert perfilador.atribuye_hilos()
+
+async def test_muestras_del_pool_de_hilos():
+    perfil, token = perfilador.iniciar(sys._getframe(), 0.002)
+    try:
+        await anyio.to_thread.run_sync(_trabajo_en_hilo, 0.2)
+    finally:
+        perfilador.terminar(perfil, token)
+    assert any("_trabajo_en_hilo" in etiqueta for pila in perfil.pilas for etiqueta in pila)
+
+def test_guardar_solo_rota_informes(tmp_path):
+    ajeno = tmp_path / "notas.txt"
+    ajeno.write_text("no es un informe")
+    os.utime(ajeno, (0, 0))
+    nombres = []
+    for i in range(3):
+        nombre = f"20240101-00000{i}-0000000{i}.txt"
+        perfilador.guardar(str(tmp_path), nombre, "# informe\n", max_archivos=2)
+        os.utime(tmp_path / nombre, (i + 1, i + 1))
+        nombres.append(nombre)
+    perfilador.guardar(str(tmp_path), perfilador.nombre_informe(), "# informe\n", max_archivos=2)
+
+    restantes = set(os.listdir(tmp_path))
+    assert "notas.txt" in restantes
+    assert nombres[0] not in restantes and nombres[1] not in restantes
+    assert len(restantes) == 3
@@ -0,0 +1,45 @@
+# tests/test_segment_service.py
+
+"""Pruebas del emparejamiento geométrico de actividades y segmentos."""
+import numpy as np
+from services import segment_service
+from utils import polilinea as geo
+
+LAT = 40.4
+LON = -3.7
+
+def _recta(inicio_m: float, fin_m: float, paso_m: float) -> np.ndarray:
+    """Puntos hacia el este desde (LAT, LON) entre dos distancias (m), cada paso_m metros."""
+    metros = np.append(np.arange(inicio_m, fin_m, paso_m), fin_m)
+    grados_lon = metros / (geo.METROS_POR_GRADO * np.cos(np.radians(LAT)))
+    return np.column_stack((np.full(len(metros), LAT), LON + grados_lon))
+
+def _tiempo(ruta: np.ndarray, segmento: np.ndarray, duracion: int = 1000):
+    acumulada = geo.distancias_acumuladas(ruta)
+    distancia = float(geo.distancias_acumuladas(segmento)[-1])
+    return segment_service._tiempo_en_segmento(ruta, acumulada, duracion, segmento, distancia)
+
+def test_ruta_con_puntos_separados_recorre_el_segmento():
+    # Puntos GPS cada 60 m: la salida y la llegada del segmento caen entre dos puntos.
+    ruta = _recta(0, 2000, 60)
+    segmento = _recta(530, 1330, 100)
+    tiempo = _tiempo(ruta, segmento)
+    # 800 m de 2000 m a ritmo constante.
+    assert tiempo == 400
+
+def test_ruta_que_no_llega_al_final():
+    ruta = _recta(0, 1000, 60)
+    segmento = _recta(530, 1330, 100)
+    assert _tiempo(ruta, segmento) is None
+
+def test_ruta_paralela_lejos_no_cuenta():
+    ruta = _recta(0, 2000, 60)
+    ruta[:, 0] += 50 / geo.METROS_POR_GRADO
+    segmento = _recta(530, 1330, 100)
+    assert _tiempo(ruta, segmento) is None
+
+def test_celdas_de_la_ruta_incluyen_la_salida_entre_puntos():
+    # Solo dos puntos a 2 km: la salida del segmento queda lejos de ambos.
+    ruta = _recta(0, 2000, 2000)
+    salida = _recta(1000, 1000, 1)[0]
+    assert segment_service._celdas_salida(*salida) <= segment_service._celdas_ruta(ruta)
@@ -0,0 +1,85 @@
+# tests/test_storage_service.py
+
+"""Pruebas de la interfaz de almacenamiento y de la deduplicación de subidas (en memoria)."""
+import hashlib
+import pytest
+from services import file_service
+from services.file_service import ArchivoRecibido
+from services.storage_service import Almacenamiento, AlmacenamientoMemoria, usar_almacenamiento
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def almacenamiento():
+    almacenamiento = AlmacenamientoMemoria()
+    usar_almacenamiento(almacenamiento)
+    yield almacenamiento
+    usar_almacenamiento(None)
+
+def _subida(directorio, contenido: bytes, nombre: str) -> ArchivoRecibido:
+    ruta = directorio / nombre
+    ruta.write_bytes(contenido)
+    return ArchivoRecibido(
+        ruta_temporal=str(ruta),
+        sha256=hashlib.sha256(contenido).hexdigest(),
+        tamano=len(contenido),
+        extension=".png",
+    )
+
+def test_interfaz_abstracta():
+    with pytest.raises(TypeError):
+        Almacenamiento()
+
+async def test_put_y_get(almacenamiento):
+    referencia = await almacenamiento.put("perfiles/ab/cd/foto.png", b"imagen")
+    assert referencia == "perfiles/ab/cd/foto.png"
+    assert await almacenamiento.get(referencia) == b"imagen"
+    assert await almacenamiento.get("perfiles/ab/cd/otra.png") is None
+
+async def test_clave_sin_salir_de_la_carpeta(almacenamiento):
+    referencia = await almacenamiento.put("../perfiles/./foto.png", b"imagen")
+    assert referencia == "perfiles/foto.png"
+    assert await almacenamiento.get("perfiles/foto.png") == b"imagen"
+
+async def test_exists(almacenamiento):
+    assert not await almacenamiento.exists("perfiles/foto.png")
+    await almacenamiento.put("perfiles/foto.png", b"imagen")
+    assert await almacenamiento.exists("perfiles/foto.png")
+
+async def test_delete(almacenamiento):
+    await almacenamiento.put("perfiles/foto.png", b"imagen")
+    await almacenamiento.delete("perfiles/foto.png")
+    assert not await almacenamiento.exists("perfiles/foto.png")
+    # Borrar algo que ya no existe no falla.
+    await almacenamiento.delete("perfiles/foto.png")
+
+async def test_put_archivo_consume_el_temporal(almacenamiento, tmp_path):
+    temporal = tmp_path / "subida.tmp"
+    temporal.write_bytes(b"imagen")
+    referencia = await almacenamiento.put_archivo("perfiles/foto.png", str(temporal))
+    assert await almacenamiento.get(referencia) == b"imagen"
+    assert not temporal.exists()
+
+async def test_deduplicacion_de_subidas(almacenamiento, tmp_path):
+    primera = _subida(tmp_path, b"misma imagen", "a.tmp")
+    segunda = _subida(tmp_path, b"misma imagen", "b.tmp")
+
+    referencia = await file_service.procesar_subida(primera)
+    assert referencia == file_service.ruta_contenido(primera.sha256, ".png")
+    assert await file_service.procesar_subida(segunda) == referencia
+
+    # Un solo archivo guardado y los dos temporales consumidos.
+    assert list(almacenamiento.archivos) == [referencia]
+    assert not (tmp_path / "a.tmp").exists()
+    assert not (tmp_path / "b.tmp").exists()
+
+async def test_contenidos_distintos_no_se_comparten(almacenamiento, tmp_path):
+    referencia_a = await file_service.procesar_subida(_subida(tmp_path, b"imagen a", "a.tmp"))
+    referencia_b = await file_service.procesar_subida(_subida(tmp_path, b"imagen b", "b.tmp"))
+    assert referencia_a != referencia_b
+    assert await almacenamiento.get(referencia_a) == b"imagen a"
+    assert await almacenamiento.get(referencia_b) == b"imagen b"
@@ -0,0 +1,165 @@
+# utils/cache.py
+
+"""
+Caché de lecturas de los servicios con invalidación por etiquetas.
+
+Cada resultado se guarda junto a la versión de sus etiquetas (los contadores del
+almacén clave-valor que incrementan los servicios al escribir, p.ej. "ranking" o
+"usuario:<nombre>"). Al leerlo se comparan con las versiones actuales: si alguna
+etiqueta ha cambiado el resultado se descarta, sin tener que buscar y borrar entradas.
+
+Backends (settings.CACHE_BACKEND):
+    - "memoria": LRU con caducidad (TTL) en cada worker.
+    - "kv": el almacén clave-valor compartido (con "sqlite", común a todos los workers).
+
+Para evitar la estampida, solo un hilo por clave calcula un resultado que falta;
+el resto espera y recibe el mismo (utils/coalescencia.py). Los valores se guardan como JSON
+y se devuelven siempre decodificados, también al calcularlos, para que un acierto y un fallo
+den exactamente lo mismo (fechas y Enum como texto, tuplas como listas).
+"""
+import json
+import time
+import threading
+from collections import OrderedDict
+from enum import Enum
+from functools import wraps
+from typing import Any, Callable, Optional
+from sqlalchemy.orm import Session
+from config import settings
+from utils.kv_store import obtener_almacen, CLAVE_VERSION_GLOBAL
+from utils.coalescencia import UnSoloVuelo
+
+class CacheMemoria:
+    """LRU con TTL en memoria del proceso."""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._entradas: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.expulsiones = 0
+
+    def get(self, clave: str) -> Optional[str]:
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            valor, expira = entrada
+            if expira <= time.monotonic():
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return valor
+
+    def set(self, clave: str, valor: str, ttl: float):
+        with self._lock:
+            self._entradas[clave] = (valor, time.monotonic() + ttl)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+class CacheKV:
+    """Caché sobre el almacén clave-valor compartido (la caducidad la gestiona el almacén)."""
+
+    expulsiones = 0
+
+    def get(self, clave: str) -> Optional[str]:
+        return obtener_almacen().get(f"cache:{clave}")
+
+    def set(self, clave: str, valor: str, ttl: float):
+        obtener_almacen().set(f"cache:{clave}", valor, ttl)
+
+class _Estadisticas:
+    """Contadores de una función cacheada (se actualizan desde los hilos del pool)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidadas = 0
+
+    def contar(self, campo: str):
+        with self.lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+_backend = None
+_estadisticas: dict[str, _Estadisticas] = {}
+_vuelos = UnSoloVuelo("cache")
+
+def obtener_backend():
+    global _backend
+    if _backend is None:
+        _backend = CacheKV() if settings.CACHE_BACKEND == "kv" else CacheMemoria(settings.CACHE_MAX_ENTRADAS)
+    return _backend
+
+def _versiones(etiquetas: list[str]) -> list:
+    almacen = obtener_almacen()
+    return [almacen.epoca, *(v or 0 for v in almacen.get_many([CLAVE_VERSION_GLOBAL, *etiquetas]))]
+
+def _serializar_argumento(valor: Any) -> str:
+    if isinstance(valor, Enum):
+        valor = valor.value
+    return repr(valor)
+
+def _leer(backend, clave: str, versiones: list, estadisticas: Optional[_Estadisticas] = None):
+    """Devuelve (encontrado, valor) si la entrada existe y sus etiquetas no han cambiado."""
+    guardado = backend.get(clave)
+    if guardado is None:
+        return False, None
+    entrada = json.loads(guardado)
+    if entrada["v"] != versiones:
+        if estadisticas:
+            estadisticas.contar("invalidadas")
+        return False, None
+    return True, entrada["d"]
+
+def cacheado(etiquetas: Callable[..., list[str]], ttl: float = 60):
+    """
+    Decorador para funciones de servicio de solo lectura con firma (db, *args).
+    'etiquetas' recibe los mismos argumentos sin la sesión y devuelve las etiquetas
+    de las que depende el resultado. El resultado debe poder convertirse a JSON.
+    """
+    def decorador(funcion):
+        nombre = f"{funcion.__module__}.{funcion.__qualname__}"
+        estadisticas = _estadisticas.setdefault(nombre, _Estadisticas())
+
+        @wraps(funcion)
+        def envoltura(db: Session, *args, **kwargs):
+            backend = obtener_backend()
+            clave = ":".join([nombre, *map(_serializar_argumento, args),
+                              *(f"{k}={_serializar_argumento(v)}" for k, v in sorted(kwargs.items()))])
+            # Versiones leídas antes de consultar: si cambian durante la consulta, la entrada ya nace obsoleta.
+            versiones = _versiones(etiquetas(*args, **kwargs))
+
+            encontrado, valor = _leer(backend, clave, versiones, estadisticas)
+            if encontrado:
+                estadisticas.contar("aciertos")
+                return valor
+
+            def calcular():
+                estadisticas.contar("fallos")
+                guardado = json.dumps({"v": versiones, "d": funcion(db, *args, **kwargs)}, default=str)
+                backend.set(clave, guardado, ttl)
+                # El mismo valor que leerán los aciertos.
+                return json.loads(guardado)["d"]
+
+            # Las peticiones simultáneas con la misma clave y versiones comparten una sola consulta.
+            return _vuelos.ejecutar((clave, *versiones), calcular)
+
+        return envoltura
+    return decorador
+
+def estadisticas() -> dict:
+    """Aciertos, fallos y tasa de aciertos de cada función cacheada."""
+    resultado = {}
+    for nombre, datos in _estadisticas.items():
+        with datos.lock:
+            aciertos, fallos, invalidadas = datos.aciertos, datos.fallos, datos.invalidadas
+        total = aciertos + fallos
+        resultado[nombre] = {
+            "aciertos": aciertos,
+            "fallos": fallos,
+            "invalidadas": invalidadas,
+            "tasa_aciertos": round(aciertos / total, 4) if total else 0.0
+        }
+    return {"funciones": resultado, "expulsiones": obtener_backend().expulsiones}
@@ -0,0 +1,85 @@
+# utils/carga.py
+
+"""
+Indicadores de carga del worker.
+
+    - Peticiones en curso (las cuenta el middleware de admisión).
+    - Tareas esperando un hilo libre del pool de FastAPI (anyio).
+    - Espera para obtener una conexión del pool de la base de datos (media móvil).
+    - Comprobaciones de contraseña con bcrypt en curso (CPU intensivas, ~250 ms cada una).
+
+Los usa el middleware de admisión para rechazar el tráfico prescindible antes
+de que las peticiones se acumulen en las colas.
+"""
+import time
+import threading
+from contextlib import contextmanager
+import anyio.to_thread
+
+# Peso de cada nueva muestra en la media móvil de la espera del pool.
+PESO_MUESTRA = 0.2
+# Sin muestras recientes la espera del pool se considera nula (no hay cola).
+VIGENCIA_MUESTRAS = 5.0
+
+class _Indicadores:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.en_curso = 0
+        self.bcrypt_en_curso = 0
+        self.espera_db = 0.0
+        self.ultima_muestra_db = 0.0
+
+_indicadores = _Indicadores()
+
+def entrar():
+    with _indicadores.lock:
+        _indicadores.en_curso += 1
+
+def salir():
+    with _indicadores.lock:
+        _indicadores.en_curso -= 1
+
+def en_curso() -> int:
+    return _indicadores.en_curso
+
+@contextmanager
+def operacion_bcrypt():
+    """Cuenta una operación de bcrypt mientras dura."""
+    with _indicadores.lock:
+        _indicadores.bcrypt_en_curso += 1
+    try:
+        yield
+    finally:
+        with _indicadores.lock:
+            _indicadores.bcrypt_en_curso -= 1
+
+def bcrypt_en_curso() -> int:
+    return _indicadores.bcrypt_en_curso
+
+def registrar_espera_db(segundos: float):
+    """Muestra del tiempo que ha tardado en conseguirse una conexión del pool."""
+    with _indicadores.lock:
+        _indicadores.espera_db += PESO_MUESTRA * (segundos - _indicadores.espera_db)
+        _indicadores.ultima_muestra_db = time.monotonic()
+
+def espera_db() -> float:
+    """Media móvil de la espera del pool de la base de datos (segundos)."""
+    if time.monotonic() - _indicadores.ultima_muestra_db > VIGENCIA_MUESTRAS:
+        return 0.0
+    return _indicadores.espera_db
+
+def cola_hilos() -> int:
+    """Tareas esperando un hilo del pool de FastAPI. Llamar desde el bucle de eventos."""
+    return anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+
+def hilos() -> tuple[int, int]:
+    """(hilos ocupados, hilos máximos) del pool de FastAPI. Llamar desde el bucle de eventos."""
+    limitador = anyio.to_thread.current_default_thread_limiter()
+    return limitador.borrowed_tokens, int(limitador.total_tokens)
+
+def estadisticas() -> dict:
+    return {
+        "en_curso": en_curso(),
+        "espera_db": round(espera_db(), 4),
+        "bcrypt_en_curso": bcrypt_en_curso(),
+    }
@@ -0,0 +1,68 @@
+# utils/coalescencia.py
+
+"""
+Agrupación de peticiones idénticas simultáneas ("single-flight").
+
+Si varias peticiones piden lo mismo a la vez (p.ej. miles de clientes abriendo el
+ranking tras una notificación), solo la primera ejecuta la consulta; el resto espera
+a que termine y recibe el mismo resultado (o la misma excepción).
+Funciona entre los hilos del pool de FastAPI; cada worker agrupa las suyas.
+"""
+import threading
+from typing import Any, Callable, Hashable
+
+class _Vuelo:
+    """Cálculo en curso compartido por todas las peticiones con la misma clave."""
+
+    def __init__(self):
+        self.hecho = threading.Event()
+        self.resultado: Any = None
+        self.error: BaseException | None = None
+
+class UnSoloVuelo:
+    """Grupo de cálculos agrupables. Los contadores muestran cuántas peticiones se ahorraron."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self._en_curso: dict[Hashable, _Vuelo] = {}
+        self._lock = threading.Lock()
+        self.ejecutadas = 0
+        self.agrupadas = 0
+        _grupos[nombre] = self
+
+    def ejecutar(self, clave: Hashable, funcion: Callable[[], Any]) -> Any:
+        with self._lock:
+            vuelo = self._en_curso.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = self._en_curso[clave] = _Vuelo()
+                self.ejecutadas += 1
+            else:
+                self.agrupadas += 1
+
+        if not lider:
+            vuelo.hecho.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = funcion()
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            # Las peticiones que lleguen a partir de aquí hacen un cálculo nuevo.
+            with self._lock:
+                del self._en_curso[clave]
+            vuelo.hecho.set()
+
+_grupos: dict[str, UnSoloVuelo] = {}
+
+def estadisticas() -> dict:
+    """Cálculos ejecutados y peticiones agrupadas de cada grupo."""
+    return {
+        nombre: {"ejecutadas": grupo.ejecutadas, "agrupadas": grupo.agrupadas}
+        for nombre, grupo in _grupos.items()
+    }
@@ -0,0 +1,128 @@
+# utils/consultas.py
+
+"""
+Instrumentación de las consultas SQL.
+
+Los eventos del motor (registrar_eventos, llamado desde database.py) cuentan las
+consultas y el tiempo en la base de datos de la petición en curso. La petición se
+identifica con una ContextVar que pone el middleware de consultas; anyio copia el
+contexto a los hilos del pool, así que también cuentan las consultas de los
+endpoints síncronos y de las dependencias.
+
+    - Consultas por encima de settings.SQL_UMBRAL_LENTA: se registran en el log con su
+      huella (la sentencia normalizada, igual para todas las ejecuciones) y solo el
+      tipo y tamaño de los parámetros, nunca sus valores (emails, hashes...).
+    - Peticiones con más de settings.SQL_MAX_CONSULTAS: aviso con la sentencia más
+      repetida, que suele ser el N+1 (una consulta por elemento de una lista).
+"""
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar, Token
+from functools import lru_cache
+from typing import Any, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+from utils import metricas
+
+logger = logging.getLogger("moveon.sql")
+
+CONSULTAS_LENTAS = metricas.Contador(
+    "db_consultas_lentas_total", "Consultas por encima de SQL_UMBRAL_LENTA", ("huella",)
+)
+
+class ConsultasPeticion:
+    """Consultas de una petición (puede actualizarse desde varios hilos)."""
+
+    def __init__(self):
+        self.total = 0
+        self.tiempo = 0.0
+        self.por_huella: Counter = Counter()
+        self.textos: dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    def registrar(self, huella: str, texto: str, duracion: float):
+        with self.lock:
+            self.total += 1
+            self.tiempo += duracion
+            self.por_huella[huella] += 1
+            self.textos.setdefault(huella, texto)
+
+_peticion: ContextVar[Optional[ConsultasPeticion]] = ContextVar("consultas_peticion", default=None)
+
+def iniciar() -> tuple[ConsultasPeticion, Token]:
+    registro = ConsultasPeticion()
+    return registro, _peticion.set(registro)
+
+def terminar(token: Token):
+    _peticion.reset(token)
+
+def actual() -> Optional[ConsultasPeticion]:
+    """Registro de la petición en curso (None fuera del middleware de consultas)."""
+    return _peticion.get()
+
+# Listas de parámetros ("IN (%(id_1)s, %(id_2)s, ...)"), literales y espacios.
+_LISTA_PARAMETROS = re.compile(r"\((?:\s*(?:%\(\w+\)s|\?|:\w+)\s*,)+\s*(?:%\(\w+\)s|\?|:\w+)\s*\)")
+_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+_LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_ESPACIOS = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def normalizar(sentencia: str) -> tuple[str, str]:
+    """(huella, sentencia normalizada). Las sentencias se repiten, así que se guarda en caché."""
+    texto = _ESPACIOS.sub(" ", sentencia).strip()
+    texto = _POSTCOMPILE.sub("(...)", texto)
+    texto = _LISTA_PARAMETROS.sub("(...)", texto)
+    texto = _LITERALES.sub("?", texto)
+    return hashlib.sha1(texto.encode()).hexdigest()[:12], texto
+
+def resumir_parametros(parametros: Any) -> str:
+    """Tipo y tamaño de cada parámetro, sin su valor."""
+    def resumen(valor: Any) -> str:
+        if isinstance(valor, (str, bytes)):
+            return f"{type(valor).__name__}({len(valor)})"
+        return type(valor).__name__
+
+    if isinstance(parametros, dict):
+        return "{" + ", ".join(f"{clave}: {resumen(valor)}" for clave, valor in parametros.items()) + "}"
+    if isinstance(parametros, (list, tuple)):
+        if parametros and isinstance(parametros[0], (dict, list, tuple)):
+            # executemany: se resume la primera fila.
+            return f"{len(parametros)} x {resumir_parametros(parametros[0])}"
+        return "(" + ", ".join(resumen(valor) for valor in parametros) + ")"
+    return resumen(parametros)
+
+def registrar_eventos(engine: Engine):
+    """Engancha la medición de consultas a los eventos del motor."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conexion, cursor, sentencia, parametros, contexto, executemany):
+        contexto._inicio_consulta = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _despues(conexion, cursor, sentencia, parametros, contexto, executemany):
+        duracion = time.perf_counter() - contexto._inicio_consulta
+        huella, texto = normalizar(sentencia)
+        registro = _peticion.get()
+        if registro is not None:
+            registro.registrar(huella, texto, duracion)
+        if duracion >= settings.SQL_UMBRAL_LENTA:
+            CONSULTAS_LENTAS.inc(huella)
+            logger.warning(
+                "Consulta lenta (%.1f ms) [%s] %s parámetros=%s",
+                duracion * 1000, huella, texto, resumir_parametros(parametros)
+            )
+
+def revisar_peticion(registro: ConsultasPeticion, metodo: str, ruta: str):
+    """Avisa si la petición ha hecho demasiadas consultas (posible N+1)."""
+    if registro.total <= settings.SQL_MAX_CONSULTAS:
+        return
+    huella, repeticiones = registro.por_huella.most_common(1)[0]
+    logger.warning(
+        "%s %s hizo %d consultas (%.1f ms en la base de datos); la más repetida [%s] %d veces: %s",
+        metodo, ruta, registro.total, registro.tiempo * 1000, huella, repeticiones, registro.textos[huella]
+    )
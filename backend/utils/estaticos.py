@@ -0,0 +1,112 @@
+# utils/estaticos.py
+
+"""
+Servidor de imágenes estáticas con cabeceras de caché.
+
+Las fotos de perfil, sus miniaturas y las miniaturas de rutas tienen nombres
+únicos derivados del contenido (hash), así que un mismo nombre nunca cambia de
+contenido y se pueden cachear para siempre (Cache-Control immutable). Con el hash
+del nombre como ETag fuerte, las peticiones condicionales se responden con 304
+sin tocar el disco. Las peticiones con Range las resuelve FileResponse.
+"""
+import os
+import re
+import mimetypes
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import StaticFiles, NotModifiedResponse
+from starlette.types import Scope
+from middlewares.compresion import elegir_codificacion
+
+# Un año: el máximo que respetan los navegadores y clientes HTTP.
+CACHE_INMUTABLE = "public, max-age=31536000, immutable"
+# Archivos con nombre fijo (p.ej. default_avatar.png): pueden cambiar con un despliegue.
+CACHE_REVALIDAR = "public, max-age=3600"
+
+# Nombres que nunca cambian de contenido:
+#   abcd...ef.png / abcd...ef_64.webp  -> fotos direccionadas por contenido y sus derivados
+#   ruta_abcd...ef.png                 -> miniaturas de rutas
+#   perfil_<hash usuario>_<fecha>.jpg  -> fotos antiguas (un nombre nuevo por subida)
+PATRON_INMUTABLE = re.compile(r"^(?:ruta_)?([0-9a-f]{64}(?:_\d+)?)\.\w+$|^perfil_[0-9a-f]{64}_.+\.\w+$")
+
+# Variantes precomprimidas que se buscan junto al archivo (archivo.ext.br, archivo.ext.gz),
+# de más a menos preferida a igual prioridad del cliente. Las imágenes ya van comprimidas, así que solo se buscan para el resto de tipos.
+VARIANTES_COMPRIMIDAS = (("br", ".br"), ("gzip", ".gz"))
+EXTENSIONES_COMPRIMIDAS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+
+def cabeceras_cache(ruta: str) -> dict[str, str]:
+    """Cache-Control y, si el nombre contiene el hash del contenido, su ETag fuerte."""
+    coincidencia = PATRON_INMUTABLE.match(os.path.basename(ruta))
+    if not coincidencia:
+        return {"cache-control": CACHE_REVALIDAR}
+    cabeceras = {"cache-control": CACHE_INMUTABLE}
+    if coincidencia.group(1):
+        cabeceras["etag"] = f'"{coincidencia.group(1)}"'
+    return cabeceras
+
+def _etag_coincide(etag: str, if_none_match: str) -> bool:
+    etiquetas = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etiquetas or etag in etiquetas
+
+class ArchivosInmutables(StaticFiles):
+    """StaticFiles con caché inmutable, ETag por contenido, 304 rápido y variantes precomprimidas."""
+
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            cabeceras = cabeceras_cache(path)
+            if cabeceras["cache-control"] == CACHE_INMUTABLE:
+                peticion = Headers(scope=scope)
+                if_none_match = peticion.get("if-none-match")
+                # Camino rápido: el nombre ya identifica el contenido, no hace falta buscar el archivo.
+                if if_none_match is not None:
+                    if "etag" in cabeceras and _etag_coincide(cabeceras["etag"], if_none_match):
+                        return NotModifiedResponse(Headers(cabeceras))
+                elif "if-modified-since" in peticion:
+                    # Sin ETag no hay nada que comparar: solo si el archivo existe (si no, 404).
+                    _, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+                    if stat_result is not None:
+                        return NotModifiedResponse(Headers(cabeceras))
+        return await super().get_response(path, scope)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope: Scope, status_code: int = 200) -> Response:
+        peticion = Headers(scope=scope)
+        cabeceras = cabeceras_cache(str(full_path))
+        respuesta = self._respuesta_comprimida(str(full_path), peticion, cabeceras, status_code)
+        if respuesta is None:
+            respuesta = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=cabeceras)
+        if self.is_not_modified(respuesta.headers, peticion):
+            return NotModifiedResponse(respuesta.headers)
+        return respuesta
+
+    def _respuesta_comprimida(self, ruta: str, peticion: Headers, cabeceras: dict, status_code: int):
+        """Sirve archivo.ext.br / archivo.ext.gz si el cliente lo acepta y existe la variante."""
+        if os.path.splitext(ruta)[1].lower() in EXTENSIONES_COMPRIMIDAS:
+            return None
+        variantes = {}
+        for codificacion, sufijo in VARIANTES_COMPRIMIDAS:
+            try:
+                variantes[codificacion] = (ruta + sufijo, os.stat(ruta + sufijo))
+            except OSError:
+                continue
+        if not variantes:
+            return None
+        # La respuesta depende de Accept-Encoding aunque se sirva el original.
+        cabeceras["vary"] = "Accept-Encoding"
+        # Negociación con los valores q (gzip;q=0 rechaza gzip), como en la compresión al vuelo.
+        codificacion = elegir_codificacion(peticion.get("accept-encoding", ""), variantes)
+        if codificacion is None:
+            return None
+        ruta_variante, stat_variante = variantes[codificacion]
+        # El tipo es el del original; la codificación indica cómo descomprimirlo.
+        respuesta = FileResponse(
+            ruta_variante,
+            status_code=status_code,
+            stat_result=stat_variante,
+            headers={**cabeceras, "content-encoding": codificacion},
+            media_type=mimetypes.guess_type(ruta)[0] or "application/octet-stream"
+        )
+        # La variante necesita su propio ETag (distinto contenido en bytes).
+        if "etag" in cabeceras:
+            respuesta.headers["etag"] = f'{cabeceras["etag"][:-1]}-{codificacion}"'
+        return respuesta
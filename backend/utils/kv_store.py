@@ -0,0 +1,252 @@
+# utils/kv_store.py
+
+"""
+Almacén clave-valor compartido para contadores y datos pequeños de corta vida.
+
+Dos implementaciones con la misma interfaz, elegida con settings.KV_BACKEND:
+    - "memoria": diccionario del proceso. Rápido, pero cada worker tiene el suyo.
+    - "sqlite": archivo SQLite en modo WAL compartido por todos los workers de la máquina.
+Con varios workers hay que usar "sqlite" para que todos vean los mismos valores.
+
+También guardan los cupos del limitador de peticiones (consumir_cupo), con el
+algoritmo GCRA: por cada clave solo se guarda el instante teórico en el que la cubeta
+de tokens volvería a estar llena, y cada comprobación es una sola operación atómica.
+
+Cada almacén tiene una 'época' aleatoria que cambia si se pierden los datos
+(reinicio en memoria o archivo borrado), para que los contadores que vuelven a
+empezar desde cero no se confundan con los anteriores.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Optional
+from config import settings
+
+class AlmacenKV(ABC):
+    """Interfaz común de los almacenes clave-valor."""
+
+    epoca: str
+
+    def get(self, clave: str) -> Any:
+        return self.get_many([clave])[0]
+
+    @abstractmethod
+    def get_many(self, claves: list[str]) -> list[Any]:
+        """Valores de varias claves (None las que no existen o han caducado)."""
+
+    @abstractmethod
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        """Guarda un valor; con ttl caduca a los ttl segundos."""
+
+    @abstractmethod
+    def incr(self, clave: str, cantidad: int = 1) -> int:
+        """Suma al contador y devuelve el nuevo valor."""
+
+    def incr_many(self, claves: list[str], cantidad: int = 1):
+        for clave in claves:
+            self.incr(clave, cantidad)
+
+    @abstractmethod
+    def delete(self, clave: str):
+        """Borra una clave."""
+
+    @abstractmethod
+    def consumir_cupo(self, clave: str, intervalo: float, capacidad: int) -> float:
+        """
+        Gasta un token de la cubeta 'clave' (capacidad tokens, uno nuevo cada 'intervalo' segundos).
+        Devuelve 0 si había token, o los segundos que faltan para el siguiente.
+        """
+
+def _gcra(lleno: Optional[float], ahora: float, intervalo: float, capacidad: int) -> tuple[float, float]:
+    """Nuevo instante de cubeta llena y espera (0 si se permite) a partir del guardado."""
+    nuevo = max(lleno or ahora, ahora) + intervalo
+    exceso = nuevo - ahora - intervalo * capacidad
+    if exceso > 0:
+        return lleno, exceso
+    return nuevo, 0.0
+
+class AlmacenMemoria(AlmacenKV):
+    """Almacén en memoria del proceso (un solo worker o pruebas)."""
+
+    def __init__(self):
+        self.epoca = uuid.uuid4().hex
+        self._datos: dict[str, tuple[Any, Optional[float]]] = {}
+        self._cupos: dict[str, float] = {}
+        self._consumos = 0
+        self._escrituras = 0
+        self._lock = threading.Lock()
+
+    def _leer(self, clave: str, ahora: float) -> Any:
+        valor, expira = self._datos.get(clave, (None, None))
+        if expira is not None and expira <= ahora:
+            self._datos.pop(clave, None)
+            return None
+        return valor
+
+    def get_many(self, claves: list[str]) -> list[Any]:
+        ahora = time.monotonic()
+        with self._lock:
+            return [self._leer(clave, ahora) for clave in claves]
+
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        ahora = time.monotonic()
+        with self._lock:
+            self._datos[clave] = (valor, ahora + ttl if ttl else None)
+            self._escrituras += 1
+            if self._escrituras % LIMPIEZA_CADUCADOS == 0:
+                # Las claves caducadas que nadie vuelve a leer (p.ej. cada búsqueda de la caché).
+                self._datos = {c: (v, e) for c, (v, e) in self._datos.items() if e is None or e > ahora}
+
+    def incr(self, clave: str, cantidad: int = 1) -> int:
+        with self._lock:
+            valor = (self._leer(clave, time.monotonic()) or 0) + cantidad
+            self._datos[clave] = (valor, None)
+            return valor
+
+    def delete(self, clave: str):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def consumir_cupo(self, clave: str, intervalo: float, capacidad: int) -> float:
+        ahora = time.monotonic()
+        with self._lock:
+            self._cupos[clave], espera = _gcra(self._cupos.get(clave), ahora, intervalo, capacidad)
+            self._consumos += 1
+            if self._consumos % LIMPIEZA_CUPOS == 0:
+                # Una cubeta ya llena equivale a no tenerla.
+                self._cupos = {c: lleno for c, lleno in self._cupos.items() if lleno > ahora}
+            return espera
+
+class AlmacenSQLite(AlmacenKV):
+    """
+    Almacén en un archivo SQLite compartido entre procesos.
+    Cada hilo usa su propia conexión; WAL permite lecturas mientras otro proceso escribe.
+    Los incrementos son atómicos (una sola sentencia UPSERT).
+    """
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        carpeta = os.path.dirname(ruta)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        self._local = threading.local()
+        with self._conexion() as conexion:
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS kv (clave TEXT PRIMARY KEY, valor, expira REAL)"
+            )
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS cupos (clave TEXT PRIMARY KEY, lleno REAL NOT NULL, espera REAL NOT NULL)"
+            )
+            conexion.execute(
+                "INSERT OR IGNORE INTO kv (clave, valor) VALUES ('__epoca__', ?)", (uuid.uuid4().hex,)
+            )
+        self.epoca = self.get("__epoca__")
+        self._consumos = 0
+        self._escrituras = 0
+
+    def _conexion(self) -> sqlite3.Connection:
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5.0, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def get_many(self, claves: list[str]) -> list[Any]:
+        if not claves:
+            return []
+        marcas = ",".join("?" * len(claves))
+        filas = self._conexion().execute(
+            f"SELECT clave, valor FROM kv WHERE clave IN ({marcas}) AND (expira IS NULL OR expira > ?)",
+            (*claves, time.time())
+        ).fetchall()
+        valores = dict(filas)
+        return [valores.get(clave) for clave in claves]
+
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        ahora = time.time()
+        conexion = self._conexion()
+        conexion.execute(
+            "INSERT OR REPLACE INTO kv (clave, valor, expira) VALUES (?, ?, ?)",
+            (clave, valor, ahora + ttl if ttl else None)
+        )
+        self._escrituras += 1
+        if self._escrituras % LIMPIEZA_CADUCADOS == 0:
+            # get_many ignora las filas caducadas, pero siguen ocupando el archivo hasta borrarlas.
+            conexion.execute("DELETE FROM kv WHERE expira IS NOT NULL AND expira <= ?", (ahora,))
+
+    def incr(self, clave: str, cantidad: int = 1) -> int:
+        fila = self._conexion().execute(
+            "INSERT INTO kv (clave, valor) VALUES (?, ?) "
+            "ON CONFLICT(clave) DO UPDATE SET valor = COALESCE(valor, 0) + excluded.valor, expira = NULL "
+            "RETURNING valor",
+            (clave, cantidad)
+        ).fetchone()
+        return fila[0]
+
+    def incr_many(self, claves: list[str], cantidad: int = 1):
+        # Una sola transacción para todas las claves.
+        conexion = self._conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            conexion.executemany(
+                "INSERT INTO kv (clave, valor) VALUES (?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET valor = COALESCE(valor, 0) + excluded.valor, expira = NULL",
+                [(clave, cantidad) for clave in claves]
+            )
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def delete(self, clave: str):
+        self._conexion().execute("DELETE FROM kv WHERE clave = ?", (clave,))
+
+    def consumir_cupo(self, clave: str, intervalo: float, capacidad: int) -> float:
+        # El mismo cálculo que _gcra en una sola sentencia: en el UPDATE las columnas
+        # tienen el valor anterior, así que 'espera' y 'lleno' parten de la misma fila.
+        ahora = time.time()
+        parametros = {"clave": clave, "ahora": ahora, "intervalo": intervalo,
+                      "limite": intervalo * capacidad}
+        conexion = self._conexion()
+        espera = conexion.execute(
+            "INSERT INTO cupos (clave, lleno, espera) VALUES (:clave, :ahora + :intervalo, 0) "
+            "ON CONFLICT(clave) DO UPDATE SET "
+            "espera = MAX(MAX(lleno, :ahora) + :intervalo - :ahora - :limite, 0), "
+            "lleno = CASE WHEN MAX(lleno, :ahora) + :intervalo - :ahora <= :limite "
+            "THEN MAX(lleno, :ahora) + :intervalo ELSE lleno END "
+            "RETURNING espera",
+            parametros
+        ).fetchone()[0]
+        self._consumos += 1
+        if self._consumos % LIMPIEZA_CUPOS == 0:
+            conexion.execute("DELETE FROM cupos WHERE lleno <= ?", (ahora,))
+        return espera
+
+# Contador que se lee junto a las versiones de cada ETag y entrada de caché: incrementarlo
+# invalida todo en todos los workers (si no se pudo incrementar una versión concreta).
+CLAVE_VERSION_GLOBAL = "__version_global__"
+
+# Cada cuántas comprobaciones se borran las que ya están llenas.
+LIMPIEZA_CUPOS = 10000
+# Cada cuántas escrituras (set) se borran las claves caducadas.
+LIMPIEZA_CADUCADOS = 1000
+
+_almacen: Optional[AlmacenKV] = None
+_lock_creacion = threading.Lock()
+
+def obtener_almacen() -> AlmacenKV:
+    """Devuelve el almacén configurado en settings.KV_BACKEND (se crea la primera vez)."""
+    global _almacen
+    if _almacen is None:
+        with _lock_creacion:
+            if _almacen is None:
+                if settings.KV_BACKEND == "sqlite":
+                    _almacen = AlmacenSQLite(settings.KV_SQLITE_PATH)
+                else:
+                    _almacen = AlmacenMemoria()
+    return _almacen
@@ -0,0 +1,272 @@
+# utils/metricas.py
+
+"""
+Métricas del servidor en formato de texto de Prometheus.
+
+Tipos propios muy simples (contador e histograma) para que registrar una muestra
+cueste un par de microsegundos y se puedan dejar siempre activos. Los valores que
+ya cuentan otros módulos (caché, coalescencia, compresión, admisión, pool de la base
+de datos, hilos...) se leen solo al exportar, mediante colectores.
+
+Con varios workers cada uno vuelca su instantánea en settings.METRICAS_DIR cada
+settings.METRICAS_INTERVALO segundos; /metrics las suma todas, así da igual a qué
+worker llegue la petición de Prometheus. Cuando un worker termina (reciclado o
+caído) sus contadores e histogramas se suman a un acumulado persistente en la misma
+carpeta, para que los totales nunca bajen: Prometheus tomaría cualquier bajada por
+un reinicio y contaría de nuevo todo lo acumulado como un pico en rate().
+"""
+import os
+import json
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterable
+
+try:
+    import fcntl
+except ImportError:
+    # Windows (entorno de desarrollo): cerrojo con msvcrt.
+    fcntl = None
+    import msvcrt
+
+PREFIJO = "moveon_"
+
+# Límites (segundos) de las cubetas de latencia.
+CUBETAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Instantánea: {nombre: {"tipo", "ayuda", "muestras": {etiquetas: valor | [cubetas..., suma]}}}
+Instantanea = dict[str, dict]
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def etiquetas(nombres: Iterable[str], valores: Iterable[str]) -> str:
+    """'ruta="/x",metodo="GET"' a partir de los nombres y valores de las etiquetas."""
+    return ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores))
+
+class Contador:
+    """Contador creciente con etiquetas."""
+
+    tipo = "counter"
+
+    def __init__(self, nombre: str, ayuda: str, nombres_etiquetas: tuple[str, ...] = ()):
+        self.nombre = PREFIJO + nombre
+        self.ayuda = ayuda
+        self.nombres_etiquetas = nombres_etiquetas
+        self._valores: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def inc(self, *valores_etiquetas: str, cantidad: float = 1):
+        with self._lock:
+            self._valores[valores_etiquetas] = self._valores.get(valores_etiquetas, 0) + cantidad
+
+    def muestras(self) -> dict:
+        with self._lock:
+            return {etiquetas(self.nombres_etiquetas, clave): valor for clave, valor in self._valores.items()}
+
+class Histograma:
+    """Histograma con cubetas fijas. Guarda la cuenta de cada cubeta (no acumulada) y la suma."""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, nombres_etiquetas: tuple[str, ...] = (),
+                 cubetas: tuple[float, ...] = CUBETAS_LATENCIA):
+        self.nombre = PREFIJO + nombre
+        self.ayuda = ayuda
+        self.nombres_etiquetas = nombres_etiquetas
+        self.cubetas = cubetas
+        # Por etiquetas: [cuenta por cubeta..., cuenta en +Inf, suma]
+        self._valores: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def observar(self, valor: float, *valores_etiquetas: str):
+        posicion = bisect.bisect_left(self.cubetas, valor)
+        with self._lock:
+            datos = self._valores.get(valores_etiquetas)
+            if datos is None:
+                datos = self._valores[valores_etiquetas] = [0] * (len(self.cubetas) + 1) + [0.0]
+            datos[posicion] += 1
+            datos[-1] += valor
+
+    def muestras(self) -> dict:
+        with self._lock:
+            return {etiquetas(self.nombres_etiquetas, clave): list(datos) for clave, datos in self._valores.items()}
+
+_registro: list = []
+_colectores: list[Callable[[], Iterable[tuple[str, str, str, dict]]]] = []
+
+def registrar_colector(colector: Callable[[], Iterable[tuple[str, str, str, dict]]]):
+    """
+    Añade una función que se llama al exportar y devuelve tuplas
+    (tipo "counter"/"gauge", nombre sin prefijo, ayuda, {etiquetas: valor}).
+    Los medidores se suman entre workers: deben ser cantidades (no porcentajes).
+    """
+    _colectores.append(colector)
+
+def instantanea() -> Instantanea:
+    """Valores actuales de este worker."""
+    resultado: Instantanea = {}
+    for metrica in _registro:
+        resultado[metrica.nombre] = {"tipo": metrica.tipo, "ayuda": metrica.ayuda, "muestras": metrica.muestras()}
+        if metrica.tipo == "histogram":
+            resultado[metrica.nombre]["cubetas"] = list(metrica.cubetas)
+    for colector in _colectores:
+        for tipo, nombre, ayuda, muestras in colector():
+            resultado[PREFIJO + nombre] = {"tipo": tipo, "ayuda": ayuda, "muestras": muestras}
+    return resultado
+
+def combinar(instantaneas: list[Instantanea]) -> Instantanea:
+    """Suma las instantáneas de varios workers."""
+    resultado: Instantanea = {}
+    for datos in instantaneas:
+        for nombre, familia in datos.items():
+            destino = resultado.setdefault(nombre, {**familia, "muestras": {}})
+            for clave, valor in familia["muestras"].items():
+                anterior = destino["muestras"].get(clave)
+                if anterior is None:
+                    destino["muestras"][clave] = valor
+                elif isinstance(valor, list):
+                    destino["muestras"][clave] = [a + b for a, b in zip(anterior, valor)]
+                else:
+                    destino["muestras"][clave] = anterior + valor
+    return resultado
+
+def _linea(nombre: str, etiquetas_muestra: str, valor: float) -> str:
+    return f"{nombre}{{{etiquetas_muestra}}} {valor}" if etiquetas_muestra else f"{nombre} {valor}"
+
+def formato_prometheus(datos: Instantanea) -> str:
+    """Texto de exposición de Prometheus (versión 0.0.4)."""
+    lineas = []
+    for nombre in sorted(datos):
+        familia = datos[nombre]
+        lineas.append(f"# HELP {nombre} {familia['ayuda']}")
+        lineas.append(f"# TYPE {nombre} {familia['tipo']}")
+        for clave, valor in sorted(familia["muestras"].items()):
+            if familia["tipo"] != "histogram":
+                lineas.append(_linea(nombre, clave, valor))
+                continue
+            separador = "," if clave else ""
+            acumulado = 0
+            for limite, cuenta in zip([*familia["cubetas"], "+Inf"], valor[:-1]):
+                acumulado += cuenta
+                lineas.append(_linea(f"{nombre}_bucket", f'{clave}{separador}le="{limite}"', acumulado))
+            lineas.append(_linea(f"{nombre}_sum", clave, round(valor[-1], 6)))
+            lineas.append(_linea(f"{nombre}_count", clave, acumulado))
+    return "\n".join(lineas) + "\n"
+
+def _ruta_volcado(directorio: str, pid: int) -> str:
+    return os.path.join(directorio, f"{pid}.json")
+
+def _escribir(destino: str, datos: Instantanea):
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    with open(temporal, "w") as archivo:
+        json.dump(datos, archivo)
+    os.replace(temporal, destino)
+
+def _leer(ruta: str) -> Instantanea:
+    try:
+        with open(ruta) as contenido:
+            return json.load(contenido)
+    except (OSError, ValueError):
+        return {}
+
+def volcar(directorio: str):
+    """Escribe la instantánea de este worker para que la sumen los demás."""
+    os.makedirs(directorio, exist_ok=True)
+    _escribir(_ruta_volcado(directorio, os.getpid()), instantanea())
+
+def _proceso_vivo(pid: int) -> bool:
+    if os.name == "nt":
+        return _proceso_vivo_windows(pid)
+    try:
+        # La señal 0 solo comprueba que el proceso existe.
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _proceso_vivo_windows(pid: int) -> bool:
+    # En Windows os.kill(pid, 0) termina el proceso: se consulta su código de salida.
+    import ctypes
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    proceso = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+    if not proceso:
+        # Acceso denegado (5): existe, pero es de otro usuario.
+        return ctypes.get_last_error() == 5
+    try:
+        codigo = ctypes.c_ulong()
+        if not kernel32.GetExitCodeProcess(proceso, ctypes.byref(codigo)):
+            return True
+        return codigo.value == 259  # STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(proceso)
+
+@contextmanager
+def _cerrojo(directorio: str):
+    """Cerrojo exclusivo entre los workers sobre la carpeta compartida."""
+    with open(os.path.join(directorio, ".cerrojo"), "a+") as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+            yield
+            return
+        archivo.seek(0)
+        while True:
+            try:
+                msvcrt.locking(archivo.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                # LK_LOCK se rinde tras unos 10 s de espera: se sigue esperando.
+                continue
+        try:
+            yield
+        finally:
+            archivo.seek(0)
+            msvcrt.locking(archivo.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _solo_crecientes(datos: Instantanea) -> Instantanea:
+    """Contadores e histogramas; los gauges de un worker terminado ya no valen nada."""
+    return {nombre: familia for nombre, familia in datos.items() if familia["tipo"] != "gauge"}
+
+def _volcados_otros_workers(directorio: str) -> list[Instantanea]:
+    """
+    Acumulado de los workers terminados más los volcados de los vivos. Los volcados de los
+    terminados se suman al acumulado y se borran, con un cerrojo entre workers para que
+    ninguno se sume dos veces.
+    """
+    ruta_acumulado = os.path.join(directorio, "acumulado.json")
+    with _cerrojo(directorio):
+        acumulado = _leer(ruta_acumulado)
+        vivos, terminados = [], {}
+        for archivo in os.listdir(directorio):
+            nombre, extension = os.path.splitext(archivo)
+            if extension != ".json" or not nombre.isdigit() or int(nombre) == os.getpid():
+                continue
+            ruta = os.path.join(directorio, archivo)
+            if _proceso_vivo(int(nombre)):
+                vivos.append(_leer(ruta))
+            else:
+                terminados[ruta] = _solo_crecientes(_leer(ruta))
+        if terminados:
+            acumulado = combinar([acumulado, *terminados.values()])
+            # Primero el acumulado: si algo falla antes de borrar, se repite la suma (nunca se pierde).
+            _escribir(ruta_acumulado, acumulado)
+            for ruta in terminados:
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+    return [acumulado, *vivos]
+
+def exportar(directorio: str = "") -> str:
+    """
+    Métricas de todos los workers (o solo de este si no hay directorio compartido).
+    El directorio solo se pasa con varios workers (middlewares.metricas.directorio_compartido).
+    """
+    instantaneas = [instantanea()]
+    if directorio and os.path.isdir(directorio):
+        instantaneas.extend(_volcados_otros_workers(directorio))
+    return formato_prometheus(combinar(instantaneas))
@@ -0,0 +1,194 @@
+# utils/perfilador.py
+
+"""
+Perfilador estadístico de peticiones.
+
+Un hilo toma cada settings.PERFIL_INTERVALO segundos la pila de todos los hilos
+(sys._current_frames) y asigna cada muestra a la petición perfilada a la que pertenece:
+    - En el hilo del bucle de eventos: si la pila contiene el marco del middleware
+      de esa petición (una corrutina solo está en la pila mientras se ejecuta).
+    - En los hilos del pool de anyio: si el contexto copiado de la tarea que ejecutan
+      (variable local 'context' de WorkerThread.run) es el de esa petición. Es un detalle
+      interno de anyio (versión fijada en requirements.txt y comprobada en tests/): si
+      cambia, se avisa al importar y esas muestras no se asignan.
+Así se ve también el trabajo de los endpoints síncronos (jose, bcrypt, Pydantic,
+SQLAlchemy...), que un perfilador determinista como cProfile no sigue fuera de su hilo.
+El hilo de muestreo solo existe mientras hay alguna petición perfilada.
+"""
+import os
+import re
+import sys
+import time
+import uuid
+import logging
+import threading
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from types import CodeType, FrameType
+from typing import Optional
+
+# Etiquetas de las pilas que se suman en cada categoría (tiempo inclusivo).
+# bcrypt es código nativo sin marcos de Python: se reconoce por las funciones de auth.py que lo llaman.
+CATEGORIAS = {
+    "jose": ("jose/",),
+    "bcrypt": ("bcrypt/", "comprobar_contraseña (auth.py)", "encriptar_contraseña (auth.py)"),
+    "pydantic": ("pydantic/", "pydantic_core/"),
+    "sqlalchemy": ("sqlalchemy/",),
+    "postgres": ("psycopg2/",),
+}
+
+logger = logging.getLogger("moveon.perfilador")
+
+# Nombres de los informes: solo estos archivos se borran al rotar settings.PERFIL_DIR.
+PATRON_INFORME = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{8}\.txt$")
+
+def _codigo_hilo_anyio() -> Optional[CodeType]:
+    """Código de WorkerThread.run si guarda el contexto de la tarea en la variable 'context'."""
+    try:
+        from anyio._backends._asyncio import WorkerThread
+    except ImportError:
+        return None
+    codigo = WorkerThread.run.__code__
+    return codigo if "context" in codigo.co_varnames else None
+
+_CODIGO_HILO = _codigo_hilo_anyio()
+if _CODIGO_HILO is None:
+    logger.warning("Versión de anyio no compatible: no se asignarán las muestras de los hilos del pool")
+
+def atribuye_hilos() -> bool:
+    """Si las muestras de los hilos del pool de anyio se asignan a su petición."""
+    return _CODIGO_HILO is not None
+
+_RAICES = sorted({p for p in sys.path if p and os.path.isdir(p)} | {os.getcwd()}, key=len, reverse=True)
+
+@lru_cache(maxsize=8192)
+def _etiqueta(codigo: CodeType) -> str:
+    archivo = codigo.co_filename
+    for raiz in _RAICES:
+        if archivo.startswith(raiz + os.sep):
+            archivo = archivo[len(raiz) + 1:]
+            break
+    return f"{codigo.co_name} ({archivo})"
+
+class Perfil:
+    """Muestras de una petición: pilas (de la raíz a la hoja) con el tiempo que representan."""
+
+    def __init__(self, marco: FrameType):
+        self.marco = marco
+        self.pilas: Counter = Counter()
+        self.muestras = 0
+        self.inicio = time.perf_counter()
+        self.duracion = 0.0
+
+    def tiempo_por_categoria(self) -> dict[str, float]:
+        tiempos = dict.fromkeys(CATEGORIAS, 0.0)
+        for pila, tiempo in self.pilas.items():
+            for categoria, patrones in CATEGORIAS.items():
+                if any(patron in etiqueta for etiqueta in pila for patron in patrones):
+                    tiempos[categoria] += tiempo
+        return tiempos
+
+    def informe(self, titulo: str) -> str:
+        """Resumen por categorías y pilas en formato "colapsado" (flamegraph.pl, speedscope)."""
+        lineas = [
+            f"# {titulo}",
+            f"# duracion_ms={self.duracion * 1000:.1f} muestras={self.muestras} hilos_pool={atribuye_hilos()}",
+            *(f"# {categoria}_ms={tiempo * 1000:.1f}" for categoria, tiempo in self.tiempo_por_categoria().items()),
+        ]
+        for pila, tiempo in self.pilas.most_common():
+            lineas.append(f"{';'.join(pila)} {round(tiempo * 1e6)}")
+        return "\n".join(lineas) + "\n"
+
+perfil_actual: ContextVar[Optional[Perfil]] = ContextVar("perfil_actual", default=None)
+
+class _Muestreador:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.activos: dict[int, Perfil] = {}
+        self.hilo: Optional[threading.Thread] = None
+
+    def iniciar(self, perfil: Perfil, intervalo: float):
+        with self.lock:
+            self.activos[id(perfil.marco)] = perfil
+            if self.hilo is None:
+                self.hilo = threading.Thread(target=self._bucle, args=(intervalo,), name="perfilador", daemon=True)
+                self.hilo.start()
+
+    def terminar(self, perfil: Perfil):
+        with self.lock:
+            self.activos.pop(id(perfil.marco), None)
+        perfil.duracion = time.perf_counter() - perfil.inicio
+
+    def tiempos(self, perfil: Perfil) -> tuple[float, dict[str, float]]:
+        """Duración hasta ahora y tiempo por categoría de un perfil todavía activo."""
+        with self.lock:
+            return time.perf_counter() - perfil.inicio, perfil.tiempo_por_categoria()
+
+    def _propietario(self, marco: Optional[FrameType], activos: dict[int, Perfil]) -> Optional[Perfil]:
+        while marco is not None:
+            perfil = activos.get(id(marco))
+            if perfil is not None and perfil.marco is marco:
+                return perfil
+            if marco.f_code is _CODIGO_HILO:
+                contexto = marco.f_locals.get("context")
+                return contexto.get(perfil_actual) if contexto is not None else None
+            marco = marco.f_back
+        return None
+
+    def _bucle(self, intervalo: float):
+        propio = threading.get_ident()
+        anterior = time.perf_counter()
+        while True:
+            time.sleep(intervalo)
+            # Con el lock tomado: al volver de terminar() ya no se escribe en ese perfil.
+            with self.lock:
+                if not self.activos:
+                    self.hilo = None
+                    return
+                ahora = time.perf_counter()
+                transcurrido, anterior = ahora - anterior, ahora
+                for ident, marco in sys._current_frames().items():
+                    if ident == propio:
+                        continue
+                    perfil = self._propietario(marco, self.activos)
+                    if perfil is None:
+                        continue
+                    pila = []
+                    while marco is not None:
+                        pila.append(_etiqueta(marco.f_code))
+                        marco = marco.f_back
+                    perfil.pilas[tuple(reversed(pila))] += transcurrido
+                    perfil.muestras += 1
+
+_muestreador = _Muestreador()
+
+def iniciar(marco: FrameType, intervalo: float) -> tuple[Perfil, object]:
+    """Empieza a perfilar la petición cuyo middleware se ejecuta en 'marco'."""
+    perfil = Perfil(marco)
+    token = perfil_actual.set(perfil)
+    _muestreador.iniciar(perfil, intervalo)
+    return perfil, token
+
+def terminar(perfil: Perfil, token):
+    _muestreador.terminar(perfil)
+    perfil_actual.reset(token)
+
+def tiempos(perfil: Perfil) -> tuple[float, dict[str, float]]:
+    return _muestreador.tiempos(perfil)
+
+def nombre_informe() -> str:
+    """Nombre único de un informe (fecha y sufijo aleatorio)."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.txt"
+
+def guardar(directorio: str, nombre: str, contenido: str, max_archivos: int):
+    """Guarda el informe y borra los informes más antiguos si hay más de max_archivos (el resto no se toca)."""
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, nombre), "w") as archivo:
+        archivo.write(contenido)
+    informes = sorted(
+        (entrada for entrada in os.scandir(directorio) if entrada.is_file() and PATRON_INFORME.match(entrada.name)),
+        key=lambda entrada: entrada.stat().st_mtime
+    )
+    for entrada in informes[:-max_archivos]:
+        os.remove(entrada.path)
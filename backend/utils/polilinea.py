@@ -0,0 +1,178 @@
+# utils/polilinea.py
+
+"""
+Utilidades de geometría para las rutas.
+
+Decodifica polilíneas en formato Google Maps y convierte coordenadas
+al sistema de teselas Web Mercator (el mismo que usan los mapas de la App).
+Todas las operaciones están vectorizadas con NumPy.
+"""
+import math
+import numpy as np
+
+# Tamaño en píxeles de una tesela de mapa.
+TAMANO_TESELA = 256
+# Latitud máxima representable en Web Mercator.
+LATITUD_MAXIMA = 85.05112878
+
+def decodificar_polilinea(polilinea: str, precision: int = 5) -> np.ndarray:
+    """
+    Decodifica una polilínea de Google Maps a un array (N, 2) de [latitud, longitud].
+
+    En lugar de recorrer carácter a carácter, se agrupan los bloques de 5 bits
+    de cada número con operaciones vectorizadas.
+    """
+    if not polilinea:
+        return np.empty((0, 2), dtype=np.float64)
+
+    try:
+        datos = np.frombuffer(polilinea.encode("ascii"), dtype=np.uint8).astype(np.int64) - 63
+    except UnicodeEncodeError:
+        raise ValueError("Error: La polilínea contiene caracteres no válidos")
+    if datos.min() < 0 or datos.max() > 63:
+        raise ValueError("Error: La polilínea contiene caracteres no válidos")
+
+    # Un bloque sin el bit de continuación (0x20) cierra un número.
+    fin = datos < 0x20
+    # Número al que pertenece cada bloque y posición del bloque dentro del número.
+    grupo = np.concatenate(([0], np.cumsum(fin)[:-1]))
+    inicio_grupo = np.flatnonzero(np.concatenate(([True], fin[:-1])))
+    posicion = np.arange(datos.size) - inicio_grupo[grupo]
+
+    # Los valores caben en 32 bits, así que la suma en float64 es exacta.
+    valores = np.bincount(grupo, weights=(datos & 0x1F) << (5 * posicion)).astype(np.int64)
+    # Se descarta un número final incompleto (polilínea truncada).
+    if not fin[-1]:
+        valores = valores[:-1]
+
+    # Decodificación zigzag del signo.
+    valores = np.where(valores & 1, ~(valores >> 1), valores >> 1)
+
+    # Cada punto son dos números (lat, lon) y vienen como diferencias acumuladas.
+    num_puntos = valores.size // 2
+    deltas = valores[:num_puntos * 2].reshape(num_puntos, 2)
+    return np.cumsum(deltas, axis=0) / (10 ** precision)
+
+def calcular_bbox(puntos: np.ndarray):
+    """Devuelve (lat_min, lat_max, lon_min, lon_max) de un array de puntos o None si está vacío."""
+    if puntos.size == 0:
+        return None
+    lat_min, lon_min = puntos.min(axis=0)
+    lat_max, lon_max = puntos.max(axis=0)
+    return float(lat_min), float(lat_max), float(lon_min), float(lon_max)
+
+def latlon_a_pixeles(puntos: np.ndarray, z: int) -> np.ndarray:
+    """Proyecta [latitud, longitud] a píxeles globales Web Mercator en el zoom indicado."""
+    escala = TAMANO_TESELA * (2 ** z)
+    lat = np.radians(np.clip(puntos[:, 0], -LATITUD_MAXIMA, LATITUD_MAXIMA))
+    x = (puntos[:, 1] + 180.0) / 360.0 * escala
+    y = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * escala
+    return np.column_stack((x, y))
+
+def tesela_a_bbox(z: int, x: int, y: int):
+    """Devuelve (lat_min, lat_max, lon_min, lon_max) que cubre una tesela."""
+    n = 2 ** z
+    lon_min = x / n * 360.0 - 180.0
+    lon_max = (x + 1) / n * 360.0 - 180.0
+    lat_max = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    lat_min = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * (y + 1) / n))))
+    return lat_min, lat_max, lon_min, lon_max
+
+def teselas_en_bbox(bbox, z: int):
+    """Devuelve los rangos (x_min, x_max, y_min, y_max) de teselas que cubren un bbox en el zoom z."""
+    lat_min, lat_max, lon_min, lon_max = bbox
+    esquinas = latlon_a_pixeles(np.array([[lat_max, lon_min], [lat_min, lon_max]]), z) // TAMANO_TESELA
+    limite = 2 ** z - 1
+    x_min, y_min = np.clip(esquinas[0], 0, limite).astype(int)
+    x_max, y_max = np.clip(esquinas[1], 0, limite).astype(int)
+    return int(x_min), int(x_max), int(y_min), int(y_max)
+
+# Alfabeto base32 de los geohash.
+_BASE32_GEOHASH = np.array(list("0123456789bcdefghjkmnpqrstuvwxyz"))
+# Metros por grado de latitud (aproximación suficiente para distancias cortas).
+METROS_POR_GRADO = 111320.0
+
+def codificar_geohash(puntos: np.ndarray, precision: int = 6) -> np.ndarray:
+    """Calcula el geohash de cada punto [latitud, longitud] de forma vectorizada."""
+    bits_totales = 5 * precision
+    bits_lon = (bits_totales + 1) // 2
+    bits_lat = bits_totales // 2
+    lat = np.clip(puntos[:, 0], -90.0, np.nextafter(90.0, 0))
+    lon = np.clip(puntos[:, 1], -180.0, np.nextafter(180.0, 0))
+    lat_i = ((lat + 90.0) / 180.0 * (1 << bits_lat)).astype(np.int64)
+    lon_i = ((lon + 180.0) / 360.0 * (1 << bits_lon)).astype(np.int64)
+
+    # Intercalado de bits empezando por la longitud (bit más significativo primero).
+    codigo = np.zeros(len(puntos), dtype=np.int64)
+    for i in range(bits_totales):
+        if i % 2 == 0:
+            bit = (lon_i >> (bits_lon - 1 - i // 2)) & 1
+        else:
+            bit = (lat_i >> (bits_lat - 1 - i // 2)) & 1
+        codigo = (codigo << 1) | bit
+
+    desplazamientos = 5 * np.arange(precision - 1, -1, -1)
+    caracteres = _BASE32_GEOHASH[(codigo[:, None] >> desplazamientos) & 0x1F]
+    return np.array(["".join(fila) for fila in caracteres])
+
+def a_metros(puntos: np.ndarray, latitud_referencia: float) -> np.ndarray:
+    """Proyección equirectangular local a metros (válida para distancias de pocos km)."""
+    x = puntos[:, 1] * METROS_POR_GRADO * math.cos(math.radians(latitud_referencia))
+    y = puntos[:, 0] * METROS_POR_GRADO
+    return np.column_stack((x, y))
+
+def distancias_acumuladas(puntos: np.ndarray) -> np.ndarray:
+    """Distancia recorrida (m) hasta cada punto de la ruta, empezando en 0."""
+    if len(puntos) == 0:
+        return np.zeros(0)
+    metros = a_metros(puntos, float(puntos[:, 0].mean()))
+    tramos = np.hypot(*np.diff(metros, axis=0).T)
+    return np.concatenate(([0.0], np.cumsum(tramos)))
+
+def densificar(puntos: np.ndarray, paso: float) -> np.ndarray:
+    """Añade puntos intermedios en línea recta para que ningún tramo mida más de 'paso' metros."""
+    if len(puntos) < 2:
+        return puntos
+    partes = np.maximum(1, np.ceil(np.diff(distancias_acumuladas(puntos)) / paso).astype(np.int64))
+    tramo = np.repeat(np.arange(len(partes)), partes)
+    t = (np.arange(partes.sum()) - np.repeat(np.cumsum(partes) - partes, partes)) / partes[tramo]
+    intermedios = puntos[tramo] + t[:, None] * (puntos[tramo + 1] - puntos[tramo])
+    return np.vstack((intermedios, puntos[-1:]))
+
+def proyectar_en_tramos(punto: np.ndarray, linea: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Proyección de un punto [latitud, longitud] sobre cada tramo de la polilínea 'linea':
+    distancia (m) a cada tramo y fracción (0-1) del tramo en la que cae la proyección.
+    """
+    referencia = float(linea[:, 0].mean())
+    p = a_metros(punto.reshape(1, 2), referencia)[0]
+    l = a_metros(linea, referencia)
+    a = l[:-1]
+    ab = l[1:] - a
+    t = np.clip(((p - a) * ab).sum(axis=1) / np.maximum((ab ** 2).sum(axis=1), 1e-12), 0.0, 1.0)
+    distancias = np.hypot(*(p - (a + t[:, None] * ab)).T)
+    return distancias, t
+
+def distancia_a_polilinea(puntos: np.ndarray, linea: np.ndarray, max_elementos: int = 1_000_000) -> np.ndarray:
+    """
+    Distancia mínima (m) de cada punto a la polilínea 'linea'.
+    Se calcula contra todos los tramos a la vez; si la matriz es muy grande se procesa por bloques.
+    """
+    referencia = float(np.concatenate((puntos[:, 0], linea[:, 0])).mean())
+    p = a_metros(puntos, referencia)
+    l = a_metros(linea, referencia)
+    if len(l) == 1:
+        return np.hypot(*(p - l[0]).T)
+
+    a = l[:-1]
+    ab = l[1:] - a
+    longitud2 = np.maximum((ab ** 2).sum(axis=1), 1e-12)
+    bloque = max(1, max_elementos // len(a))
+    resultado = np.empty(len(p))
+
+    for inicio in range(0, len(p), bloque):
+        q = p[inicio:inicio + bloque, None, :]
+        t = np.clip(((q - a) * ab).sum(axis=2) / longitud2, 0.0, 1.0)
+        proyeccion = a + t[..., None] * ab
+        resultado[inicio:inicio + bloque] = np.hypot(*(q - proyeccion).transpose(2, 0, 1)).min(axis=1)
+    return resultado
@@ -0,0 +1,37 @@
+# utils/procesos.py
+
+"""
+Pool de procesos compartido para el trabajo intensivo de CPU (rasterizado de mapas).
+
+Se crea de forma perezosa para no arrancar procesos en cada worker si nunca se usa,
+y emplea 'spawn' para no heredar el estado del servidor (hilos, conexiones a la BD).
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from config import settings
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def obtener_pool() -> ProcessPoolExecutor:
+    """Devuelve el pool de procesos, creándolo en el primer uso."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.PROCESS_POOL_WORKERS or None,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+async def ejecutar_en_proceso(funcion, *args):
+    """Ejecuta una función en el pool de procesos sin bloquear el bucle de eventos."""
+    bucle = asyncio.get_running_loop()
+    return await bucle.run_in_executor(obtener_pool(), funcion, *args)
+
+def cerrar_pool():
+    """Detiene el pool de procesos (al apagar el servidor)."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
@@ -0,0 +1,132 @@
+# utils/registro.py
+
+"""
+Registro (logs) en JSON sin bloquear.
+
+Los loggers "moveon.*" no escriben directamente: dejan cada registro en una cola
+acotada y un hilo (QueueListener) los escribe en stdout o en settings.LOG_ARCHIVO.
+Así la escritura nunca bloquea el bucle de eventos ni los hilos del pool; si la
+cola se llena (disco o terminal atascados) los registros se descartan y se cuentan.
+
+Cada registro lleva el id de la petición y el usuario de la petición en curso
+(los pone el middleware de registro) y los campos pasados con extra={...}.
+"""
+import sys
+import copy
+import queue
+import logging
+import threading
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+from typing import Optional
+import orjson
+from config import settings
+from utils import metricas
+
+REGISTROS_DESCARTADOS = metricas.Contador(
+    "log_descartados_total", "Registros descartados con la cola de logs llena"
+)
+
+# Atributos propios de LogRecord: el resto son campos pasados con extra={...}.
+_ATRIBUTOS_ESTANDAR = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class ContextoPeticion:
+    """Datos de la petición en curso. Es mutable: el usuario se conoce después (en la autenticación)."""
+
+    def __init__(self, id_peticion: str):
+        self.id = id_peticion
+        self.usuario: Optional[str] = None
+
+_contexto: ContextVar[Optional[ContextoPeticion]] = ContextVar("contexto_registro", default=None)
+
+def iniciar_peticion(id_peticion: str) -> tuple[ContextoPeticion, object]:
+    contexto = ContextoPeticion(id_peticion)
+    return contexto, _contexto.set(contexto)
+
+def terminar_peticion(token):
+    _contexto.reset(token)
+
+def anotar_usuario(usuario: str):
+    """Usuario autenticado de la petición en curso (funciona también desde los hilos del pool)."""
+    contexto = _contexto.get()
+    if contexto is not None:
+        contexto.usuario = usuario
+
+class FormatoJSON(logging.Formatter):
+    """Un objeto JSON por línea."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "fecha": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage(),
+        }
+        for clave, valor in vars(record).items():
+            if clave not in _ATRIBUTOS_ESTANDAR and valor is not None:
+                datos[clave] = valor
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            datos["excepcion"] = record.exc_text
+        return orjson.dumps(datos, default=str).decode()
+
+class _ManejadorCola(QueueHandler):
+    """Encola sin esperar nunca; el JSON se genera en el hilo del listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Lo que depende del hilo o puede cambiar después se resuelve aquí.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        contexto = _contexto.get()
+        if contexto is not None:
+            record.peticion = contexto.id
+            record.usuario = contexto.usuario
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            REGISTROS_DESCARTADOS.inc()
+
+class _Registro:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listener: Optional[QueueListener] = None
+
+_registro = _Registro()
+
+def iniciar():
+    """Conecta los loggers "moveon.*" a la cola y arranca el hilo que escribe (idempotente)."""
+    with _registro.lock:
+        if _registro.listener is not None:
+            return
+        if settings.LOG_ARCHIVO:
+            destino: logging.Handler = WatchedFileHandler(settings.LOG_ARCHIVO, encoding="utf-8")
+        else:
+            destino = logging.StreamHandler(sys.stdout)
+        destino.setFormatter(FormatoJSON())
+
+        cola: queue.Queue = queue.Queue(maxsize=settings.LOG_COLA_MAX)
+        logger = logging.getLogger("moveon")
+        logger.handlers = [_ManejadorCola(cola)]
+        logger.setLevel(settings.LOG_NIVEL)
+        logger.propagate = False
+
+        _registro.listener = QueueListener(cola, destino)
+        _registro.listener.start()
+
+def detener():
+    """Escribe lo que quede en la cola y detiene el hilo."""
+    with _registro.lock:
+        if _registro.listener is None:
+            return
+        _registro.listener.stop()
+        for manejador in _registro.listener.handlers:
+            manejador.close()
+        _registro.listener = None
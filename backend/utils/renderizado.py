@@ -0,0 +1,172 @@
+# utils/renderizado.py
+
+"""
+Funciones de rasterizado (mapas de calor, miniaturas de rutas y fotos de perfil).
+
+Se ejecutan dentro del pool de procesos (utils/procesos.py), por eso solo
+dependen de NumPy, Pillow y utils.polilinea: nada de base de datos ni FastAPI.
+Pillow se importa dentro de cada función: el servidor web solo usa nombre_derivado
+y así no lo carga al arrancar.
+"""
+import io
+import os
+import numpy as np
+from utils import polilinea as geo
+
+# Máximo de puntos interpolados por tramo para que un tramo enorme no dispare la memoria.
+MAX_PASOS_TRAMO = 4 * geo.TAMANO_TESELA
+
+def _paleta_calor() -> np.ndarray:
+    """Tabla de 256 colores RGBA (azul -> cian -> amarillo -> rojo) con transparencia creciente."""
+    t = np.linspace(0.0, 1.0, 256)
+    rojo = np.clip(2.0 * t - 0.3, 0, 1)
+    verde = np.clip(1.6 - np.abs(2.6 * t - 1.5), 0, 1)
+    azul = np.clip(1.2 - 2.2 * t, 0, 1)
+    alfa = np.clip(0.35 + t, 0, 1)
+    paleta = np.column_stack((rojo, verde, azul, alfa)) * 255
+    paleta[0] = 0  # Sin datos = transparente.
+    return paleta.astype(np.uint8)
+
+PALETA_CALOR = _paleta_calor()
+
+def densificar(pixeles: np.ndarray) -> np.ndarray:
+    """
+    Interpola puntos a lo largo de cada tramo para que las líneas no queden
+    punteadas en zooms altos (aprox. un punto por píxel).
+    """
+    if len(pixeles) < 2:
+        return pixeles
+    origen = pixeles[:-1]
+    vector = pixeles[1:] - pixeles[:-1]
+    pasos = np.clip(np.ceil(np.abs(vector).max(axis=1)), 1, MAX_PASOS_TRAMO).astype(np.int64)
+
+    tramo = np.repeat(np.arange(len(pasos)), pasos)
+    inicio_tramo = np.repeat(np.cumsum(pasos) - pasos, pasos)
+    t = (np.arange(pasos.sum()) - inicio_tramo) / np.repeat(pasos, pasos)
+    interpolados = origen[tramo] + vector[tramo] * t[:, None]
+    return np.vstack((interpolados, pixeles[-1:]))
+
+def acumular_densidad(polilineas: list[str], z: int, x: int, y: int, tamano: int = geo.TAMANO_TESELA) -> np.ndarray:
+    """Acumula en una rejilla (tamano x tamano) cuántas rutas pasan por cada píxel de la tesela."""
+    escala = tamano / geo.TAMANO_TESELA
+    origen = np.array([x, y], dtype=np.float64) * geo.TAMANO_TESELA
+    indices = []
+
+    for texto in polilineas:
+        try:
+            puntos = geo.decodificar_polilinea(texto)
+        except ValueError:
+            continue
+        if len(puntos) == 0:
+            continue
+        pixeles = (geo.latlon_a_pixeles(puntos, z) - origen) * escala
+        pixeles = densificar(pixeles)
+        columnas = pixeles[:, 0].astype(np.int64)
+        filas = pixeles[:, 1].astype(np.int64)
+        dentro = (columnas >= 0) & (columnas < tamano) & (filas >= 0) & (filas < tamano)
+        if dentro.any():
+            # np.unique evita que una ruta sume varias veces el mismo píxel.
+            indices.append(np.unique(filas[dentro] * tamano + columnas[dentro]))
+
+    if not indices:
+        return np.zeros((tamano, tamano), dtype=np.float64)
+    conteo = np.bincount(np.concatenate(indices), minlength=tamano * tamano)
+    return conteo.reshape(tamano, tamano).astype(np.float64)
+
+def _engrosar(rejilla: np.ndarray) -> np.ndarray:
+    """Suaviza la rejilla con una ventana 3x3 para que las líneas tengan grosor visible."""
+    acolchada = np.pad(rejilla, 1)
+    suma = np.zeros_like(rejilla)
+    for dy in range(3):
+        for dx in range(3):
+            suma += acolchada[dy:dy + rejilla.shape[0], dx:dx + rejilla.shape[1]]
+    return np.maximum(rejilla, suma / 4.0)
+
+def renderizar_heatmap(polilineas: list[str], z: int, x: int, y: int) -> bytes:
+    """Genera el PNG (RGBA, 256x256) del mapa de calor de una tesela."""
+    densidad = _engrosar(acumular_densidad(polilineas, z, x, y))
+    maximo = densidad.max()
+
+    if maximo > 0:
+        # Escala logarítmica para que las zonas muy transitadas no apaguen al resto.
+        normalizada = np.log1p(densidad) / np.log1p(maximo)
+        niveles = np.where(densidad > 0, np.clip(normalizada * 255, 1, 255), 0).astype(np.uint8)
+    else:
+        niveles = np.zeros(densidad.shape, dtype=np.uint8)
+
+    from PIL import Image
+
+    imagen = Image.fromarray(PALETA_CALOR[niveles])
+    buffer = io.BytesIO()
+    imagen.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def renderizar_instantanea_ruta(polilinea: str, ancho: int, alto: int) -> bytes:
+    """
+    Genera una miniatura PNG de la ruta (sin mapa base) para los listados de la App.
+    La ruta se encaja centrada conservando la proporción de la proyección Web Mercator.
+    """
+    from PIL import Image, ImageDraw
+
+    margen = 12
+    imagen = Image.new("RGB", (ancho, alto), (242, 244, 247))
+    puntos = geo.decodificar_polilinea(polilinea)
+
+    if len(puntos) > 0:
+        # Se proyecta a un zoom alto y luego se escala para que quepa en la imagen.
+        pixeles = geo.latlon_a_pixeles(puntos, 20)
+        minimo = pixeles.min(axis=0)
+        extension = np.maximum(pixeles.max(axis=0) - minimo, 1e-9)
+        escala = min((ancho - 2 * margen) / extension[0], (alto - 2 * margen) / extension[1])
+        desplazamiento = (np.array([ancho, alto]) - extension * escala) / 2
+        coordenadas = (pixeles - minimo) * escala + desplazamiento
+
+        dibujo = ImageDraw.Draw(imagen)
+        trazo = [tuple(p) for p in coordenadas.round(1).tolist()]
+        if len(trazo) > 1:
+            dibujo.line(trazo, fill=(0, 123, 255), width=4, joint="curve")
+        # Marcadores de salida (verde) y llegada (rojo).
+        for (px, py), color in ((trazo[0], (40, 167, 69)), (trazo[-1], (220, 53, 69))):
+            dibujo.ellipse((px - 5, py - 5, px + 5, py + 5), fill=color, outline=(255, 255, 255), width=2)
+
+    buffer = io.BytesIO()
+    imagen.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+# Formatos de los derivados de las fotos: WebP para la App y JPEG como alternativa universal.
+FORMATOS_DERIVADOS = {"webp": "WEBP", "jpg": "JPEG"}
+# Límite de píxeles de la imagen original (protección contra "bombas de descompresión").
+MAX_PIXELES_FOTO = 40_000_000
+
+def nombre_derivado(nombre_archivo: str, tamano: int, formato: str) -> str:
+    """Nombre del derivado de una foto: perfil_x.jpg -> perfil_x_64.webp"""
+    base, _ = os.path.splitext(nombre_archivo)
+    return f"{base}_{tamano}.{formato}"
+
+def generar_derivados_foto(ruta_original: str, tamanos: tuple) -> list[str]:
+    """
+    Genera miniaturas cuadradas de una foto de perfil en todos los tamaños y formatos.
+    Se vuelven a codificar desde los píxeles, así no se copia ningún metadato (EXIF, GPS...).
+    Lanza ValueError si el archivo no es una imagen válida.
+    """
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELES_FOTO
+    try:
+        with Image.open(ruta_original) as original:
+            # Respetar la orientación de la cámara antes de descartar el EXIF.
+            imagen = ImageOps.exif_transpose(original).convert("RGB")
+    except (OSError, Image.DecompressionBombError):
+        raise ValueError("Error: La imagen no es válida")
+
+    creados = []
+    carpeta = os.path.dirname(ruta_original)
+    for tamano in tamanos:
+        miniatura = ImageOps.fit(imagen, (tamano, tamano), method=Image.Resampling.LANCZOS)
+        for extension, formato in FORMATOS_DERIVADOS.items():
+            nombre = nombre_derivado(os.path.basename(ruta_original), tamano, extension)
+            temporal = os.path.join(carpeta, f".{nombre}.{os.getpid()}.tmp")
+            miniatura.save(temporal, format=formato, quality=82, optimize=True)
+            os.replace(temporal, os.path.join(carpeta, nombre))
+            creados.append(nombre)
+    return creados
@@ -0,0 +1,102 @@
+# utils/respuestas.py
+
+"""
+Respuestas rápidas para los endpoints de listas.
+
+Los servicios devuelven filas de SQLAlchemy Core ya convertidas en diccionarios con
+los campos exactos del esquema de respuesta, así que no hace falta que FastAPI
+vuelva a validar cada elemento con response_model. El cuerpo se escribe una sola
+vez con orjson (fechas, floats y None igual que el JSON de FastAPI).
+
+Con la cabecera Accept: application/msgpack el cuerpo se envía en MessagePack:
+números en binario nativo y polilíneas como bytes sin comillas ni escapes.
+Las fechas se mantienen en texto ISO 8601, igual que en JSON.
+
+El response_model del endpoint se mantiene para la documentación de la API.
+"""
+from datetime import date, datetime
+from typing import Any, Optional
+import msgpack
+import orjson
+from fastapi import Request, Response
+
+FORMATO_JSON = "json"
+FORMATO_MSGPACK = "msgpack"
+
+TIPOS_MSGPACK = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+TIPOS_FORMATO = {FORMATO_JSON: "application/json", FORMATO_MSGPACK: TIPOS_MSGPACK[0]}
+
+# Documentación OpenAPI de los endpoints que también responden en MessagePack.
+DOC_MSGPACK = {200: {"content": {TIPOS_MSGPACK[0]: {}}}}
+
+# Campos de texto que en MessagePack se envían como bytes (UTF-8). Las polilíneas válidas son
+# ASCII, pero se guardan sin comprobarlo y una con otros caracteres no debe romper la respuesta.
+CAMPOS_BINARIOS = ("ruta_polilinea",)
+
+def formato_preferido(request: Request) -> str:
+    """Formato pedido en la cabecera Accept. JSON salvo que MessagePack tenga igual o más prioridad."""
+    aceptados: dict[str, float] = {}
+    for parte in request.headers.get("accept", "").split(","):
+        tipo, *parametros = [p.strip() for p in parte.split(";")]
+        calidad = 1.0
+        for parametro in parametros:
+            if parametro.startswith("q="):
+                try:
+                    calidad = float(parametro[2:])
+                except ValueError:
+                    calidad = 0.0
+        aceptados[tipo.lower()] = calidad
+
+    calidad_msgpack = max((aceptados.get(tipo, 0.0) for tipo in TIPOS_MSGPACK), default=0.0)
+    if calidad_msgpack <= 0:
+        return FORMATO_JSON
+    calidad_json = max(aceptados.get("application/json", 0.0), aceptados.get("*/*", 0.0) * 0.99)
+    return FORMATO_MSGPACK if calidad_msgpack >= calidad_json else FORMATO_JSON
+
+def _por_defecto_msgpack(valor: Any):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+def _campos_binarios(elemento: Any) -> Any:
+    if isinstance(elemento, dict) and any(isinstance(elemento.get(c), str) for c in CAMPOS_BINARIOS):
+        return {
+            clave: valor.encode("utf-8", "surrogatepass") if clave in CAMPOS_BINARIOS and isinstance(valor, str) else valor
+            for clave, valor in elemento.items()
+        }
+    return elemento
+
+def serializar(contenido: Any, formato: str = FORMATO_JSON) -> bytes:
+    """Cuerpo de la respuesta en el formato negociado."""
+    if formato == FORMATO_MSGPACK:
+        if isinstance(contenido, list):
+            contenido = [_campos_binarios(elemento) for elemento in contenido]
+        else:
+            contenido = _campos_binarios(contenido)
+        return msgpack.packb(contenido, default=_por_defecto_msgpack, use_bin_type=True)
+    return orjson.dumps(contenido, option=orjson.OPT_NON_STR_KEYS)
+
+def respuesta_json(cuerpo: bytes, response: Optional[Response] = None) -> Response:
+    """
+    Respuesta con un cuerpo ya serializado. Con 'response' se conservan las cabeceras
+    que han puesto las dependencias (p.ej. el ETag), que FastAPI no copia cuando
+    el endpoint devuelve directamente un Response.
+    """
+    return respuesta_serializada(cuerpo, FORMATO_JSON, response, negociada=False)
+
+def respuesta_serializada(cuerpo: bytes, formato: str, response: Optional[Response] = None,
+                          negociada: bool = True) -> Response:
+    """Respuesta con un cuerpo ya serializado en 'formato'. Si se negoció, varía según Accept."""
+    respuesta = Response(content=cuerpo, media_type=TIPOS_FORMATO[formato])
+    if response is not None:
+        for clave, valor in response.headers.items():
+            if clave != "content-length":
+                respuesta.headers[clave] = valor
+    if negociada:
+        respuesta.headers["vary"] = "Accept"
+    return respuesta
+
+def respuesta_negociada(request: Request, contenido: Any, response: Optional[Response] = None) -> Response:
+    """Serializa en JSON o MessagePack según la cabecera Accept de la petición."""
+    formato = formato_preferido(request)
+    return respuesta_serializada(serializar(contenido, formato), formato, response)
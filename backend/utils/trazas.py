@@ -0,0 +1,232 @@
+# utils/trazas.py
+
+"""
+Trazas de peticiones (tramos con su duración).
+
+Cada petición trazada (middlewares/trazas.py) tiene una traza con un tramo raíz;
+dentro se abren tramos para las funciones de servicio (@trazar), las consultas y
+los commits (registrar_eventos), el almacenamiento y el envío de emails. El tramo
+actual va en una ContextVar, así que el anidamiento se conserva también en los
+hilos del pool de anyio (copian el contexto).
+
+Muestreo:
+    - settings.TRAZAS_MUESTREO: fracción de peticiones que se guardan siempre.
+    - settings.TRAZAS_UMBRAL_LENTA: con un valor > 0 se trazan todas las peticiones
+      y se guardan además las que tardan más (para poder ver por qué fueron lentas).
+Las trazas guardadas van a un búfer circular por worker (endpoint /trazas) y, si
+settings.TRAZAS_ARCHIVO no está vacío, a un archivo JSONL compartido.
+"""
+import json
+import time
+import random
+import uuid
+import inspect
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from config import settings
+from utils import consultas
+
+class Traza:
+    """Tramos de una petición. Se añaden desde el bucle de eventos y desde los hilos."""
+
+    def __init__(self, metodo: str, ruta: str):
+        self.id = uuid.uuid4().hex[:16]
+        self.metodo = metodo
+        self.ruta = ruta
+        self.fecha = datetime.now(timezone.utc)
+        self.inicio = time.perf_counter()
+        self.duracion = 0.0
+        self.estado: Optional[int] = None
+        self.tramos: list[dict] = []
+        self.descartados = 0
+        self.lock = threading.Lock()
+
+    def añadir(self, tramo: dict):
+        with self.lock:
+            if len(self.tramos) >= settings.TRAZAS_MAX_TRAMOS:
+                self.descartados += 1
+                return
+            self.tramos.append(tramo)
+
+    def como_dict(self) -> dict:
+        with self.lock:
+            tramos = sorted(self.tramos, key=lambda tramo: tramo["inicio_ms"])
+        return {
+            "id": self.id,
+            "fecha": self.fecha.isoformat(),
+            "metodo": self.metodo,
+            "ruta": self.ruta,
+            "estado": self.estado,
+            "duracion_ms": round(self.duracion * 1000, 2),
+            "tramos_descartados": self.descartados,
+            "tramos": tramos,
+        }
+
+class Tramo:
+    """Una operación dentro de una traza. Se registra al cerrarse."""
+
+    def __init__(self, traza: Traza, nombre: str, padre: Optional[str], atributos: dict):
+        self.traza = traza
+        self.nombre = nombre
+        self.id = uuid.uuid4().hex[:8]
+        self.padre = padre
+        self.atributos = atributos
+        self.inicio = time.perf_counter()
+
+    def cerrar(self, error: Optional[BaseException] = None):
+        fin = time.perf_counter()
+        tramo = {
+            "id": self.id,
+            "padre": self.padre,
+            "nombre": self.nombre,
+            "inicio_ms": round((self.inicio - self.traza.inicio) * 1000, 2),
+            "duracion_ms": round((fin - self.inicio) * 1000, 2),
+        }
+        if self.atributos:
+            tramo["atributos"] = self.atributos
+        if error is not None:
+            tramo["error"] = type(error).__name__
+        self.traza.añadir(tramo)
+
+_traza: ContextVar[Optional[Traza]] = ContextVar("traza", default=None)
+_tramo: ContextVar[Optional[Tramo]] = ContextVar("tramo", default=None)
+
+def iniciar(metodo: str, ruta: str) -> tuple[Traza, Tramo, tuple]:
+    """Traza nueva con su tramo raíz como tramo actual."""
+    traza = Traza(metodo, ruta)
+    raiz = Tramo(traza, f"{metodo} {ruta}", None, {})
+    return traza, raiz, (_traza.set(traza), _tramo.set(raiz))
+
+def terminar(traza: Traza, raiz: Tramo, tokens: tuple, ruta: str, error: Optional[BaseException] = None):
+    """Cierra la traza. La ruta (plantilla) solo se conoce después del enrutado."""
+    traza.ruta = ruta
+    raiz.nombre = f"{traza.metodo} {ruta}"
+    raiz.cerrar(error)
+    traza.duracion = time.perf_counter() - traza.inicio
+    _tramo.reset(tokens[1])
+    _traza.reset(tokens[0])
+
+def abrir(nombre: str, **atributos: Any) -> Optional[Tramo]:
+    """
+    Tramo hijo del actual que no pasa a ser el actual (operaciones sin tramos dentro,
+    como una consulta). None si la petición no se está trazando.
+    """
+    traza = _traza.get()
+    if traza is None:
+        return None
+    padre = _tramo.get()
+    return Tramo(traza, nombre, padre.id if padre else None, atributos)
+
+@contextmanager
+def tramo(nombre: str, **atributos: Any):
+    """Mide el bloque como un tramo; los tramos abiertos dentro son sus hijos."""
+    actual = abrir(nombre, **atributos)
+    if actual is None:
+        yield None
+        return
+    token = _tramo.set(actual)
+    try:
+        yield actual
+    except BaseException as e:
+        actual.cerrar(e)
+        raise
+    else:
+        actual.cerrar()
+    finally:
+        _tramo.reset(token)
+
+def trazar(nombre: Optional[str] = None):
+    """Decorador: cada llamada a la función (síncrona o async) es un tramo."""
+    def decorador(funcion):
+        etiqueta = nombre or f"{funcion.__module__}.{funcion.__qualname__}"
+
+        if inspect.iscoroutinefunction(funcion):
+            @wraps(funcion)
+            async def envoltura_async(*args, **kwargs):
+                if _traza.get() is None:
+                    return await funcion(*args, **kwargs)
+                with tramo(etiqueta):
+                    return await funcion(*args, **kwargs)
+            return envoltura_async
+
+        @wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if _traza.get() is None:
+                return funcion(*args, **kwargs)
+            with tramo(etiqueta):
+                return funcion(*args, **kwargs)
+        return envoltura
+    return decorador
+
+def registrar_eventos(engine: Engine, sesiones):
+    """Tramos para cada consulta del motor y cada commit de las sesiones."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _antes(conexion, cursor, sentencia, parametros, contexto, executemany):
+        contexto._tramo_traza = abrir("db.consulta", huella=consultas.normalizar(sentencia)[0])
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _despues(conexion, cursor, sentencia, parametros, contexto, executemany):
+        if contexto._tramo_traza is not None:
+            contexto._tramo_traza.cerrar()
+
+    @event.listens_for(engine, "handle_error")
+    def _error(contexto_excepcion):
+        actual = getattr(contexto_excepcion.execution_context, "_tramo_traza", None)
+        if actual is not None:
+            actual.cerrar(contexto_excepcion.original_exception)
+
+    # El commit incluye el flush (INSERT/UPDATE pendientes): sus consultas aparecen dentro de su intervalo.
+    @event.listens_for(sesiones, "before_commit")
+    def _antes_commit(sesion):
+        sesion.info["_tramo_traza"] = abrir("db.commit")
+
+    @event.listens_for(sesiones, "after_commit")
+    def _despues_commit(sesion):
+        actual = sesion.info.pop("_tramo_traza", None)
+        if actual is not None:
+            actual.cerrar()
+
+# Búfer circular de las trazas guardadas de este worker.
+_guardadas: deque = deque(maxlen=max(1, settings.TRAZAS_MAX))
+_lock_archivo = threading.Lock()
+
+def debe_trazar() -> tuple[bool, bool]:
+    """(trazar la petición, guardarla siempre por muestreo)."""
+    muestreada = bool(settings.TRAZAS_MUESTREO) and random.random() < settings.TRAZAS_MUESTREO
+    return muestreada or settings.TRAZAS_UMBRAL_LENTA > 0, muestreada
+
+def conservar(traza: Traza, muestreada: bool) -> Optional[dict]:
+    """Guarda la traza si fue muestreada o lenta y la devuelve como dict (None si se descarta)."""
+    lenta = settings.TRAZAS_UMBRAL_LENTA > 0 and traza.duracion >= settings.TRAZAS_UMBRAL_LENTA
+    if not (muestreada or lenta):
+        return None
+    datos = traza.como_dict()
+    _guardadas.append(datos)
+    return datos
+
+def escribir(ruta: str, datos: dict):
+    """Añade la traza al archivo JSONL (una línea por traza)."""
+    linea = json.dumps(datos, ensure_ascii=False, default=str) + "\n"
+    with _lock_archivo, open(ruta, "a", encoding="utf-8") as archivo:
+        archivo.write(linea)
+
+def recientes(ruta: Optional[str] = None, min_ms: float = 0, limite: int = 20) -> list[dict]:
+    """Trazas guardadas en este worker, de la más reciente a la más antigua."""
+    resultado = []
+    for datos in reversed(list(_guardadas)):
+        if ruta is not None and datos["ruta"] != ruta:
+            continue
+        if datos["duracion_ms"] < min_ms:
+            continue
+        resultado.append(datos)
+        if len(resultado) >= limite:
+            break
+    return resultado